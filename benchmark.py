@@ -0,0 +1,475 @@
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image, ImageChops, ExifTags
+import PIL
+from engine import (ImageConverter, ConversionOptions, convert_file, read_source, render_image, iter_convert_images,
+                    get_exif_orientation, get_oriented_size, get_optimal_resolutions, resize_oriented, resize_image,
+                    resolve_workers)
+from encoders import ORIENTATION_TAG
+from metrics import peak_rss_mb
+
+
+BASELINE_VERSION = 1
+CORPUS_SIZES = ((6000, 4000), (4000, 3000), (3000, 2000), (1920, 1280), (1024, 768))
+CORPUS_MODES = ('RGB', 'RGB', 'CMYK', 'L')
+CORPUS_SPEC_FILE = 'corpus.json'
+SINGLE_STAGES = ('open', 'orientation', 'resize', 'encode')
+# Entry points whose import cost a fresh process pays before doing any work.
+STARTUP_MODULES = ('engine', 'cli', 'gui')
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_synthetic_jpeg(path, size, mode='RGB', quality=90, orientation=1, seed=0):
+    width, height = size
+    # Gradients plus noise compress and decode roughly like a real photo, unlike a flat colour.
+    # The noise comes from a seeded generator so a corpus is identical on every machine.
+    rng = random.Random(seed)
+    noise_size = (max(1, width // 4), max(1, height // 4))
+    red = Image.linear_gradient('L').resize(size)
+    green = Image.frombytes('L', noise_size, rng.randbytes(noise_size[0] * noise_size[1])).resize(size)
+    blue = Image.linear_gradient('L').rotate(90).resize(size)
+    img = Image.merge('RGB', (red, green, blue))
+    if mode != 'RGB':
+        img = img.convert(mode)
+    exif = Image.Exif()
+    exif[ORIENTATION_TAG] = orientation
+    img.save(path, 'JPEG', quality=quality, exif=exif.tobytes())
+    return path
+
+
+def _run_child(queue, func, args):
+    try:
+        queue.put(func(*args))
+    except Exception as e:
+        queue.put({'error': str(e)})
+
+
+def run_isolated(func, *args):
+    # A fresh interpreter per case keeps one case's peak RSS from leaking into the next.
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    process = context.Process(target=_run_child, args=(queue, func, args))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def make_corpus(directory, count=24, seed=0):
+    # Mixed resolutions, all eight EXIF orientations and CMYK/grayscale sources, chosen from the
+    # seed. An existing corpus with the same spec is reused.
+    spec = {'count': count, 'seed': seed, 'sizes': [list(size) for size in CORPUS_SIZES], 'modes': list(CORPUS_MODES)}
+    spec_path = os.path.join(directory, CORPUS_SPEC_FILE)
+    try:
+        with open(spec_path) as file:
+            if json.load(file) == spec:
+                return spec
+    except (OSError, ValueError):
+        pass
+    os.makedirs(directory, exist_ok=True)
+    rng = random.Random(seed)
+    for index in range(count):
+        size = CORPUS_SIZES[index % len(CORPUS_SIZES)]
+        mode = rng.choice(CORPUS_MODES)
+        orientation = index % 8 + 1
+        name = f'{index:03d}-{size[0]}x{size[1]}-{mode}-o{orientation}.jpg'
+        make_synthetic_jpeg(os.path.join(directory, name), size, mode, orientation=orientation, seed=seed + index)
+    with open(spec_path, 'w') as file:
+        json.dump(spec, file)
+    return spec
+
+
+def corpus_files(directory):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.jpg'))
+
+
+def time_convert(input_path, output_base, options, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = convert_file(input_path, output_base, options)
+        timings.append(time.perf_counter() - start)
+        if result['status'] != 'converted':
+            return {'error': result.get('error')}
+    return {
+        'median_s': statistics.median(timings),
+        'min_s': min(timings),
+        'peak_rss_mb': peak_rss_mb(),
+        'output_bytes': result['new_size'],
+    }
+
+
+def bench_draft(args):
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for width, height in args.sizes:
+            # Generated out of process: Linux carries the parent's peak RSS over into spawned children.
+            input_path = run_isolated(make_synthetic_jpeg, os.path.join(tmp, f'{width}x{height}.jpg'), (width, height))
+            output_base = os.path.join(tmp, 'out')
+            for draft in (False, True):
+                case = run_isolated(time_convert, input_path, output_base, ConversionOptions(draft=draft), args.repeat)
+                case.update({'size': f'{width}x{height}', 'draft': draft})
+                results.append(case)
+    return results
+
+
+def time_single(input_path, repeat):
+    # The per-image path without the pipeline around it: decode, orientation, target size plus
+    # resize, and WEBP encode, each as the median over the repeats.
+    options = ConversionOptions()
+    source = read_source(input_path, options)
+    runs = []
+    for _ in range(repeat):
+        result = render_image(source, input_path, os.devnull, options)
+        if result['status'] != 'converted':
+            return {'error': result.get('error')}
+        runs.append(result['timings'])
+    case = {stage: statistics.median(run.get(stage, 0.0) for run in runs) for stage in SINGLE_STAGES}
+    case['total_s'] = statistics.median(run['compute'] for run in runs)
+    case['peak_rss_mb'] = peak_rss_mb()
+    return case
+
+
+def bench_single(args):
+    # Generated out of process: Linux carries the parent's peak RSS over into spawned children.
+    run_isolated(make_corpus, args.corpus, args.count, args.seed)
+    results = []
+    for path in corpus_files(args.corpus):
+        case = run_isolated(time_single, path, args.repeat)
+        case['case'] = os.path.splitext(os.path.basename(path))[0]
+        results.append(case)
+    return results
+
+
+def time_batch(input_dir, output_dir, workers):
+    converter = ImageConverter({})
+    options = ConversionOptions(workers=workers, manifest_path=False)
+    converter.is_converting.set()
+    for _ in iter_convert_images(converter, input_dir, output_dir, options):
+        pass
+    metrics = converter.metrics.summary()
+    # Workers report their own peaks; the parent holds the read-ahead buffers and encoded outputs.
+    peaks = [rss for rss in (metrics['peak_rss_mb'], peak_rss_mb()) if rss is not None]
+    return {
+        'files': metrics['files'].get('converted', 0),
+        'wall_s': metrics['wall_s'],
+        'files_per_s': metrics['files_per_s'],
+        'mb_in_per_s': metrics['mb_in_per_s'],
+        'p90_s': metrics['latency_s'].get('total', {}).get('p90'),
+        'peak_rss_mb': max(peaks) if peaks else None,
+        'bottleneck': metrics['bottleneck'],
+    }
+
+
+def bench_batch(args):
+    run_isolated(make_corpus, args.corpus, args.count, args.seed)
+    results = []
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as output_dir:
+            case = run_isolated(time_batch, args.corpus, output_dir, workers)
+        case['workers'] = workers
+        results.append(case)
+    return results
+
+
+def time_interpreter(code, repeat):
+    # Median wall time of a fresh interpreter running code; None if it fails (e.g. no Tk).
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        completed = subprocess.run([sys.executable, '-c', code], cwd=REPO_DIR, capture_output=True)
+        if completed.returncode != 0:
+            return None
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def time_pool_startup(method, workers, repeat):
+    # From creating a process pool until every worker has imported the engine and answered once.
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method)) as pool:
+            list(pool.map(resolve_workers, [1] * workers))
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def bench_startup(args):
+    interpreter = time_interpreter('pass', args.repeat)
+    imports = {}
+    for module in STARTUP_MODULES:
+        elapsed = time_interpreter(f'import {module}', args.repeat)
+        imports[module] = round((elapsed - interpreter) * 1000, 1) if elapsed is not None else None
+    pools = {method: round(time_pool_startup(method, args.workers, args.repeat) * 1000, 1)
+             for method in multiprocessing.get_all_start_methods()}
+    return {
+        'environment': environment(),
+        'interpreter_ms': round(interpreter * 1000, 1),
+        'import_ms': imports,
+        'workers': args.workers,
+        'pool_ms': pools,
+    }
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def bench_suite(args):
+    return {
+        'version': BASELINE_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': environment(),
+        'corpus': {'count': args.count, 'seed': args.seed},
+        'single': bench_single(args),
+        'batch': bench_batch(args),
+    }
+
+
+def _comparable(results):
+    # Flattens a suite into {metric name: (value, higher_is_better)}.
+    metrics = {}
+    for case in results.get('single', []):
+        if 'error' not in case:
+            metrics[f"single/{case['case']}/total_s"] = (case['total_s'], False)
+    for case in results.get('batch', []):
+        metrics[f"batch/workers={case['workers']}/files_per_s"] = (case['files_per_s'], True)
+        if case.get('peak_rss_mb') is not None:
+            metrics[f"batch/workers={case['workers']}/peak_rss_mb"] = (case['peak_rss_mb'], False)
+    return metrics
+
+
+def compare_results(baseline, current, tolerance):
+    old = _comparable(baseline)
+    rows = []
+    for name, (value, higher_is_better) in _comparable(current).items():
+        if name not in old or not old[name][0]:
+            continue
+        change = value / old[name][0] - 1
+        worse = -change if higher_is_better else change
+        rows.append({'metric': name, 'baseline': old[name][0], 'current': value, 'change': change,
+                     'regression': worse > tolerance})
+    return rows
+
+
+def print_comparison(rows, tolerance):
+    for row in rows:
+        flag = 'REGRESSION' if row['regression'] else ''
+        print(f"{row['metric']:<48} {row['baseline']:10.4g} -> {row['current']:10.4g} {row['change']:+7.1%} {flag}")
+    regressions = sum(row['regression'] for row in rows)
+    print(f"{regressions} of {len(rows)} metrics worse than the baseline by more than {tolerance:.0%}.")
+
+
+def print_suite(results):
+    env = results['environment']
+    print(f"Python {env['python']}, Pillow {env['pillow']}, {env['cpu_count']} CPUs, {env['platform']}")
+    print_single(results['single'])
+    print_batch(results['batch'])
+
+
+def print_single(results):
+    for case in results:
+        if 'error' in case:
+            print(f"{case['case']:<32} error: {case['error']}")
+            continue
+        stages = '  '.join(f"{stage} {case[stage] * 1000:7.1f}" for stage in SINGLE_STAGES)
+        print(f"{case['case']:<32} {stages}  total {case['total_s'] * 1000:7.1f} ms")
+
+
+def print_batch(results):
+    for case in results:
+        if 'error' in case:
+            print(f"workers={case['workers']:<3} error: {case['error']}")
+            continue
+        rss = f"{case['peak_rss_mb']:.0f} MB" if case['peak_rss_mb'] is not None else 'n/a'
+        print(f"workers={case['workers']:<3} {case['files']} files in {case['wall_s']:7.2f} s  "
+              f"{case['files_per_s']:6.2f} files/s  {case['mb_in_per_s']:6.1f} MB/s  peak RSS {rss:>8}  "
+              f"bottleneck {case['bottleneck']}")
+
+
+def print_startup(results):
+    print(f"Bare interpreter: {results['interpreter_ms']:.1f} ms")
+    for module, elapsed in results['import_ms'].items():
+        print(f"import {module:<10} " + (f"{elapsed:7.1f} ms" if elapsed is not None else "    n/a (import failed)"))
+    for method, elapsed in results['pool_ms'].items():
+        print(f"{results['workers']} workers via {method:<11} ready in {elapsed:7.1f} ms")
+
+
+def legacy_orientation_lookup(img):
+    for orientation in ExifTags.TAGS.keys():
+        if ExifTags.TAGS[orientation] == 'Orientation':
+            break
+    exif_data = img._getexif()
+    if exif_data is not None and orientation in exif_data:
+        return exif_data[orientation]
+    return None
+
+
+def legacy_correct_orientation(img):
+    # The original implementation, kept here as the baseline for the orientation benchmark.
+    orientation_value = legacy_orientation_lookup(img)
+    if orientation_value is not None:
+        if orientation_value == 2:
+            img = img.transpose(Image.FLIP_LEFT_RIGHT)
+        elif orientation_value == 3:
+            img = img.rotate(180)
+        elif orientation_value == 4:
+            img = img.rotate(180).transpose(Image.FLIP_LEFT_RIGHT)
+        elif orientation_value == 5:
+            img = img.rotate(-90, expand=True).transpose(Image.FLIP_LEFT_RIGHT)
+        elif orientation_value == 6:
+            img = img.rotate(-90, expand=True)
+        elif orientation_value == 7:
+            img = img.rotate(90, expand=True).transpose(Image.FLIP_LEFT_RIGHT)
+        elif orientation_value == 8:
+            img = img.rotate(90, expand=True)
+    return img
+
+
+def _best_of(repeat, func):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), value
+
+
+def bench_orientation(args):
+    results = []
+    options = ConversionOptions(draft=False)
+    with tempfile.TemporaryDirectory() as tmp:
+        for orientation in range(1, 9):
+            path = make_synthetic_jpeg(os.path.join(tmp, f'{orientation}.jpg'), args.size, orientation=orientation)
+            with Image.open(path) as img:
+                img.load()
+                target = get_optimal_resolutions(get_oriented_size(img))[0]
+                lookup_legacy, _ = _best_of(args.repeat, lambda: legacy_orientation_lookup(img))
+                lookup_header, _ = _best_of(args.repeat, lambda: get_exif_orientation(img))
+                legacy_s, legacy = _best_of(args.repeat, lambda: resize_image(legacy_correct_orientation(img),
+                                                                               target, options))
+                current_s, current = _best_of(args.repeat, lambda: resize_oriented(img, target,
+                                                                                   get_exif_orientation(img), options))
+            # Both paths must produce the same picture; resampling order only adds rounding noise.
+            difference = max(high for _, high in ImageChops.difference(legacy, current).getextrema())
+            results.append({
+                'orientation': orientation,
+                'legacy_orient_s': lookup_legacy,
+                'header_lookup_s': lookup_header,
+                'legacy_s': legacy_s,
+                'current_s': current_s,
+                'max_pixel_difference': difference,
+            })
+    return results
+
+
+def print_orientation_table(results):
+    for case in results:
+        print(f"orientation {case['orientation']}: rotate-then-resize {case['legacy_s'] * 1000:7.1f} ms, "
+              f"resize-then-transpose {case['current_s'] * 1000:7.1f} ms, "
+              f"lookup {case['legacy_orient_s'] * 1e6:9.1f} us -> {case['header_lookup_s'] * 1e6:6.1f} us, "
+              f"max pixel difference {case['max_pixel_difference']}")
+
+
+def print_table(results):
+    for case in results:
+        if 'error' in case:
+            print(f"{case['size']:>11} draft={case['draft']!s:<5} error: {case['error']}")
+            continue
+        rss = f"{case['peak_rss_mb']:.0f} MB" if case['peak_rss_mb'] is not None else 'n/a'
+        print(f"{case['size']:>11} draft={case['draft']!s:<5} median {case['median_s'] * 1000:8.1f} ms"
+              f"  peak RSS {rss:>8}  output {case['output_bytes']} bytes")
+
+
+def parse_size(value):
+    width, height = value.lower().split('x')
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks for the conversion hot path.")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    draft = subparsers.add_parser('draft', help="Compare full decoding with reduced-scale JPEG decoding.")
+    draft.add_argument('--sizes', type=parse_size, nargs='+', default=[(3000, 2000), (6000, 4000)],
+                       help="Synthetic source sizes, e.g. 6000x4000.")
+    draft.add_argument('--repeat', type=int, default=3)
+    draft.add_argument('--json', action='store_true', help="Print results as JSON.")
+    draft.set_defaults(func=bench_draft, print_results=print_table)
+
+    orientation = subparsers.add_parser('orientation', help="Time EXIF orientation handling for all eight values.")
+    orientation.add_argument('--size', type=parse_size, default=(4000, 3000), help="Synthetic source size.")
+    orientation.add_argument('--repeat', type=int, default=3)
+    orientation.add_argument('--json', action='store_true', help="Print results as JSON.")
+    orientation.set_defaults(func=bench_orientation, print_results=print_orientation_table)
+
+    def add_corpus_arguments(subparser):
+        subparser.add_argument('--corpus', default=os.path.join(tempfile.gettempdir(), 'img_convert_bench_corpus'),
+                               help="Directory for the synthetic corpus; reused when it matches --count and --seed.")
+        subparser.add_argument('--count', type=int, default=24, help="Number of images in the corpus.")
+        subparser.add_argument('--seed', type=int, default=0, help="Seed for the corpus contents.")
+        subparser.add_argument('--json', action='store_true', help="Print results as JSON.")
+
+    single = subparsers.add_parser('single', help="Time each step of the single-image path over the corpus.")
+    add_corpus_arguments(single)
+    single.add_argument('--repeat', type=int, default=3)
+    single.set_defaults(func=bench_single, print_results=print_single)
+
+    batch = subparsers.add_parser('batch', help="Measure whole-corpus throughput at several worker counts.")
+    add_corpus_arguments(batch)
+    batch.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    batch.set_defaults(func=bench_batch, print_results=print_batch)
+
+    suite = subparsers.add_parser('suite', help="Run single and batch, save a baseline and compare with an older one.")
+    add_corpus_arguments(suite)
+    suite.add_argument('--repeat', type=int, default=3)
+    suite.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    suite.add_argument('--save', metavar='PATH', help="Write the results to this baseline file.")
+    suite.add_argument('--compare', metavar='PATH', help="Compare the results with this baseline file.")
+    suite.add_argument('--tolerance', type=float, default=0.10,
+                       help="Relative slowdown reported as a regression (default: 0.10).")
+    suite.set_defaults(func=bench_suite, print_results=print_suite)
+
+    startup = subparsers.add_parser('startup', help="Time module imports and worker process startup.")
+    startup.add_argument('--repeat', type=int, default=5)
+    startup.add_argument('--workers', type=int, default=2, help="Size of the process pool to start.")
+    startup.add_argument('--json', action='store_true', help="Print results as JSON.")
+    startup.set_defaults(func=bench_startup, print_results=print_startup)
+
+    args = parser.parse_args(argv)
+    results = args.func(args)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        args.print_results(results)
+    if getattr(args, 'save', None):
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=2)
+    if getattr(args, 'compare', None):
+        with open(args.compare) as file:
+            rows = compare_results(json.load(file), results, args.tolerance)
+        print_comparison(rows, args.tolerance)
+        if any(row['regression'] for row in rows):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
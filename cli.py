@@ -0,0 +1,412 @@
+import sys
+import json
+import time
+import signal
+import argparse
+import logging
+from engine import (ImageConverter, ConversionOptions, iter_convert_images, format_result,
+                    get_last_selected_dirs, save_config, ENCODER_CONFIG_KEYS, LARGE_IMAGE_PIXELS)
+from metrics import TraceWriter
+from dedup import DEDUP_MODES, NEAR_DUPLICATE_DISTANCE
+
+PROMETHEUS_INTERVAL = 10.0  # seconds between snapshot rewrites during a run
+BYTE_UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+# store_true encoder flags: False only means the flag was not given.
+ENCODER_FLAGS = ('lossless', 'keep_metadata')
+
+
+def parse_bytes(value):
+    # '512M', '4G', '1.5G' or a plain number of bytes.
+    text = value.strip().upper().rstrip('B')
+    unit = text[-1] if text and text[-1] in BYTE_UNITS else ''
+    try:
+        return int(float(text[:len(text) - len(unit)]) * BYTE_UNITS[unit])
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size: {value!r}")
+
+
+def or_default(value, default):
+    # For options whose default lives in a module that is only imported when the subcommand runs.
+    return default if value is None else value
+
+
+def emit(event, args, **fields):
+    if args.json:
+        print(json.dumps({'event': event, **fields}), flush=True)
+    elif 'message' in fields:
+        print(fields['message'], flush=True)
+
+
+def build_options(args, converter):
+    # Encoder settings come from config.json unless given on the command line.
+    encoder = dict(converter.encoder_config)
+    for key in ENCODER_CONFIG_KEYS:
+        value = getattr(args, key, None)
+        # Not "in (None, False)": 0 == False, and --quality 0 or --method 0 are real settings.
+        if value is None or (key in ENCODER_FLAGS and not value):
+            continue
+        encoder[key] = value
+    options = ConversionOptions(width=args.width, height=args.height, workers=args.workers,
+                                max_in_flight=args.max_in_flight, read_ahead=args.read_ahead,
+                                io_threads=args.io_threads, write_queue=args.write_queue,
+                                memory_budget=args.memory_budget, large_image_pixels=args.large_image_pixels,
+                                dedup=args.dedup, near_duplicates=bool(args.near_duplicates),
+                                near_duplicate_distance=args.near_duplicate_distance,
+                                draft=not args.no_draft,
+                                incremental=not args.force, verify_hash=args.verify_hash, resume=args.resume,
+                                manifest_path=False if args.no_manifest else args.manifest,
+                                recursive=not args.no_recursive, mirror=not args.flat, extensions=args.ext,
+                                include=args.include, exclude=args.exclude, **encoder)
+    return options
+
+
+def make_converter():
+    _, _, config = get_last_selected_dirs()
+    converter = ImageConverter(config)
+    converter.setup_logging()
+
+    # Ctrl+C / SIGTERM finish the current file and stop cleanly.
+    def on_signal(signum, frame):
+        converter.stop_event.set()
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+    return converter
+
+
+def run_convert(args):
+    converter = make_converter()
+    options = build_options(args, converter)
+
+    trace = TraceWriter(args.metrics_jsonl) if args.metrics_jsonl else None
+    last_snapshot = time.monotonic()
+    converted = skipped = unchanged = duplicates = errors = 0
+    converter.is_converting.set()
+    try:
+        for processed_files, total_files, result in iter_convert_images(converter, args.input_dir, args.output_dir, options):
+            if trace is not None:
+                trace.file_record(result)
+            if args.metrics_prom and time.monotonic() - last_snapshot >= PROMETHEUS_INTERVAL:
+                converter.metrics.write_prometheus(args.metrics_prom)
+                last_snapshot = time.monotonic()
+            if result['status'] == 'converted':
+                converted += 1
+            elif result['status'] == 'skipped':
+                skipped += 1
+            elif result['status'] == 'unchanged':
+                unchanged += 1
+            elif result['status'] == 'duplicate':
+                duplicates += 1
+            else:
+                errors += 1
+            emit('file', args, processed=processed_files, total=total_files,
+                 message=format_result(result), **result)
+    finally:
+        converter.is_converting.clear()
+        if not args.no_stats:
+            save_config(converter.stats.get_stats())
+
+    stopped = converter.stop_event.is_set()
+    metrics = converter.metrics.summary() if converter.metrics else None
+    if metrics is not None:
+        if trace is not None:
+            trace.summary(metrics)
+        if args.metrics_prom:
+            converter.metrics.write_prometheus(args.metrics_prom)
+    if trace is not None:
+        trace.close()
+    near_duplicates = None
+    if args.near_duplicates and converter.near_duplicates is not None:
+        report = converter.near_duplicates.report()
+        with open(args.near_duplicates, 'w') as file:
+            json.dump(report, file, indent=2)
+        near_duplicates = len(report['groups'])
+    emit('summary', args, converted=converted, skipped=skipped, unchanged=unchanged, duplicates=duplicates,
+         errors=errors, stopped=stopped, near_duplicate_groups=near_duplicates, metrics=metrics,
+         message=f"{converted} converted, {duplicates} duplicates reused, {unchanged} up to date, "
+                 f"{skipped} skipped, {errors} errors" + (" (stopped)" if stopped else ""))
+    if near_duplicates is not None and not args.json:
+        print(f"{near_duplicates} groups of near-duplicate images written to {args.near_duplicates}")
+    if metrics and metrics['bottleneck'] and not args.json:
+        print_metrics(metrics)
+    return 1 if errors else 0
+
+
+def run_watch(args):
+    # The watcher (and watchdog) and the planner are imported by their subcommands only, so
+    # convert runs and worker processes re-importing this module never load them.
+    from watcher import FolderWatcher, SETTLE_TIME, LATENCY_TARGET, BATCH_SIZE, POLL_INTERVAL
+    converter = make_converter()
+    options = build_options(args, converter)
+    trace = TraceWriter(args.metrics_jsonl) if args.metrics_jsonl else None
+    counts = {}
+    last_snapshot = time.monotonic()
+
+    def on_result(result):
+        nonlocal last_snapshot
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+        if trace is not None:
+            trace.file_record(result)
+        emit('file', args, message=format_result(result), **result)
+        if args.metrics_prom and time.monotonic() - last_snapshot >= PROMETHEUS_INTERVAL:
+            watcher.metrics.write_prometheus(args.metrics_prom)
+            last_snapshot = time.monotonic()
+
+    def save_stats():
+        # Once per batch, not per file.
+        if not args.no_stats:
+            save_config(converter.stats.get_stats())
+
+    watcher = FolderWatcher(converter, args.input_dir, args.output_dir, options,
+                            settle_time=or_default(args.settle, SETTLE_TIME),
+                            latency=or_default(args.latency, LATENCY_TARGET),
+                            batch_size=or_default(args.batch_size, BATCH_SIZE),
+                            poll_interval=or_default(args.poll_interval, POLL_INTERVAL),
+                            use_polling=args.polling, on_result=on_result, on_batch=save_stats)
+    emit('watching', args, input_dir=args.input_dir, polling=watcher.use_polling,
+         message=f"Watching {args.input_dir} ({'polling' if watcher.use_polling else 'file system events'}); "
+                 f"press Ctrl+C to stop.")
+    converter.is_converting.set()
+    try:
+        watcher.run()
+    finally:
+        converter.is_converting.clear()
+        save_stats()
+        if trace is not None:
+            trace.summary(watcher.metrics.summary())
+            trace.close()
+        if args.metrics_prom:
+            watcher.metrics.write_prometheus(args.metrics_prom)
+
+    latency = watcher.latency_summary()
+    emit('summary', args, files=counts, latency=latency, metrics=watcher.metrics.summary(),
+         message=f"Stopped after converting {counts.get('converted', 0)} files; "
+                 + (f"latency p50 {latency['p50_s']}s, p90 {latency['p90_s']}s, "
+                    f"{latency['over_target']} over the {latency['target_s']}s target."
+                    if latency['files'] else "no new files arrived."))
+    return 1 if counts.get('error') else 0
+
+
+def run_serve(args):
+    # asyncio and the service are only needed here; other subcommands, and worker processes
+    # re-importing this module, start faster without them.
+    import asyncio
+    from service import JobService, serve, DEFAULT_PORT
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    async def main():
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, stop_event.set)
+            except NotImplementedError:  # Windows
+                signal.signal(signum, lambda *_: loop.call_soon_threadsafe(stop_event.set))
+        service = JobService(workers=args.workers, max_jobs=args.max_jobs, max_uploads=args.max_uploads,
+                             allowed_root=args.root)
+
+        def on_ready(server):
+            where = args.unix or ', '.join(str(sock.getsockname()) for sock in server.sockets)
+            logging.info(f"Serving conversion jobs on {where}")
+
+        await serve(service, args.host, args.port or DEFAULT_PORT, args.unix, stop_event, on_ready)
+
+    asyncio.run(main())
+    return 0
+
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(size) < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def run_plan(args):
+    from planner import plan_conversion, SAMPLE_SIZE
+    converter = make_converter()
+    options = build_options(args, converter)
+
+    def on_progress(scanned):
+        if not args.json and scanned % 10000 < 256:
+            print(f"Read {scanned} headers...", flush=True)
+
+    plan = plan_conversion(args.input_dir, args.output_dir, options, sample_size=or_default(args.sample, SAMPLE_SIZE),
+                           seed=args.seed, worker_counts=args.plan_workers, stop_event=converter.stop_event,
+                           on_progress=on_progress)
+    emit('plan', args, **plan,
+         message=f"{plan['files']} files: {plan['convert']} to convert, {plan['unchanged']} up to date, "
+                 f"{plan['unreadable']} unreadable" + (" (stopped early)" if plan['stopped'] else ""))
+    projection = plan['projection']
+    if args.json:
+        return 0
+    if projection is None:
+        print("Nothing could be sampled, so there is no projection.")
+        return 0
+    error = projection['output_bytes_stderr']
+    print(f"Input {format_bytes(plan['input_bytes'])} -> projected output {format_bytes(projection['output_bytes'])}"
+          + (f" (+/- {format_bytes(2 * error)})" if error is not None else "")
+          + f", saving {format_bytes(projection['saved_bytes'])} ({projection['saved_percent']}%)")
+    print(f"Based on {plan['sample']['files']} sampled files converted in {plan['sample']['seconds']}s; "
+          f"headers read in {plan['scan_s']}s.")
+    for estimate in projection['time']:
+        print(f"  {estimate['workers']:>3} workers: {format_duration(estimate['wall_s']):>10}  "
+              f"(bound by {estimate['bottleneck']})")
+    return 0
+
+
+def print_metrics(metrics):
+    print(f"Throughput: {metrics['files_per_s']:.2f} files/s, {metrics['mb_in_per_s']:.1f} MB/s in, "
+          f"{metrics['mb_out_per_s']:.1f} MB/s out over {metrics['wall_s']:.1f}s"
+          + (f"; peak RSS {metrics['peak_rss_mb']:.0f} MB" if metrics['peak_rss_mb'] is not None else ""))
+    for stage, latency in metrics['latency_s'].items():
+        print(f"  {stage:<12} p50 {latency['p50'] * 1000:8.1f} ms  p90 {latency['p90'] * 1000:8.1f} ms  "
+              f"p99 {latency['p99'] * 1000:8.1f} ms")
+    stages = ', '.join(f"{stage} {info['utilization']:.0%} of {info['threads']}"
+                       for stage, info in metrics['stages'].items())
+    print(f"Stage utilization: {stages}; bottleneck: {metrics['bottleneck']}")
+
+
+def add_conversion_arguments(parser):
+    parser.add_argument('input_dir')
+    parser.add_argument('output_dir')
+    parser.add_argument('--width', type=int, help="Custom output width (requires --height).")
+    parser.add_argument('--height', type=int, help="Custom output height (requires --width).")
+    parser.add_argument('--widths', type=int, nargs='+', metavar='WIDTH',
+                         help="Write one rendition per width (e.g. --widths 1920 1440 1280) from a single decode.")
+    parser.add_argument('--formats', nargs='+', metavar='FORMAT',
+                         help="Output formats: webp (default), avif, jpeg (progressive), png, or png-alpha "
+                              "(PNG only for images with transparency). Unavailable formats are skipped.")
+    parser.add_argument('--quality', type=int, help="Encoder quality 0-100 for lossy formats.")
+    parser.add_argument('--method', type=int, help="WEBP compression effort 0-6 (slower is smaller).")
+    parser.add_argument('--lossless', action='store_true', help="Write lossless WEBP.")
+    parser.add_argument('--keep-metadata', action='store_true', help="Copy EXIF and ICC profile into the outputs.")
+    search = parser.add_mutually_exclusive_group()
+    search.add_argument('--target-bytes', type=int,
+                        help="Search each image for the highest quality whose output fits in this many bytes.")
+    search.add_argument('--min-ssim', type=float,
+                        help="Search each image for the lowest quality reaching this SSIM (0-1).")
+    search.add_argument('--min-psnr', type=float,
+                        help="Search each image for the lowest quality reaching this PSNR in dB.")
+    parser.add_argument('--max-encodes', type=int,
+                         help="Maximum encodes per output during the quality search (default: 6).")
+    parser.add_argument('--no-recursive', action='store_true', help="Only convert files directly inside input_dir.")
+    parser.add_argument('--flat', action='store_true',
+                         help="Write every output straight into output_dir instead of mirroring subdirectories.")
+    parser.add_argument('--ext', action='append',
+                         help="File extension to convert (repeatable, case-insensitive; default: .jpg and .jpeg).")
+    parser.add_argument('--include', action='append', metavar='GLOB',
+                         help="Only convert files whose relative path or name matches (repeatable).")
+    parser.add_argument('--exclude', action='append', metavar='GLOB',
+                         help="Skip files and directories whose relative path or name matches (repeatable).")
+    parser.add_argument('--workers', type=int, default=1,
+                         help="Number of worker processes (0 uses every CPU).")
+    parser.add_argument('--max-in-flight', type=int,
+                         help="Maximum number of files queued for the workers at once (default: 2 per worker).")
+    parser.add_argument('--read-ahead', type=int,
+                         help="Number of input files read into memory ahead of the workers (default: 2x max-in-flight).")
+    parser.add_argument('--io-threads', type=int, default=4, help="Threads reading input files (default: 4).")
+    parser.add_argument('--write-queue', type=int,
+                         help="Maximum number of encoded files waiting to be written (default: max-in-flight).")
+    parser.add_argument('--memory-budget', type=parse_bytes, metavar='SIZE',
+                         help="Estimated memory all running conversions may use together, e.g. 4G. Large images "
+                              "wait until enough is free; one that exceeds the budget runs alone.")
+    parser.add_argument('--large-image-pixels', type=int, default=LARGE_IMAGE_PIXELS, metavar='PIXELS',
+                         help="Downscale images with more pixels than this in strips to bound memory "
+                              "(default: %(default)s; 0 disables).")
+    parser.add_argument('--dedup', choices=DEDUP_MODES,
+                         help="Encode byte-identical inputs once and hard-link (falling back to copying) or copy "
+                              "the outputs for the other copies.")
+    parser.add_argument('--near-duplicates', metavar='PATH',
+                         help="Hash every converted image perceptually and write groups of near-duplicates to "
+                              "this JSON file.")
+    parser.add_argument('--near-duplicate-distance', type=int, default=NEAR_DUPLICATE_DISTANCE, metavar='BITS',
+                         help="Maximum perceptual hash difference, out of 64 bits, for a near-duplicate "
+                              "(default: %(default)s).")
+    parser.add_argument('--no-draft', action='store_true',
+                         help="Always decode at full resolution instead of using reduced-scale JPEG decoding.")
+    parser.add_argument('--force', action='store_true',
+                         help="Reconvert every file, even if the manifest says it is up to date.")
+    parser.add_argument('--resume', action='store_true',
+                         help="Continue an interrupted run: skip files already recorded in the manifest, even with --force.")
+    parser.add_argument('--manifest', help="Manifest database path (default: inside the output directory).")
+    parser.add_argument('--no-manifest', action='store_true', help="Do not read or write a manifest.")
+    parser.add_argument('--verify-hash', action='store_true',
+                         help="Hash inputs so touched but unchanged files are still skipped.")
+    parser.add_argument('--json', action='store_true', help="Print progress as JSON lines.")
+    parser.add_argument('--metrics-jsonl', metavar='PATH',
+                         help="Append per-file stage timings and the run summary to this JSON lines file.")
+    parser.add_argument('--metrics-prom', metavar='PATH',
+                         help="Keep a Prometheus text-format snapshot of the run metrics in this file.")
+    parser.add_argument('--no-stats', action='store_true', help="Do not update the totals in config.json.")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Convert and resize images to WEBP without the GUI.")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    convert = subparsers.add_parser('convert', help="Convert a directory of images.")
+    add_conversion_arguments(convert)
+    convert.set_defaults(func=run_convert)
+
+    watch = subparsers.add_parser('watch', help="Keep converting new images as they appear, until stopped.")
+    add_conversion_arguments(watch)
+    watch.add_argument('--settle', type=float, metavar='SECONDS',
+                       help="How long a file must stay unchanged before it is converted (default: 2.0).")
+    watch.add_argument('--latency', type=float, metavar='SECONDS',
+                       help="Target time from a file appearing to its outputs being written (default: 5.0).")
+    watch.add_argument('--batch-size', type=int,
+                       help="Most files handed to the workers at once (default: 64).")
+    watch.add_argument('--poll-interval', type=float, metavar='SECONDS',
+                       help="Seconds between directory checks when polling (default: 1.0).")
+    watch.add_argument('--polling', action='store_true',
+                       help="Poll for changes even when the watchdog package is installed.")
+    watch.set_defaults(func=run_watch)
+
+    plan = subparsers.add_parser('plan', help="Estimate output size, savings and run time without converting.")
+    add_conversion_arguments(plan)
+    plan.add_argument('--sample', type=int,
+                      help="Files actually converted to calibrate the estimate (default: 24).")
+    plan.add_argument('--seed', type=int, default=0, help="Seed for choosing the sample (default: %(default)s).")
+    plan.add_argument('--plan-workers', type=int, nargs='+', metavar='N',
+                      help="Worker counts to estimate run time for (default: 1, --workers and powers of two "
+                           "up to the CPU count).")
+    plan.set_defaults(func=run_plan)
+
+    serve = subparsers.add_parser('serve', help="Accept conversion jobs over a local HTTP API.")
+    serve.add_argument('--host', default='127.0.0.1', help="Address to listen on (default: %(default)s).")
+    serve.add_argument('--port', type=int, help="Port to listen on (default: 8765).")
+    serve.add_argument('--unix', metavar='PATH', help="Listen on a Unix socket instead of TCP.")
+    serve.add_argument('--max-jobs', type=int, default=1,
+                       help="Directory and file-list jobs run at the same time (default: %(default)s).")
+    serve.add_argument('--max-uploads', type=int,
+                       help="Uploaded images converted at the same time (default: one per CPU).")
+    serve.add_argument('--workers', type=int, default=0,
+                       help="Worker processes per directory job unless the job says otherwise (0 uses every CPU).")
+    serve.add_argument('--root', metavar='DIR', help="Only accept input and output paths inside this directory.")
+    serve.set_defaults(func=run_serve)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if hasattr(args, 'width') and (args.width is None) != (args.height is None):
+        parser.error("--width and --height must be given together.")
+    try:
+        return args.func(args)
+    except Exception as e:
+        logging.exception(f"Exception: {e}")
+        print(f"Exception: {e}", file=sys.stderr)
+        return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,173 @@
+import os
+import shutil
+import hashlib
+from PIL import Image
+
+try:
+    # Several times faster than any stdlib hash; optional.
+    import xxhash
+except ImportError:
+    xxhash = None
+
+DEDUP_MODES = ('link', 'copy')
+NEAR_DUPLICATE_DISTANCE = 4  # differing bits out of 64
+# A dHash with fewer set (or unset) bits than this comes from a flat or smooth image; such hashes
+# all look alike and would pair every blank frame with every other one.
+MIN_DHASH_BITS = 8
+HASH_CHUNK = 1024 * 1024
+
+
+def fast_digest(data):
+    # Identity, not security: collisions only matter between files that already share a size.
+    if xxhash is not None:
+        return xxhash.xxh3_128_hexdigest(data)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def fast_file_digest(path):
+    digest = xxhash.xxh3_128() if xxhash is not None else hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DedupIndex:
+    # Maps input contents to the first file seen with them. A file is only hashed once a second
+    # file of the same size turns up; the first file of that size is then hashed from disk.
+    # A long-running caller (the watcher) keeps one index across runs, so outputs holds what each
+    # converted original wrote and a re-upload in a later batch is linked rather than encoded.
+    def __init__(self):
+        self.by_size = {}
+        self.sizes = {}  # key -> size of the bucket it is registered in, so forget() stays cheap
+        self.outputs = {}  # key -> what the converted original wrote, for link_duplicate()
+
+    def __contains__(self, key):
+        return key in self.sizes
+
+    def find(self, key, path, size, data):
+        # Returns the key of an earlier identical file, or None after registering this one.
+        bucket = self.by_size.get(size)
+        if bucket is None:
+            self.by_size[size] = {'first': (key, path), 'hashes': None}
+            self.sizes[key] = size
+            return None
+        if bucket['hashes'] is None:
+            first_key, first_path = bucket['first']
+            try:
+                bucket['hashes'] = {fast_file_digest(first_path): first_key}
+            except OSError:
+                bucket['hashes'] = {}
+        digest = fast_digest(data)
+        primary = bucket['hashes'].get(digest)
+        if primary is None:
+            bucket['hashes'][digest] = key
+            self.sizes[key] = size
+        return primary
+
+    def forget(self, key):
+        # The original failed to convert, changed or lost its outputs, so copies of it must not
+        # wait for or link to its outputs.
+        self.outputs.pop(key, None)
+        bucket = self.by_size.get(self.sizes.pop(key, None))
+        if bucket is None:
+            return
+        if bucket['hashes'] is not None:
+            for digest, primary in list(bucket['hashes'].items()):
+                if primary == key:
+                    del bucket['hashes'][digest]
+        elif bucket['first'][0] == key:
+            bucket['hashes'] = {}
+
+
+def link_or_copy(source, destination, mode):
+    # Through a temp name, like every other output, so a crash never leaves a partial file.
+    directory, name = os.path.split(destination)
+    temp_path = os.path.join(directory, f'.{name}.tmp')
+    try:
+        if os.path.lexists(temp_path):
+            os.remove(temp_path)
+        if mode == 'link':
+            try:
+                os.link(source, temp_path)
+            except OSError:
+                # Different filesystem, or no hard links there.
+                shutil.copyfile(source, temp_path)
+        else:
+            shutil.copyfile(source, temp_path)
+        os.replace(temp_path, destination)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return os.path.getsize(destination)
+
+
+def difference_hash(img):
+    # 64-bit dHash: brightness gradients of a 9x8 thumbnail. Survives re-encoding and resizing.
+    small = img.convert('L').resize((9, 8), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = value << 1 | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+class NearDuplicateIndex:
+    # Pairs of images whose dHashes differ in at most max_distance bits. The hash is split into
+    # max_distance + 1 bands, and two hashes that close must agree exactly on at least one band,
+    # so only images sharing a band are compared.
+    def __init__(self, max_distance=NEAR_DUPLICATE_DISTANCE):
+        self.max_distance = max_distance
+        bands = max_distance + 1
+        width = 64 // bands
+        self.bands = [(index * width, 64 if index == bands - 1 else (index + 1) * width) for index in range(bands)]
+        self.buckets = {}
+        self.pairs = []
+        self.low_detail = 0
+
+    def add(self, key, value):
+        bits = bin(value).count('1')
+        if bits < MIN_DHASH_BITS or bits > 64 - MIN_DHASH_BITS:
+            self.low_detail += 1
+            return
+        seen = set()
+        for index, (low, high) in enumerate(self.bands):
+            band = (index, value >> low & ((1 << (high - low)) - 1))
+            for other_key, other_value in self.buckets.get(band, ()):
+                if other_key in seen:
+                    continue
+                seen.add(other_key)
+                distance = bin(value ^ other_value).count('1')
+                if distance <= self.max_distance:
+                    self.pairs.append((other_key, key, distance))
+            self.buckets.setdefault(band, []).append((key, value))
+
+    def groups(self):
+        # Connected components of the near-duplicate pairs, largest first.
+        parent = {}
+
+        def find(key):
+            parent.setdefault(key, key)
+            while parent[key] != key:
+                parent[key] = parent[parent[key]]
+                key = parent[key]
+            return key
+
+        for first, second, _ in self.pairs:
+            parent[find(first)] = find(second)
+        groups = {}
+        for key in parent:
+            groups.setdefault(find(key), []).append(key)
+        return sorted((sorted(group) for group in groups.values()), key=len, reverse=True)
+
+    def report(self):
+        return {
+            'max_distance': self.max_distance,
+            'pairs': [{'a': first, 'b': second, 'distance': distance} for first, second, distance in self.pairs],
+            'groups': self.groups(),
+            'low_detail_skipped': self.low_detail,
+        }
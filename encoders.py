@@ -0,0 +1,221 @@
+import io
+import math
+import logging
+from PIL import Image, ImageChops
+
+try:
+    # Registers AVIF with Pillow versions that have no native support.
+    import pillow_avif  # noqa: F401
+except ImportError:
+    pillow_avif = None
+
+DEFAULT_FORMATS = ('webp',)
+
+ORIENTATION_TAG = 0x0112
+QUALITY_RANGE = (30, 95)
+DEFAULT_MAX_ENCODES = 6
+# Metrics are computed on a copy whose short side is about this long (as in the reference SSIM code).
+METRIC_SIZE = 256
+SSIM_BLOCK = 8
+
+# 'png-alpha' writes a PNG only for images that actually have transparency.
+FORMATS = {
+    'webp': {'pillow': 'WEBP', 'extension': '.webp', 'params': {}},
+    'avif': {'pillow': 'AVIF', 'extension': '.avif', 'params': {}},
+    'jpeg': {'pillow': 'JPEG', 'extension': '.jpg', 'params': {'progressive': True, 'optimize': True}},
+    'png': {'pillow': 'PNG', 'extension': '.png', 'params': {'optimize': True}},
+    'png-alpha': {'pillow': 'PNG', 'extension': '.png', 'params': {'optimize': True}},
+}
+
+
+def is_format_available(name):
+    Image.init()
+    return name in FORMATS and FORMATS[name]['pillow'] in Image.SAVE
+
+
+def resolve_formats(formats):
+    resolved = []
+    for name in formats or DEFAULT_FORMATS:
+        name = name.lower()
+        if name == 'jpg':
+            name = 'jpeg'
+        if name not in FORMATS:
+            raise ValueError(f"Unknown output format: {name!r}")
+        if not is_format_available(name):
+            logging.warning(f"Output format {name} is not supported by this Pillow build; skipping it.")
+            continue
+        if name not in resolved:
+            resolved.append(name)
+    if not resolved:
+        raise ValueError("None of the requested output formats are available.")
+    return resolved
+
+
+def has_alpha(img):
+    return img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+
+
+def normalize_mode(img):
+    # Bring every source into a mode the resize and all encoders understand.
+    if has_alpha(img):
+        return img if img.mode == 'RGBA' else img.convert('RGBA')
+    if img.mode in ('RGB', 'L'):
+        return img
+    return img.convert('RGB')
+
+
+def prepare_for_format(img, name):
+    if name == 'jpeg' and img.mode == 'RGBA':
+        # JPEG has no alpha channel; flatten onto white rather than letting transparent areas turn black.
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel('A'))
+        return background
+    if name in ('webp', 'avif') and img.mode == 'L':
+        return img.convert('RGB')
+    return img
+
+
+def rendition_path(output_base, size, name, multiple_sizes):
+    extension = FORMATS[name]['extension']
+    if multiple_sizes:
+        return f'{output_base}-{size[0]}{extension}'
+    return output_base + extension
+
+
+def supports_quality(name, options):
+    if name == 'webp':
+        return not options.lossless
+    return name in ('jpeg', 'avif')
+
+
+def extract_metadata(img):
+    # Read before any conversion: resized copies don't reliably carry the source's info.
+    metadata = {}
+    try:
+        exif = img.getexif()
+        if exif:
+            # Pixels are written upright, so the orientation tag must not rotate them again.
+            exif[ORIENTATION_TAG] = 1
+            metadata['exif'] = exif.tobytes()
+    except Exception as e:
+        logging.warning(f"Could not read EXIF data: {e}")
+    # A CMYK profile does not describe the RGB pixels we write.
+    if img.info.get('icc_profile') and img.mode != 'CMYK':
+        metadata['icc_profile'] = img.info['icc_profile']
+    return metadata
+
+
+def save_params(name, options, metadata=None):
+    params = dict(FORMATS[name]['params'])
+    if supports_quality(name, options) and options.quality is not None:
+        params['quality'] = options.quality
+    if name == 'webp':
+        if options.method is not None:
+            params['method'] = options.method
+        if options.lossless:
+            params['lossless'] = True
+    params.update(options.encoder_params.get(name, {}))
+    if metadata:
+        params.update(metadata)
+    return params
+
+
+def encode_to_bytes(img, name, params):
+    buffer = io.BytesIO()
+    img.save(buffer, FORMATS[name]['pillow'], **params)
+    return buffer.getvalue()
+
+
+def _metric_image(img, reference_size=None):
+    img = img.convert('L')
+    width, height = reference_size or img.size
+    factor = max(1, round(min(width, height) / METRIC_SIZE))
+    if factor > 1:
+        img = img.resize((max(1, img.width // factor), max(1, img.height // factor)), Image.BOX)
+    return img
+
+
+def psnr(reference, candidate):
+    histogram = ImageChops.difference(reference, candidate).histogram()
+    squared_error = sum(count * (value % 256) ** 2 for value, count in enumerate(histogram))
+    mse = squared_error / (reference.width * reference.height * len(reference.getbands()))
+    if mse == 0:
+        return float('inf')
+    return 10 * math.log10(255 ** 2 / mse)
+
+
+def _blocks(img):
+    # Pixel values of each non-overlapping SSIM_BLOCK x SSIM_BLOCK window.
+    width, height = img.size
+    pixels = list(img.getdata())
+    blocks = []
+    for top in range(0, height - SSIM_BLOCK + 1, SSIM_BLOCK):
+        for left in range(0, width - SSIM_BLOCK + 1, SSIM_BLOCK):
+            values = [pixels[row * width + left + col] for row in range(top, top + SSIM_BLOCK)
+                      for col in range(SSIM_BLOCK)]
+            blocks.append(values)
+    return blocks
+
+
+def ssim(reference_blocks, candidate):
+    # Mean SSIM over 8x8 blocks of the downsampled luma; close enough to rank encoder qualities.
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    n = SSIM_BLOCK * SSIM_BLOCK
+    total = 0.0
+    candidate_blocks = _blocks(candidate)
+    if not candidate_blocks:
+        return 1.0
+    for xs, ys in zip(reference_blocks, candidate_blocks):
+        mean_x = sum(xs) / n
+        mean_y = sum(ys) / n
+        var_x = sum(x * x for x in xs) / n - mean_x * mean_x
+        var_y = sum(y * y for y in ys) / n - mean_y * mean_y
+        cov = sum(x * y for x, y in zip(xs, ys)) / n - mean_x * mean_y
+        total += ((2 * mean_x * mean_y + c1) * (2 * cov + c2)) / \
+                 ((mean_x * mean_x + mean_y * mean_y + c1) * (var_x + var_y + c2))
+    return total / len(candidate_blocks)
+
+
+def search_quality(img, name, params, target_bytes=None, min_ssim=None, min_psnr=None,
+                   max_encodes=DEFAULT_MAX_ENCODES):
+    # Binary search over the encoder quality. With a byte budget we want the highest quality that
+    # fits; with a metric floor the lowest quality that reaches it. Returns (quality, data).
+    low, high = QUALITY_RANGE
+    reference = reference_blocks = None
+    if min_ssim is not None or min_psnr is not None:
+        reference = _metric_image(img)
+        if min_ssim is not None:
+            reference_blocks = _blocks(reference)
+
+    def acceptable(data):
+        if target_bytes is not None:
+            return len(data) <= target_bytes
+        with Image.open(io.BytesIO(data)) as decoded:
+            candidate = _metric_image(decoded, img.size)
+        if min_ssim is not None and ssim(reference_blocks, candidate) < min_ssim:
+            return False
+        if min_psnr is not None and psnr(reference, candidate) < min_psnr:
+            return False
+        return True
+
+    best = fallback = None
+    encodes = 0
+    while low <= high and encodes < max_encodes:
+        quality = (low + high) // 2
+        data = encode_to_bytes(img, name, dict(params, quality=quality))
+        encodes += 1
+        if acceptable(data):
+            best = (quality, data)
+            if target_bytes is not None:
+                low = quality + 1
+            else:
+                high = quality - 1
+        else:
+            # Keep the closest miss in case nothing in range is acceptable.
+            fallback = (quality, data)
+            if target_bytes is not None:
+                high = quality - 1
+            else:
+                low = quality + 1
+    return best or fallback
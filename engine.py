@@ -0,0 +1,1090 @@
+import io
+import os
+import math
+import sys
+import json
+import time
+import logging
+import threading
+from contextlib import nullcontext
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from PIL import Image
+from manifest import ConversionManifest, MANIFEST_FILE, data_digest
+from metrics import RunMetrics, Stopwatch, peak_rss_mb
+from dedup import DedupIndex, NearDuplicateIndex, DEDUP_MODES, NEAR_DUPLICATE_DISTANCE, difference_hash, link_or_copy
+from encoders import (ORIENTATION_TAG, DEFAULT_MAX_ENCODES, resolve_formats, normalize_mode, has_alpha, prepare_for_format,
+                      rendition_path, save_params, supports_quality, extract_metadata, search_quality,
+                      encode_to_bytes)
+from scanner import scan_images, normalize_extensions, BackgroundCounter
+
+CONFIG_FILE = 'config.json'
+DRAFT_REDUCING_GAP = 3.0
+# Images with more stored pixels than this are downscaled a band of rows at a time.
+LARGE_IMAGE_PIXELS = 40_000_000
+# Decoded source bytes per band in the strip path.
+STRIP_BYTES = 32 * 1024 * 1024
+MAX_TARGET_BYTES = 1 << 40
+MAX_PSNR = 100.0  # dB; 8-bit lossy encodes stay well below this
+ENCODER_CONFIG_KEYS = ('formats', 'widths', 'quality', 'method', 'lossless', 'keep_metadata', 'encoder_params',
+                       'target_bytes', 'min_ssim', 'min_psnr', 'max_encodes')
+_config = None  # see load_config()
+
+
+class ImageConverter:
+    def __init__(self, config):
+        self.is_converting = threading.Event()
+        self.stop_event = threading.Event()
+        self.metrics = None
+        self.near_duplicates = None
+        self.stats = ConversionStats(config)
+        self.encoder_config = get_encoder_config(config)
+
+    def setup_logging(self):
+        logging.basicConfig(filename='errors.log', level=logging.ERROR,
+                            format='%(asctime)s - %(levelname)s - %(message)s')
+
+    def correct_image_orientation(self, img):
+        return correct_image_orientation(img)
+
+
+class ConversionStats:
+    def __init__(self, config):
+        self.total_files_converted = config.get('total_files_converted', 0)
+        self.total_space_saved = config.get('total_space_saved', 0)  # in bytes
+        # Number of primary outputs written at each encoder quality.
+        self.quality_counts = self._parse_quality_counts(config.get('quality_counts'))
+        # Inputs identical to an earlier one, whose outputs were linked or copied instead of encoded.
+        self.duplicates_reused = config.get('duplicates_reused', 0)
+
+    def update_stats(self, old_size, new_size, quality=None):
+        self.total_files_converted += 1
+        self.total_space_saved += old_size - new_size
+        if quality is not None:
+            self.quality_counts[quality] = self.quality_counts.get(quality, 0) + 1
+
+    def record_duplicate(self, old_size, new_size):
+        self.duplicates_reused += 1
+        self.total_space_saved += old_size - new_size
+
+    def get_stats(self):
+        return {
+            'total_files_converted': self.total_files_converted,
+            'total_space_saved': self.total_space_saved,
+            'quality_counts': {str(quality): count for quality, count in sorted(self.quality_counts.items())},
+            'duplicates_reused': self.duplicates_reused,
+        }
+
+    @staticmethod
+    def _parse_quality_counts(counts):
+        # JSON object keys are strings.
+        return {int(quality): count for quality, count in (counts or {}).items()}
+
+
+# One lossless transpose per EXIF orientation value, instead of rotate() followed by transpose().
+ORIENTATION_TRANSPOSE = {
+    2: Image.FLIP_LEFT_RIGHT,
+    3: Image.ROTATE_180,
+    4: Image.FLIP_TOP_BOTTOM,
+    5: Image.TRANSPOSE,
+    6: Image.ROTATE_270,
+    7: Image.TRANSVERSE,
+    8: Image.ROTATE_90,
+}
+
+
+def correct_image_orientation(img, orientation=None):
+    if orientation is None:
+        orientation = get_exif_orientation(img)
+    method = ORIENTATION_TRANSPOSE.get(orientation)
+    if method is None:
+        return img
+    return img.transpose(method)
+
+
+class ConversionOptions:
+    def __init__(self, batch_mode=True, width=None, height=None, workers=1, max_in_flight=None, draft=True,
+                 incremental=True, manifest_path=None, verify_hash=False, resume=False,
+                 recursive=True, mirror=True, extensions=None, include=None, exclude=None,
+                 widths=None, formats=None, quality=None, method=None, lossless=False, keep_metadata=False,
+                 encoder_params=None, target_bytes=None, min_ssim=None, min_psnr=None,
+                 max_encodes=DEFAULT_MAX_ENCODES, read_ahead=None, io_threads=4, write_queue=None,
+                 memory_budget=None, large_image_pixels=LARGE_IMAGE_PIXELS, dedup=None, near_duplicates=False,
+                 near_duplicate_distance=NEAR_DUPLICATE_DISTANCE):
+        self.batch_mode = batch_mode
+        self.width = parse_dimension(width)
+        self.height = parse_dimension(height)
+        self.workers = resolve_workers(workers)
+        # Bound the number of submitted-but-unfinished files so memory stays flat on huge directories.
+        self.max_in_flight = max_in_flight or self.workers * 2
+        # Pipelined I/O: files read ahead of the compute stage, reader threads, and encoded
+        # files allowed to wait for the writer.
+        self.read_ahead = read_ahead or max(4, self.max_in_flight * 2)
+        self.io_threads = max(1, io_threads)
+        self.write_queue = write_queue or self.max_in_flight
+        # Estimated bytes all running conversions may use together; None admits files on
+        # max_in_flight alone. Sources above large_image_pixels take the strip path.
+        self.memory_budget = memory_budget
+        self.large_image_pixels = large_image_pixels
+        # Encode byte-identical inputs once and 'link' or 'copy' the outputs for the others.
+        if dedup not in (None,) + DEDUP_MODES:
+            raise ValueError(f"dedup must be one of {', '.join(DEDUP_MODES)}, got {dedup!r}")
+        self.dedup = dedup
+        # Hash every converted image perceptually and report pairs within this many bits.
+        self.near_duplicates = near_duplicates
+        self.near_duplicate_distance = parse_range('near_duplicate_distance', near_duplicate_distance, 0, 16)
+        # Reduced-scale JPEG decoding; turn off to always decode and resample at full resolution.
+        self.draft = draft
+        # Skip inputs the manifest says are already converted with the same settings.
+        self.incremental = incremental
+        # Resuming always skips files the manifest has recorded, even when incremental is off.
+        self.resume = resume
+        self.recursive = recursive
+        # Recreate the input's subdirectories under the output directory instead of flattening them.
+        self.mirror = mirror
+        self.extensions = normalize_extensions(extensions)
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        # Rendition set: every width (largest first, so each size is resized from the previous one)
+        # in every output format. Without widths only the recommended size is written.
+        self.widths = sorted({parse_dimension(width) for width in widths or []}, reverse=True)
+        self.formats = resolve_formats(formats)
+        self.quality = parse_range('quality', quality, 0, 100)
+        self.method = parse_range('method', method, 0, 6)  # WEBP effort, 6 is slowest and smallest
+        self.lossless = lossless
+        # Copy EXIF (with the orientation reset) and the ICC profile into the outputs.
+        self.keep_metadata = keep_metadata
+        # Extra Pillow save() arguments per format, e.g. {'avif': {'speed': 4}}.
+        self.encoder_params = encoder_params or {}
+        # Optional per-image quality search: fit a byte budget, or reach a minimum SSIM/PSNR
+        # against the resized image, using at most max_encodes encodes per output.
+        if sum(target is not None for target in (target_bytes, min_ssim, min_psnr)) > 1:
+            raise ValueError("Choose only one of target_bytes, min_ssim and min_psnr.")
+        self.target_bytes = parse_range('target_bytes', target_bytes, 1, MAX_TARGET_BYTES)
+        self.min_ssim = parse_float_range('min_ssim', min_ssim, 0.0, 1.0)
+        self.min_psnr = parse_float_range('min_psnr', min_psnr, 0.0, MAX_PSNR)
+        self.max_encodes = parse_range('max_encodes', max_encodes, 1, 20)
+        self.manifest_path = manifest_path
+        # Hash inputs so touched-but-identical files are still recognised as up to date.
+        self.verify_hash = verify_hash
+
+    def fingerprint(self):
+        # Everything that changes the bytes written for a given input.
+        return json.dumps({
+            'width': self.width,
+            'height': self.height,
+            'draft': self.draft,
+            'widths': self.widths,
+            'formats': self.formats,
+            'quality': self.quality,
+            'method': self.method,
+            'lossless': self.lossless,
+            'keep_metadata': self.keep_metadata,
+            'encoder_params': self.encoder_params,
+            'target_bytes': self.target_bytes,
+            'min_ssim': self.min_ssim,
+            'min_psnr': self.min_psnr,
+            'max_encodes': self.max_encodes,
+        }, sort_keys=True)
+
+    @property
+    def quality_search(self):
+        return any(target is not None for target in (self.target_bytes, self.min_ssim, self.min_psnr))
+
+    def to_dict(self):
+        return {
+            'batch_mode': self.batch_mode,
+            'width': self.width,
+            'height': self.height,
+            'workers': self.workers,
+            'max_in_flight': self.max_in_flight,
+            'read_ahead': self.read_ahead,
+            'io_threads': self.io_threads,
+            'write_queue': self.write_queue,
+            'memory_budget': self.memory_budget,
+            'large_image_pixels': self.large_image_pixels,
+            'dedup': self.dedup,
+            'near_duplicates': self.near_duplicates,
+            'near_duplicate_distance': self.near_duplicate_distance,
+            'draft': self.draft,
+            'incremental': self.incremental,
+            'manifest_path': self.manifest_path,
+            'verify_hash': self.verify_hash,
+            'resume': self.resume,
+            'recursive': self.recursive,
+            'mirror': self.mirror,
+            'extensions': list(self.extensions),
+            'include': self.include,
+            'exclude': self.exclude,
+            'widths': self.widths,
+            'formats': self.formats,
+            'quality': self.quality,
+            'method': self.method,
+            'lossless': self.lossless,
+            'keep_metadata': self.keep_metadata,
+            'encoder_params': self.encoder_params,
+            'target_bytes': self.target_bytes,
+            'min_ssim': self.min_ssim,
+            'min_psnr': self.min_psnr,
+            'max_encodes': self.max_encodes,
+        }
+
+
+def parse_dimension(value):
+    if value in (None, ''):
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid dimension: {value!r}")
+    if value <= 0:
+        raise ValueError(f"Invalid dimension: {value!r}")
+    return value
+
+
+def parse_range(name, value, low, high):
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {name}: {value!r}")
+    if not low <= value <= high:
+        raise ValueError(f"{name} must be between {low} and {high}, got {value}")
+    return value
+
+
+def parse_float_range(name, value, low, high):
+    if value is None:
+        return None
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid {name}: {value!r}")
+    if not low <= value <= high:
+        raise ValueError(f"{name} must be between {low} and {high}, got {value}")
+    return value
+
+
+def get_encoder_config(config):
+    # The optional "encoder" section of config.json uses the ConversionOptions argument names.
+    section = config.get('encoder') or {}
+    return {key: value for key, value in section.items() if key in ENCODER_CONFIG_KEYS}
+
+
+def resolve_workers(workers):
+    if not workers or workers < 0:
+        return os.cpu_count() or 1
+    return workers
+
+
+def get_optimal_resolutions(original_size):
+    common_widths = [1920, 1440, 1280]
+    original_width, original_height = original_size
+    aspect_ratio = original_width / original_height
+    return [(int(width), int(width / aspect_ratio)) for width in common_widths]
+
+
+def get_target_resolution(original_size, options):
+    if options.width and options.height:
+        return (options.width, options.height)
+    return get_optimal_resolutions(original_size)[0]
+
+
+def get_exif_orientation(img):
+    # Parsed from the EXIF block read with the header; no pixels are decoded.
+    try:
+        return img.getexif().get(ORIENTATION_TAG, 1)
+    except Exception as e:
+        logging.warning(f"Could not read EXIF orientation: {e}")
+        return 1
+
+
+def swaps_axes(orientation):
+    return orientation in (5, 6, 7, 8)
+
+
+def get_oriented_size(img, orientation=None):
+    if orientation is None:
+        orientation = get_exif_orientation(img)
+    width, height = img.size
+    if swaps_axes(orientation):
+        return height, width
+    return width, height
+
+
+def apply_draft(img, target_size, orientation):
+    # JPEG can decode at 1/2, 1/4 or 1/8 scale in the DCT domain; Pillow picks the
+    # smallest scale that still covers the requested size. Other formats ignore this.
+    if swaps_axes(orientation):
+        target_size = (target_size[1], target_size[0])
+    img.draft(img.mode, target_size)
+
+
+def resize_oriented(img, size, orientation, options):
+    # Resize the stored (unrotated) pixels first and transpose the small result, so no
+    # full-resolution rotated copy is ever made.
+    if swaps_axes(orientation):
+        resized_img = resize_image(img, (size[1], size[0]), options)
+    else:
+        resized_img = resize_image(img, size, options)
+    return correct_image_orientation(resized_img, orientation)
+
+
+def is_large_image(img, options):
+    width, height = img.size
+    return bool(options.large_image_pixels) and width * height > options.large_image_pixels
+
+
+def resize_in_strips(img, size, strip_bytes=STRIP_BYTES):
+    # Downscale one band of source rows at a time instead of converting and reducing the whole
+    # image. Each band is cropped with enough extra rows for the LANCZOS kernel and resized with a
+    # box, so the seams match a whole-image resize while mode conversion and the resampling
+    # buffers only ever hold one band.
+    width, height = img.size
+    out_width, out_height = size
+    scale = height / out_height
+    margin = math.ceil(3 * max(scale, 1)) + 1
+    bytes_per_row = width * (1 if img.mode in ('1', 'L', 'P') else 4)
+    rows = max(1, int(strip_bytes / (bytes_per_row * max(scale, 1))))
+    result = None
+    for top in range(0, out_height, rows):
+        bottom = min(out_height, top + rows)
+        band_top = max(0, int(top * scale) - margin)
+        band_bottom = min(height, math.ceil(bottom * scale) + margin)
+        band = normalize_mode(img.crop((0, band_top, width, band_bottom)))
+        box = (0, top * scale - band_top, width, bottom * scale - band_top)
+        piece = band.resize((out_width, bottom - top), Image.LANCZOS, box=box)
+        if result is None:
+            result = Image.new(piece.mode, size)
+        result.paste(piece, (0, top))
+    return result
+
+
+def estimate_memory(img, options):
+    # Rough peak bytes for converting img, from the header alone. Pillow keeps RGB, RGBA and
+    # CMYK at four bytes per pixel. The whole-image path holds the decoded source plus about
+    # one full-size copy (mode conversion or the reducing step); the strip path holds the source
+    # plus a couple of bands. Outputs are counted a few times for the format and encoder copies.
+    orientation = get_exif_orientation(img)
+    width, height = img.size
+    if options.batch_mode:
+        target = get_rendition_sizes(get_oriented_size(img, orientation), options)[0]
+        if swaps_axes(orientation):
+            target = (target[1], target[0])
+    else:
+        target = (width, height)
+    large = is_large_image(img, options)
+    scale = 1
+    if img.format == 'JPEG' and (options.draft or large):
+        # Same rule as Image.draft(): the largest DCT scale that still covers the target.
+        factor = min(width // max(1, target[0]), height // max(1, target[1]))
+        scale = next((s for s in (8, 4, 2) if factor >= s), 1)
+    bytes_per_pixel = 1 if img.mode in ('1', 'L', 'P') else 4
+    decoded = math.ceil(width / scale) * math.ceil(height / scale) * bytes_per_pixel
+    output = target[0] * target[1] * 4 * 3
+    if large:
+        return decoded + 2 * STRIP_BYTES + output
+    return 2 * decoded + output
+
+
+def resize_image(img, size, options):
+    if options.draft:
+        # Shrink by a cheap integer box reduction first, then finish with LANCZOS.
+        return img.resize(size, Image.LANCZOS, reducing_gap=DRAFT_REDUCING_GAP)
+    return img.resize(size, Image.LANCZOS)
+
+
+def _read_config():
+    # Raises FileNotFoundError, or ValueError when config.json is not a JSON object.
+    with open(CONFIG_FILE, 'r') as file:
+        data = json.load(file)
+    if not isinstance(data, dict):
+        raise ValueError("config.json does not hold a JSON object")
+    return data
+
+
+def load_config(reload=False):
+    # Parsed once per process and shared by every caller that only reads it.
+    global _config
+    if _config is not None and not reload:
+        return _config
+    try:
+        _config = _read_config()
+    except FileNotFoundError:
+        _config = {}
+        print("Config file not found. Starting with fresh directories and config.", file=sys.stderr)
+    except ValueError:
+        _config = {}
+        print("Could not decode the config file. Starting with fresh directories and config.", file=sys.stderr)
+    return _config
+
+
+def save_config(updates):
+    # Re-read rather than written from the cached copy: the GUI, another run or a manual edit may
+    # have changed config.json since this process loaded it, and only updates are ours to change.
+    global _config
+    try:
+        config = _read_config()
+    except (OSError, ValueError):
+        config = dict(load_config())
+    config.update(updates)
+    try:
+        # A crash mid-write must not leave a truncated config behind.
+        atomic_write(CONFIG_FILE, json.dumps(config).encode())
+    except Exception as e:
+        logging.exception(e)
+    _config = config
+
+
+def save_last_selected_dirs(input_dir, output_dir, converter):
+    save_config({
+        'input_dir': input_dir,
+        'output_dir': output_dir,
+        **converter.stats.get_stats(),
+    })
+
+
+def get_last_selected_dirs():
+    data = load_config()
+    input_dir = data.get('input_dir', '')
+    output_dir = data.get('output_dir', '')
+    config = {
+        'total_files_converted': data.get('total_files_converted', 0),
+        'total_space_saved': data.get('total_space_saved', 0),
+        'quality_counts': data.get('quality_counts', {}),
+        'duplicates_reused': data.get('duplicates_reused', 0),
+        'encoder': data.get('encoder', {}),
+    }
+    return input_dir, output_dir, config
+
+
+def atomic_write(output_path, data):
+    # Write next to the target and rename over it, so an interrupted run never leaves a
+    # truncated output behind. The temp name is fixed per output, so a leftover from a
+    # crash is simply overwritten when that file is converted again.
+    directory, name = os.path.split(output_path)
+    temp_path = os.path.join(directory, f'.{name}.tmp')
+    try:
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        size = len(data)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return size
+
+
+def get_rendition_sizes(original_size, options):
+    if options.width and options.height:
+        return [(options.width, options.height)]
+    if options.widths:
+        original_width, original_height = original_size
+        aspect_ratio = original_width / original_height
+        return [(width, max(1, int(width / aspect_ratio))) for width in options.widths]
+    return [get_target_resolution(original_size, options)]
+
+
+def _new_result(input_path, output_base):
+    return {
+        'file': os.path.basename(input_path),
+        'input_path': input_path,
+        'output_base': output_base,
+        'output_path': None,
+        'status': 'error',
+    }
+
+
+def read_source(input_path, options):
+    # Prefetch stage: pull the raw bytes into memory so decoding never waits on storage.
+    start = time.perf_counter()
+    with open(input_path, 'rb') as file:
+        stat = os.fstat(file.fileno())
+        data = file.read()
+    source = make_source(data, options, stat.st_mtime_ns)
+    source['read_s'] = time.perf_counter() - start
+    return source
+
+
+def make_source(data, options, mtime_ns=0):
+    # Input for render_image(): file contents plus what the scheduler needs to know about them.
+    source = {'data': data, 'size': len(data), 'mtime_ns': mtime_ns, 'memory': 0, 'read_s': 0.0}
+    if options.verify_hash:
+        source['content_hash'] = data_digest(data)
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            source['memory'] = estimate_memory(img, options)
+    except (IOError, ValueError, Image.DecompressionBombError):
+        pass  # render_image reports the error
+    return source
+
+
+def render_image(source, input_path, output_base, options, select_resolution=None):
+    # Compute stage: decode, resize and encode entirely in memory. The encoded outputs are
+    # returned in result['encoded'] for the writer stage.
+    start = time.perf_counter()
+    result = _new_result(input_path, output_base)
+    result['mtime_ns'] = source['mtime_ns']
+    result['content_hash'] = source.get('content_hash')
+    result['timings'] = {'read': source.get('read_s', 0.0)}
+    stopwatch = Stopwatch(result['timings'])
+    try:
+        with Image.open(io.BytesIO(source['data'])) as img:
+            stopwatch.lap('open')
+            # Only the header has been read so far; pick the target before decoding any pixels.
+            orientation = get_exif_orientation(img)
+            original_size = get_oriented_size(img, orientation)
+            result['original_size'] = original_size
+            stopwatch.lap('orientation')
+
+            if not options.batch_mode and select_resolution is not None:
+                resolutions = get_optimal_resolutions(original_size)
+                chosen_resolution = select_resolution(result['file'], input_path, resolutions)
+                if chosen_resolution == 'SKIP':
+                    result['status'] = 'skipped'
+                    return result
+                # Time spent waiting for the user is not compute time.
+                start = time.perf_counter()
+                stopwatch.restart()
+                sizes = [chosen_resolution]
+            else:
+                sizes = get_rendition_sizes(original_size, options)
+
+            metadata = extract_metadata(img) if options.keep_metadata else None
+            large = is_large_image(img, options)
+            result['large'] = large
+            # DCT scaling is the only way to shrink a huge JPEG while decoding, so use it even
+            # when draft is off.
+            if options.draft or large:
+                apply_draft(img, sizes[0], orientation)
+            img.load()
+            if not large:
+                img = normalize_mode(img)
+            stopwatch.lap('open')
+
+            # Decode once, then build each smaller rendition from the previous one.
+            outputs = []
+            encoded = []
+            resized_img = None
+            for size in sizes:
+                if resized_img is None:
+                    # resize_oriented() in two steps, so the transpose is timed on its own.
+                    stored_size = (size[1], size[0]) if swaps_axes(orientation) else size
+                    if large:
+                        resized_img = resize_in_strips(img, stored_size)
+                    else:
+                        resized_img = resize_image(img, stored_size, options)
+                    stopwatch.lap('resize')
+                    resized_img = correct_image_orientation(resized_img, orientation)
+                    stopwatch.lap('orientation')
+                    if options.near_duplicates:
+                        result['dhash'] = difference_hash(resized_img)
+                        stopwatch.lap('dedup')
+                else:
+                    resized_img = resize_image(resized_img, size, options)
+                    stopwatch.lap('resize')
+                for name in options.formats:
+                    if name == 'png-alpha' and not has_alpha(resized_img):
+                        continue
+                    path = rendition_path(output_base, size, name, len(sizes) > 1)
+                    encoded_img = prepare_for_format(resized_img, name)
+                    params = save_params(name, options, metadata)
+                    quality = params.get('quality')
+                    if options.quality_search and supports_quality(name, options):
+                        quality, data = search_quality(encoded_img, name, params, options.target_bytes,
+                                                       options.min_ssim, options.min_psnr, options.max_encodes)
+                    else:
+                        data = encode_to_bytes(encoded_img, name, params)
+                    stopwatch.lap('encode')
+                    encoded.append((path, data))
+                    outputs.append({'path': path, 'format': name, 'size': resized_img.size, 'bytes': len(data),
+                                    'quality': quality})
+
+            result.update({
+                'status': 'converted',
+                'output_path': outputs[0]['path'] if outputs else None,
+                'outputs': outputs,
+                'encoded': encoded,
+                'size': outputs[0]['size'] if outputs else sizes[0],
+                'quality': outputs[0]['quality'] if outputs else None,
+                'old_size': len(source['data']),
+                'new_size': sum(output['bytes'] for output in outputs),
+            })
+    except (IOError, ValueError, Image.DecompressionBombError) as e:
+        result['error'] = str(e)
+        logging.error(format_result(result))
+    result['timings']['compute'] = time.perf_counter() - start
+    # Peak of whichever process did the work; a worker reports its own high-water mark.
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def input_difference_hash(path):
+    # dHash of a file converted in an earlier run, from the smallest DCT-scaled decode.
+    try:
+        with Image.open(path) as img:
+            orientation = get_exif_orientation(img)
+            img.draft('L', (img.width // 8 or 1, img.height // 8 or 1))
+            return difference_hash(correct_image_orientation(img, orientation))
+    except (IOError, ValueError, Image.DecompressionBombError) as e:
+        logging.warning(f"Could not hash {path}: {e}")
+        return None
+
+
+def check_not_input(input_path, output_paths):
+    # With the output directory set to the input directory, a rendition in the source's own
+    # format has the input's path and would be renamed over the original.
+    real_input = os.path.realpath(input_path)
+    for path in output_paths:
+        if os.path.realpath(path) == real_input:
+            raise OSError(f"Refusing to overwrite the input {input_path} with its own output.")
+
+
+def write_outputs(result):
+    # Writer stage.
+    start = time.perf_counter()
+    try:
+        encoded = result.pop('encoded', ())
+        check_not_input(result['input_path'], [path for path, _ in encoded])
+        for path, data in encoded:
+            atomic_write(path, data)
+    except OSError as e:
+        result['status'] = 'error'
+        result['error'] = str(e)
+        logging.error(format_result(result))
+    result.setdefault('timings', {})['write'] = time.perf_counter() - start
+    return result
+
+
+def link_duplicate(primary, input_path, output_base, source, mode):
+    # Writer stage for an input identical to one already converted: its outputs are reused.
+    start = time.perf_counter()
+    result = _new_result(input_path, output_base)
+    result.update({
+        'mtime_ns': source['mtime_ns'],
+        'content_hash': source.get('content_hash'),
+        'duplicate_of': primary['rel_path'],
+        'dhash': primary.get('dhash'),
+        'timings': {'read': source.get('read_s', 0.0)},
+    })
+    try:
+        paths = [output_base + output['path'][len(primary['output_base']):] for output in primary['outputs']]
+        check_not_input(input_path, paths)
+        outputs = [dict(output, path=path, bytes=link_or_copy(output['path'], path, mode))
+                   for output, path in zip(primary['outputs'], paths)]
+        result.update({
+            'status': 'duplicate',
+            'original_size': primary['original_size'],
+            'output_path': outputs[0]['path'] if outputs else None,
+            'outputs': outputs,
+            'size': outputs[0]['size'] if outputs else None,
+            'quality': outputs[0]['quality'] if outputs else None,
+            'old_size': source['size'],
+            'new_size': sum(output['bytes'] for output in outputs),
+        })
+    except OSError as e:
+        result['error'] = str(e)
+        logging.error(format_result(result))
+    result['timings']['write'] = time.perf_counter() - start
+    return result
+
+
+def render_data(data, input_path, output_base, options):
+    # Compute stage for contents already in memory (e.g. an upload). Hashing the contents and
+    # opening the header happen here too, so a caller can hand all of it to a worker process.
+    return render_image(make_source(data, options), input_path, output_base, options)
+
+
+def convert_file(input_path, output_base, options, select_resolution=None):
+    # All three stages back to back, for callers that convert a single file.
+    try:
+        source = read_source(input_path, options)
+    except OSError as e:
+        result = _new_result(input_path, output_base)
+        result['error'] = str(e)
+        logging.error(format_result(result))
+        return result
+    result = render_image(source, input_path, output_base, options, select_resolution)
+    if result['status'] != 'converted':
+        return result
+    return write_outputs(result)
+
+
+def format_result(result):
+    file = result.get('rel_path', result['file'])
+    if result['status'] == 'converted':
+        width, height = result['original_size']
+        new_width, new_height = result['size']
+        if len(result.get('outputs', ())) > 1:
+            renditions = ', '.join(f"{output['size'][0]}x{output['size'][1]} {output['format']}"
+                                   for output in result['outputs'])
+            return f'{file} ({width}x{height}) converted to {renditions} processed successfully.'
+        return f'{file} ({width}x{height}) converted to ({new_width}x{new_height}) processed successfully.'
+    if result['status'] == 'duplicate':
+        return f"{file} is identical to {result['duplicate_of']}; its outputs were reused."
+    if result['status'] == 'skipped':
+        return f"{file} was skipped by an unknown force."
+    if result['status'] == 'unchanged':
+        return f"{file} is already up to date."
+    return f"Error processing {file}: {result.get('error')}"
+
+
+def _should_stop(converter):
+    return converter.stop_event.is_set() or not converter.is_converting.is_set()
+
+
+def _error_result(entry, output_base, error):
+    result = _new_result(entry.path, output_base)
+    result['error'] = str(error)
+    logging.error(format_result(result))
+    return result
+
+
+class MemoryBudget:
+    # Admission control for the compute stage: a file starts only when its estimated peak fits
+    # in what the running files leave free. One file is always admitted, so an image larger than
+    # the whole budget still converts, on its own.
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.running = 0
+
+    def admits(self, cost):
+        return self.limit is None or self.running == 0 or self.in_use + cost <= self.limit
+
+    def acquire(self, cost):
+        self.in_use += cost
+        self.running += 1
+
+    def release(self, cost):
+        self.in_use -= cost
+        self.running -= 1
+
+
+def make_compute_pool(options):
+    # Worker processes for a parallel run, or None when conversion stays in this process.
+    if options.workers > 1 and options.batch_mode:
+        # Imported here: it pulls in multiprocessing, which single-process runs never need.
+        from concurrent.futures import ProcessPoolExecutor
+        return ProcessPoolExecutor(max_workers=options.workers)
+    return None
+
+
+def open_manifest(output_dir, options, read_only=False):
+    if options.manifest_path is False:
+        return None
+    path = options.manifest_path or os.path.join(output_dir, MANIFEST_FILE)
+    if read_only and not os.path.exists(path):
+        return None
+    return ConversionManifest(path, read_only=read_only)
+
+
+def is_unchanged(manifest, entry, params, output_base, options):
+    # The skip rules, shared with the planner so a plan skips exactly what a run would.
+    return (manifest is not None and (options.incremental or options.resume)
+            and manifest.is_up_to_date(entry.rel_path, entry.path, entry.size, entry.mtime_ns, params, output_base,
+                                       options.verify_hash))
+
+
+def _outputs_exist(original):
+    return all(os.path.exists(output['path']) for output in original['outputs'])
+
+
+def _run_pipeline(converter, tasks, options, select_resolution, check_unchanged, compute_pool=None, dedup=None):
+    # Three stages connected by bounded windows: up to read_ahead files being read, up to
+    # max_in_flight being decoded/encoded and up to write_queue waiting for the writer. A full
+    # later stage stops the earlier one from taking more work, so memory stays bounded.
+    # A compute_pool passed in (see make_compute_pool) is reused and left running, and a DedupIndex
+    # passed in keeps matching copies against originals converted by earlier calls.
+    parallel = options.workers > 1 and options.batch_mode
+    own_pool = compute_pool is None or not parallel
+    if not parallel:
+        # Interactive selection needs the GUI, so it never leaves this process.
+        compute_pool = ThreadPoolExecutor(max_workers=1)
+    elif own_pool:
+        compute_pool = make_compute_pool(options)
+    tasks = iter(tasks)
+    budget = MemoryBudget(options.memory_budget)
+    reading = {}
+    computing = {}
+    writing = {}
+    # Deduplication: copies wait for their original's outputs, keyed by the original's rel_path;
+    # dedup.outputs has the outputs of the originals already written.
+    if not options.dedup:
+        dedup = None
+    elif dedup is None:
+        dedup = DedupIndex()
+    copies = {}
+    exhausted = stopping = False
+    # An interactive chooser may build its previews while files are read ahead of the dialog.
+    prefetch = None if options.batch_mode else getattr(select_resolution, 'prefetch', None)
+
+    def submit_compute(entry, output_base, source):
+        budget.acquire(source['memory'])
+        if parallel:
+            future = compute_pool.submit(render_image, source, entry.path, output_base, options)
+        else:
+            future = compute_pool.submit(render_image, source, entry.path, output_base, options, select_resolution)
+        computing[future] = (entry, output_base, source)
+
+    def without_data(source):
+        # A copy only needs its source's metadata; holding its bytes while it waits for the
+        # original would sidestep the read and compute windows and the memory budget.
+        return {key: value for key, value in source.items() if key != 'data'}
+
+    def submit_copy(primary, entry, output_base, source):
+        future = write_pool.submit(link_duplicate, primary, entry.path, output_base, source, options.dedup)
+        writing[future] = (entry, output_base, source)
+
+    def original_failed(entry):
+        # Copies waiting for a failed original are read again and converted on their own; the
+        # first of them becomes the new original for the rest.
+        dedup.forget(entry.rel_path)
+        for copy_entry, output_base, _ in copies.pop(entry.rel_path, ()):
+            if not stopping:
+                reading[read_pool.submit(read_source, copy_entry.path, options)] = (copy_entry, output_base)
+
+    with ThreadPoolExecutor(max_workers=options.io_threads) as read_pool, \
+            ThreadPoolExecutor(max_workers=1) as write_pool, compute_pool if own_pool else nullcontext():
+        while True:
+            if not stopping and _should_stop(converter):
+                # Drop work that has not started; files already being converted are finished and written.
+                stopping = True
+                for future in list(reading):
+                    future.cancel()
+                reading.clear()
+                for future in list(computing):
+                    if future.cancel():
+                        budget.release(computing.pop(future)[2]['memory'])
+
+            while not stopping and not exhausted and len(reading) < options.read_ahead:
+                task = next(tasks, None)
+                if task is None:
+                    exhausted = True
+                    break
+                entry, output_base = task
+                result = check_unchanged(entry, output_base)
+                if result is not None:
+                    yield entry, result
+                    continue
+                reading[read_pool.submit(read_source, entry.path, options)] = task
+                if prefetch is not None:
+                    prefetch(entry.path)
+
+            for future in [future for future in reading if future.done()]:
+                if len(computing) >= options.max_in_flight or len(writing) >= options.write_queue:
+                    break
+                entry, output_base = reading[future]
+                try:
+                    source = future.result()
+                except Exception as e:
+                    del reading[future]
+                    yield entry, _error_result(entry, output_base, e)
+                    continue
+                if dedup is not None:
+                    if 'duplicate_of' not in source:
+                        if entry.rel_path in dedup:
+                            # Seen by an earlier call; its contents may have changed since.
+                            dedup.forget(entry.rel_path)
+                        primary = dedup.find(entry.rel_path, entry.path, len(source['data']), source['data'])
+                        if primary is not None and primary not in copies and not (
+                                primary in dedup.outputs and _outputs_exist(dedup.outputs[primary])):
+                            # An earlier call's original whose outputs were removed, or that was
+                            # stopped before writing them: this file becomes the original.
+                            dedup.forget(primary)
+                            primary = dedup.find(entry.rel_path, entry.path, len(source['data']),
+                                                 source['data'])
+                        source['duplicate_of'] = primary
+                        if primary is None:
+                            copies[entry.rel_path] = []
+                    primary = source['duplicate_of']
+                    if primary in dedup.outputs:
+                        del reading[future]
+                        submit_copy(dedup.outputs[primary], entry, output_base, without_data(source))
+                        continue
+                    if primary in copies:
+                        del reading[future]
+                        copies[primary].append((entry, output_base, without_data(source)))
+                        continue
+                # In read order: a large image waits for memory rather than being overtaken forever.
+                if not budget.admits(source['memory']):
+                    break
+                del reading[future]
+                submit_compute(entry, output_base, source)
+
+            for future in [future for future in computing if future.done()]:
+                entry, output_base, source = computing.pop(future)
+                budget.release(source['memory'])
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = _error_result(entry, output_base, e)
+                if result['status'] == 'converted':
+                    writing[write_pool.submit(write_outputs, result)] = (entry, output_base, source)
+                    continue
+                if dedup is not None:
+                    original_failed(entry)
+                yield entry, result
+
+            for future in [future for future in writing if future.done()]:
+                entry, output_base, source = writing.pop(future)
+                result = future.result()
+                if dedup is not None and result['status'] == 'converted':
+                    original = {'rel_path': entry.rel_path, 'output_base': output_base,
+                                'original_size': result['original_size'], 'outputs': result['outputs'],
+                                'dhash': result.get('dhash')}
+                    dedup.outputs[entry.rel_path] = original
+                    for copy in copies.pop(entry.rel_path, ()):
+                        submit_copy(original, *copy)
+                elif dedup is not None and result['status'] == 'error' and 'duplicate_of' not in result:
+                    original_failed(entry)
+                yield entry, result
+
+            if (exhausted or stopping) and not reading and not computing and not writing:
+                return
+            waiting = [future for future in reading if not future.done()] + list(computing) + list(writing)
+            if waiting:
+                wait(waiting, timeout=0.5, return_when=FIRST_COMPLETED)
+
+
+def get_scan_options(options, output_dir):
+    return {
+        'recursive': options.recursive,
+        'extensions': options.extensions,
+        'include': options.include,
+        'exclude': options.exclude,
+        # Never pick up our own outputs when the output directory sits inside the input tree.
+        'exclude_dirs': [output_dir],
+    }
+
+
+def get_output_base(output_dir, rel_path, options):
+    # Output path without the size/format suffix the encoders add.
+    rel_dir, name = os.path.split(rel_path)
+    target_dir = os.path.join(output_dir, rel_dir) if options.mirror else output_dir
+    return os.path.join(target_dir, os.path.splitext(name)[0])
+
+
+def iter_convert_images(converter, input_dir, output_dir, options=None, select_resolution=None, entries=None,
+                        manifest=None, compute_pool=None, dedup_index=None):
+    # entries: ScanEntry objects to convert instead of scanning input_dir (e.g. from the watcher).
+    # A long-running caller can pass its own manifest (see open_manifest), compute_pool and
+    # DedupIndex, which are then kept across calls.
+    options = options or ConversionOptions()
+    os.makedirs(output_dir, exist_ok=True)
+    if entries is None:
+        scan_options = get_scan_options(options, output_dir)
+        counter = BackgroundCounter(input_dir, **scan_options)
+        counter.start()
+        entries = scan_images(input_dir, **scan_options)
+    else:
+        entries = list(entries)
+        counter = SimpleNamespace(total=len(entries))
+    created_dirs = {output_dir}
+    # Inputs whose outputs would overwrite another input's ('a/x.jpg' and 'b/x.jpg' with mirror
+    # off, or 'x.jpg' and 'x.png' side by side) are reported as errors instead of converted.
+    conflicts = {}
+    claimed = {}
+
+    def output_owner(entry, output_base):
+        owner = claimed.setdefault(os.path.normcase(output_base), entry.rel_path)
+        if owner == entry.rel_path and manifest is not None:
+            # Outputs recorded by an earlier run (or watcher batch) whose input still exists.
+            owner = manifest.output_owner(output_base, entry.rel_path) or owner
+            if owner != entry.rel_path and not os.path.exists(os.path.join(input_dir, owner)):
+                owner = entry.rel_path
+        return None if owner == entry.rel_path else owner
+
+    def make_tasks():
+        claimed_dir = None
+        for entry in entries:
+            output_base = get_output_base(output_dir, entry.rel_path, options)
+            target_dir = os.path.dirname(output_base)
+            if target_dir != claimed_dir:
+                # Scans yield one directory at a time, so only the current target's names are kept.
+                claimed.clear()
+                claimed_dir = target_dir
+            owner = output_owner(entry, output_base)
+            if owner is not None:
+                conflicts[entry.rel_path] = f"Its outputs would overwrite those of {owner}."
+            if target_dir not in created_dirs:
+                os.makedirs(target_dir, exist_ok=True)
+                created_dirs.add(target_dir)
+            yield entry, output_base
+
+    tasks = make_tasks()
+    processed_files = 0
+    params = options.fingerprint()
+    own_manifest = manifest is None
+    if own_manifest:
+        manifest = open_manifest(output_dir, options)
+
+    def check_unchanged(entry, output_base):
+        if entry.rel_path in conflicts:
+            return _error_result(entry, output_base, conflicts.pop(entry.rel_path))
+        if not is_unchanged(manifest, entry, params, output_base, options):
+            return None
+        result = {
+            'file': os.path.basename(entry.path),
+            'input_path': entry.path,
+            'output_base': output_base,
+            'output_path': None,
+            'status': 'unchanged',
+        }
+        if options.near_duplicates:
+            # Skipped files still take part in the near-duplicate report.
+            result['dhash'] = manifest.lookup_dhash(entry.rel_path)
+            if result['dhash'] is None:
+                result['dhash'] = input_difference_hash(entry.path)
+                if result['dhash'] is not None:
+                    manifest.set_dhash(entry.rel_path, result['dhash'])
+        return result
+
+    converter.near_duplicates = NearDuplicateIndex(options.near_duplicate_distance) if options.near_duplicates else None
+    converter.metrics = RunMetrics({
+        'read': options.io_threads,
+        'compute': options.workers if options.batch_mode else 1,
+        'write': 1,
+    })
+    results = _run_pipeline(converter, tasks, options, select_resolution, check_unchanged, compute_pool,
+                            dedup_index)
+
+    try:
+        for entry, result in results:
+            result['rel_path'] = entry.rel_path
+            converter.metrics.add(result)
+            if result['status'] == 'duplicate':
+                converter.stats.record_duplicate(result['old_size'], result['new_size'])
+            elif result['status'] == 'converted' and result['outputs']:
+                converter.stats.update_stats(result['old_size'], result['new_size'], result['quality'])
+            if converter.near_duplicates is not None and result.get('dhash') is not None:
+                converter.near_duplicates.add(entry.rel_path, result['dhash'])
+            if result['status'] in ('converted', 'duplicate') and manifest is not None:
+                manifest.record(entry.rel_path, result['old_size'], result['mtime_ns'], params, result['output_base'],
+                                [(output['path'], output['bytes']) for output in result['outputs']],
+                                result.get('content_hash'), result.get('dhash'))
+            processed_files += 1
+            # The total stays None until the background count has finished.
+            yield processed_files, counter.total, result
+    finally:
+        if manifest is not None and own_manifest:
+            manifest.close()
+
+
+def convert_images(converter, input_dir, output_dir, options=None, on_progress=None, select_resolution=None):
+    if converter.is_converting.is_set():
+        raise RuntimeError("A conversion process is already running.")
+    converter.is_converting.set()
+    results = []
+    try:
+        for processed_files, total_files, result in iter_convert_images(converter, input_dir, output_dir, options, select_resolution):
+            results.append(result)
+            if on_progress is not None:
+                on_progress(processed_files, total_files, result)
+    finally:
+        converter.is_converting.clear()
+    return results
@@ -0,0 +1,474 @@
+from PIL import Image, ImageTk
+import tkinter as tk
+from tkinter import filedialog, messagebox, Toplevel, Label, Button, Menu
+from tkinter.ttk import Frame, Progressbar
+from ttkthemes import ThemedTk
+import logging
+import tkinter.scrolledtext as ScrolledText
+import io
+import threading
+import queue
+from engine import (ImageConverter, ConversionOptions, iter_convert_images,
+                    format_result, save_last_selected_dirs, get_last_selected_dirs)
+from scanner import count_images
+from previews import PreviewCache
+
+GUI_POLL_MS = 100
+TERMINAL_MAX_LINES = 5000
+
+# Tk is not thread-safe, so worker threads never touch widgets. They post (kind, value) events
+# here and the main loop applies everything queued since its last pass, every GUI_POLL_MS.
+gui_events = queue.Queue()
+
+
+def post_event(kind, value=None):
+    gui_events.put((kind, value))
+
+class ResolutionDialog:
+    # Interactive resolution choice. The conversion thread calls the dialog and blocks until the
+    # user answers; the single Toplevel behind it is built once, only ever touched by the Tk main
+    # loop and kept open between images. Previews come from the cache, which the engine fills
+    # through prefetch() as it reads files ahead of the one being shown.
+    def __init__(self, converter, preview_cache):
+        self.converter = converter
+        self.preview_cache = preview_cache
+        self.answers = queue.Queue()
+        self.window = None
+        self.buttons = []
+
+    def prefetch(self, img_path):
+        self.preview_cache.prefetch(img_path)
+
+    def __call__(self, image_name, img_path, resolutions):
+        while not self.answers.empty():
+            self.answers.get_nowait()
+        data = self.preview_cache.get(img_path)
+        post_event('call', lambda: self.show(image_name, data, resolutions))
+        while True:
+            try:
+                return self.answers.get(timeout=0.2)
+            except queue.Empty:
+                if self.converter.stop_event.is_set():
+                    post_event('call', self.hide)
+                    return 'SKIP'
+
+    def build(self):
+        self.window = Toplevel()
+        self.window.protocol("WM_DELETE_WINDOW", lambda: self.answer('SKIP', hide=True))
+        self.image_label = Label(self.window)
+        self.image_label.pack(pady=10)
+        self.name_label = Label(self.window)
+        self.name_label.pack(pady=10)
+        Label(self.window, text="Select the optimal resolution:").pack(pady=10)
+        self.button_frame = Frame(self.window)
+        self.button_frame.pack()
+        self.skip_button = Button(self.window, text="Skip", command=lambda: self.answer('SKIP'))
+        self.skip_button.pack(pady=10)
+
+    def show(self, image_name, data, resolutions):
+        if self.window is None or not self.window.winfo_exists():
+            self.build()
+        self.window.title(f"Select resolution for {image_name}")
+        photo = ImageTk.PhotoImage(Image.open(io.BytesIO(data))) if data else ''
+        self.image_label.config(image=photo)
+        self.image_label.image = photo
+        self.name_label.config(text=image_name)
+        for button in self.buttons:
+            button.destroy()
+        self.buttons = [Button(self.button_frame, text=f"{res[0]} x {res[1]}", command=lambda r=res: self.answer(r))
+                        for res in resolutions]
+        for button in self.buttons:
+            button.pack(pady=5)
+        self.skip_button.config(state='normal')
+        self.window.deiconify()
+        self.window.lift()
+
+    def answer(self, value, hide=False):
+        # Buttons stay disabled until the next image arrives, so one click is one answer.
+        for button in self.buttons + [self.skip_button]:
+            button.config(state='disabled')
+        if hide:
+            self.hide()
+        self.answers.put(value)
+
+    def hide(self):
+        if self.window is not None and self.window.winfo_exists():
+            self.window.withdraw()
+
+def update_image_count_label(input_dir, output_dir, image_count_label):
+    # Counting a large tree can take a while, so keep it off the Tk main loop.
+    # Tk variables may only be read on the main thread, so the output directory is passed in.
+    def count():
+        try:
+            image_count = count_images(input_dir, exclude_dirs=[output_dir])
+            post_event('call', lambda: image_count_label.config(text=f"{image_count} images currently selected in batch."))
+        except Exception as e:
+            logging.exception(e)
+
+    image_count_label.config(text="Counting images...")
+    threading.Thread(target=count, daemon=True).start()
+
+def update_directory_path(title, input_label_text, output_label_text, terminal, image_count_label=None):  # add terminal argument here
+    dir_path = filedialog.askdirectory(title=title)
+    if dir_path:
+        if title == 'Input Directory':
+            input_label_text.set(dir_path)
+        else:
+            output_label_text.set(dir_path)
+        save_last_selected_dirs(input_label_text.get(), output_label_text.get(), converter)
+        if image_count_label:
+            update_image_count_label(dir_path, output_label_text.get(), image_count_label)
+
+    
+        print_to_terminal(terminal, f"{title}: {dir_path}")
+    return dir_path
+
+def message_tag(message):
+    if "successfully" in message:
+        return "Success"
+    if "Error" in message or "error" in message:
+        return "Error"
+    return ()
+
+def append_to_terminal(terminal, messages):
+    # One insert and one scroll for the whole batch; only the newest TERMINAL_MAX_LINES lines are
+    # kept so a long run doesn't grow the widget without limit.
+    messages = messages[-TERMINAL_MAX_LINES:]
+    chunks = []
+    for message in messages:
+        chunks.extend((message + '\n', message_tag(message)))
+    terminal.config(state='normal')
+    terminal.insert(tk.END, *chunks)
+    excess = int(terminal.index('end-1c').split('.')[0]) - 1 - TERMINAL_MAX_LINES
+    if excess > 0:
+        terminal.delete('1.0', f'{excess + 1}.0')
+    terminal.config(state='disabled')
+    terminal.see(tk.END)
+
+def print_to_terminal(terminal, message):
+    # Main thread only; worker threads use post_event('message', ...).
+    append_to_terminal(terminal, [message])
+
+def drain_gui_events(root, terminal, progress, progress_text):
+    try:
+        apply_gui_events(terminal, progress, progress_text)
+    finally:
+        root.after(GUI_POLL_MS, drain_gui_events, root, terminal, progress, progress_text)
+
+def apply_gui_events(terminal, progress, progress_text):
+    messages = []
+    latest_progress = None
+    while True:
+        try:
+            kind, value = gui_events.get_nowait()
+        except queue.Empty:
+            break
+        if kind == 'message':
+            messages.append(value)
+        elif kind == 'progress':
+            # Only the newest position matters.
+            latest_progress = value
+        elif kind == 'call':
+            try:
+                value()
+            except Exception as e:
+                logging.exception(e)
+    if messages:
+        append_to_terminal(terminal, messages)
+    if latest_progress is not None:
+        processed_files, total_files = latest_progress
+        if total_files:
+            progress_value = min(processed_files / total_files, 1) * 100
+            progress['value'] = progress_value
+            progress_text.config(text=f"{processed_files}/{total_files} - {progress_value:.0f}%")
+        else:
+            # Still counting the input tree in the background.
+            progress_text.config(text=f"{processed_files}/?")
+
+def convert_and_resize_images(converter, input_dir, output_dir, batch_mode, resolution_choice, custom_width, custom_height, stop_button, resume_button, resume=False):
+    # Runs on a worker thread; every GUI update goes through post_event.
+    if converter.is_converting.is_set():
+        post_event('message', "A conversion process is already running.")
+        return
+    converter.is_converting.set()
+    try:
+        if resolution_choice == "Custom":
+            options = ConversionOptions(batch_mode, custom_width, custom_height, resume=resume, **converter.encoder_config)
+        else:
+            options = ConversionOptions(batch_mode, resume=resume, **converter.encoder_config)
+
+        for processed_files, total_files, result in iter_convert_images(converter, input_dir, output_dir, options, resolution_dialog):
+            post_event('progress', (processed_files, total_files))
+
+            message = format_result(result)
+            print(message)
+            post_event('message', message)
+            if result['status'] == 'error':
+                post_event('call', stop_button.grid_remove)
+
+        if converter.stop_event.is_set():
+            post_event('message', "Process was stopped.")
+
+    except Exception as e:
+        error_message = f'An error occurred: {e}'
+        print(error_message)
+        post_event('message', error_message)
+        logging.error(error_message)
+    finally: 
+        save_last_selected_dirs(input_dir, output_dir, converter)
+        converter.is_converting.clear()
+        post_event('call', stop_button.grid_remove)
+        post_event('call', resume_button.grid_remove)
+        post_event('call', resolution_dialog.hide)
+        logging.info("Conversion process stopped or completed.") 
+
+
+def on_stop_click(converter):
+    # The pipeline still finishes its in-flight files; convert_and_resize_images clears
+    # is_converting once it has, so Convert and Resume cannot start a second run meanwhile.
+    converter.stop_event.set()
+    logging.info("Stop button clicked.")
+
+def on_convert_click(converter, input_label_text, output_label_text, terminal, progress, resolution_choice, width_entry, height_entry, progress_text, stop_button, root):
+    if converter.is_converting.is_set():
+        print_to_terminal(terminal, "A conversion process is already running.")
+        return
+    converter.stop_event.clear()
+    input_dir = input_label_text.get()
+    output_dir = output_label_text.get()
+    save_last_selected_dirs(input_dir, output_dir, converter)
+    batch_mode = resolution_choice.get() == "Automatically"
+
+    if input_dir and output_dir:
+        stop_button.grid(row=10, columnspan=5, pady=10)
+        resume_button.grid(row=10, columnspan=5, pady=10)
+        threading.Thread(target=convert_and_resize_images, args=(converter, input_dir, output_dir, batch_mode, resolution_choice.get(), width_entry.get(), height_entry.get(), stop_button, resume_button)).start()
+    else:
+        error_message = 'No directory selected. Exiting.'
+        print_to_terminal(terminal, error_message)
+        logging.error(error_message)
+    
+
+def on_resume_click(converter, input_label, output_label, terminal, progress, resolution_choice, width_entry, height_entry, progress_text, stop_button, root):
+    if converter.is_converting.is_set():
+        print_to_terminal(terminal, "A conversion process is already running.")
+        return
+    converter.stop_event.clear()
+    input_dir = input_label.cget("text")
+    output_dir = output_label.cget("text")
+    batch_mode = resolution_choice.get() == "Automatically"
+
+    if input_dir and output_dir:
+        stop_button.grid(row=10, columnspan=5, pady=10)
+        threading.Thread(target=convert_and_resize_images, args=(converter, input_dir, output_dir, batch_mode, resolution_choice.get(), width_entry.get(), height_entry.get(), stop_button, resume_button, True)).start()
+
+    else:
+        error_message = 'No directory selected. Exiting.'
+        print_to_terminal(terminal, error_message)
+        logging.error(error_message)
+
+
+
+def show_about_window(converter):
+    about_window = Toplevel()
+    about_window.title("About")
+    
+    frame = Frame(about_window)  
+    frame.pack(fill='both', expand=True, padx=10, pady=10)  
+
+    author_label = Label(frame, text="Author: Austin Scheller", anchor='w', justify='left', width=50)  
+    author_label.grid(sticky='w', row=0, column=0, padx=5, pady=5)  
+
+    email_label = Label(frame, text="Email: austinscheller1@gmail.com", anchor='w', justify='left', width=50)
+    email_label.grid(sticky='w', row=1, column=0, padx=5, pady=5)
+
+    files_label = Label(frame, text=f"Total Files Converted: {converter.stats.total_files_converted}", anchor='w', justify='left', width=50)
+    files_label.grid(sticky='w', row=2, column=0, padx=5, pady=5)
+
+    space_saved_label = Label(frame, text=f"Space Saved: {converter.stats.total_space_saved / (1024 * 1024):.2f} MB", anchor='w', justify='left', width=50)
+    space_saved_label.grid(sticky='w', row=3, column=0, padx=5, pady=5)
+
+    duplicates_label = Label(frame, text=f"Duplicates Reused: {converter.stats.duplicates_reused}", anchor='w', justify='left', width=50)
+    duplicates_label.grid(sticky='w', row=4, column=0, padx=5, pady=5)
+
+    about_window.mainloop()
+
+
+def update_entry_visibility(resolution_choice, dimension_frame):
+    if resolution_choice.get() == "Custom":
+        dimension_frame.grid()
+    else:
+        dimension_frame.grid_remove()
+
+def initialize_gui():
+    global converter  
+    global resume_button 
+    global resolution_dialog
+
+
+    input_dir, output_dir, config = get_last_selected_dirs()
+    converter = ImageConverter(config) 
+    converter.setup_logging() 
+    preview_cache = PreviewCache()
+    resolution_dialog = ResolutionDialog(converter, preview_cache)
+
+    root = ThemedTk(theme="Breeze")
+    root.title("Image Converter")
+    root.iconbitmap('icons/icon.ico')
+
+    global input_label_text 
+    global output_label_text
+
+    input_label_text = tk.StringVar() 
+    output_label_text = tk.StringVar()
+
+    menu = Menu(root)
+    help_menu = Menu(menu, tearoff=0)
+    help_menu.add_command(label="Documentation", command=open_documentation)
+    menu.add_cascade(label="Help", menu=help_menu)
+    root.config(menu=menu)
+
+    about_menu = Menu(menu, tearoff=0)
+    about_menu.add_command(label="About", command=lambda: show_about_window(converter))
+    menu.add_cascade(label="About", menu=about_menu)
+
+    main_frame = Frame(root, padding="10")
+    main_frame.grid(sticky=(tk.E, tk.W, tk.N, tk.S), padx=10, pady=10)
+
+    input_frame = Frame(main_frame)
+    input_frame.grid(row=0, column=0, sticky='ew', padx=5, pady=5)
+
+    input_icon = ImageTk.PhotoImage(Image.open('icons/input_icon.png'))
+    input_button = tk.Button(input_frame, image=input_icon, compound=tk.LEFT, command=lambda: update_directory_path('Input Directory', input_label_text, output_label_text, terminal))
+    input_button.grid(row=0, column=0)
+
+    input_label = tk.Label(input_frame, text=input_dir)
+    input_label.grid(row=0, column=1)
+    
+
+    arrow_label = tk.Label(input_frame, text=' > ', font=("Helvetica", 14))
+    arrow_label.grid(row=0, column=2)
+
+    output_icon = ImageTk.PhotoImage(Image.open('icons/output_icon.png'))
+    output_button = tk.Button(input_frame, image=output_icon, compound=tk.LEFT, command=lambda: update_directory_path('Output Directory', input_label_text, output_label_text, terminal))
+    output_button.grid(row=0, column=3)
+    
+
+    output_label = tk.Label(input_frame, text=output_dir)  
+    output_label.grid(row=0, column=4)
+    
+
+    resolution_choice = tk.StringVar(value="Automatically")
+    auto_radio = tk.Radiobutton(root, text="Recommended dimensions", variable=resolution_choice, value="Automatically",
+    state='disabled')  
+    auto_radio.grid(row=2, columnspan=3, sticky='w', padx=20)
+    custom_radio = tk.Radiobutton(root, text="Specify dimensions", variable=resolution_choice, value="Custom",
+    state='disabled')  
+    custom_radio.grid(row=3, column=0, sticky='w', padx=20)
+
+    dimension_frame = Frame(root)  
+    dimension_frame.grid(row=4, column=0, columnspan=2, sticky='ew', padx=5, pady=5)
+    dimension_frame.grid_remove()  
+
+
+    width_frame = Frame(dimension_frame)  
+    width_frame.pack(fill='x', padx=5, pady=5)  
+
+    width_label = tk.Label(width_frame, text="Width:")  
+    width_label.pack(side='left') 
+
+    width_entry = tk.Entry(width_frame)  
+    width_entry.pack(side='left', expand=True, fill='x')  
+    height_frame = Frame(dimension_frame)  
+    height_frame.pack(fill='x', padx=5, pady=5)  
+
+    height_label = tk.Label(height_frame, text="Height:")  
+    height_label.pack(side='left')  
+
+    height_entry = tk.Entry(height_frame)  
+    height_entry.pack(side='left', expand=True, fill='x')  
+
+    image_count_label = tk.Label(root, text="", font=("Helvetica", 12))
+    image_count_label.grid(row=5, column=0, columnspan=5, pady=5, sticky='ew')
+
+    convert_icon = ImageTk.PhotoImage(Image.open('icons/convert_icon.png'))
+    convert_button = tk.Button(root, text="Convert", image=convert_icon, compound=tk.LEFT,
+                           command=lambda: on_convert_click(converter, input_label_text, output_label_text, terminal, progress, resolution_choice, width_entry, height_entry, progress_text, stop_button, root))  
+
+    convert_button.grid(row=7, columnspan=5, pady=10)
+
+    terminal = ScrolledText.ScrolledText(main_frame, state='disabled', width=80, height=20, wrap='word', fg='green', bg='black', font=("Fixedsys", 12))
+    terminal.grid(row=6, column=0, columnspan=5, padx=5, pady=5, sticky='ew')
+    terminal.tag_config("Success", foreground='green')
+    terminal.tag_config("Error", foreground='red')
+
+    progress = Progressbar(main_frame, orient='horizontal', length=400, mode='determinate')
+    progress.grid(row=8, column=0, columnspan=5, padx=5, pady=5, sticky='ew')  
+    progress_text = tk.Label(main_frame, text="")
+    progress_text.grid(row=7, column=0, columnspan=5, pady=5, sticky='ew') 
+    
+
+
+    for col in range(5):
+        main_frame.grid_columnconfigure(col, weight=1)
+    main_frame.grid_rowconfigure(6, weight=1)  
+
+    button_frame = Frame(root)  
+    button_frame.grid(row=10, columnspan=5, pady=10)  
+
+    stop_icon = ImageTk.PhotoImage(Image.open('icons/stop_icon.png'))
+    stop_button = tk.Button(button_frame, text="Stop", image=stop_icon, compound=tk.LEFT, command=lambda: on_stop_click(converter))
+    stop_button.grid(row=0, column=0, padx=5)  
+
+    
+
+    resume_icon = ImageTk.PhotoImage(Image.open('icons/resume_icon.png'))
+    resume_button = tk.Button(button_frame, text="Resume", image=resume_icon, compound=tk.LEFT, 
+                              command=lambda: on_resume_click(converter, input_label, output_label, terminal, 
+                                                               progress, resolution_choice, width_entry, 
+                                                               height_entry, progress_text, stop_button, root))
+    resume_button.grid(row=0, column=1, padx=5)
+    resume_button.grid_remove()
+    stop_button.grid_remove()  
+    
+
+
+    
+
+    # Load last selected directories
+    if input_dir and output_dir:
+        input_label_text.set(input_dir)
+        output_label_text.set(output_dir)
+        update_image_count_label(input_dir, output_dir, image_count_label)
+        print_to_terminal(terminal, f"Input Directory: {input_dir}")
+        print_to_terminal(terminal, f"Output Directory: {output_dir}")
+    else:
+        print_to_terminal(terminal, "Input Directory: Not selected")
+        print_to_terminal(terminal, "Output Directory: Not selected")
+
+    resolution_choice.trace_add('write', lambda *args: update_entry_visibility(resolution_choice, dimension_frame))
+
+    doc_icon = ImageTk.PhotoImage(Image.open('icons/document_icon.png'))
+    help_menu.entryconfig('Documentation', image=doc_icon, compound=tk.LEFT)
+
+    input_label.grid_remove()
+    output_label.grid_remove()
+    root.after(GUI_POLL_MS, drain_gui_events, root, terminal, progress, progress_text)
+    root.mainloop()
+    preview_cache.close()
+
+
+def open_documentation():
+    # open for future documentation
+    pass
+
+
+def main():
+    logging.basicConfig(filename='errors.log', level=logging.ERROR, 
+                        format='%(asctime)s - %(levelname)s - %(message)s')
+    try:
+        initialize_gui()
+    except Exception as e:
+        print(f"Exception: {e}")
+        logging.exception(f"Exception: {e}")
+
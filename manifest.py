@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+from urllib.parse import quote
+
+MANIFEST_FILE = '.img_convert_manifest.sqlite'
+COMMIT_INTERVAL = 2.0  # seconds
+COMMIT_EVERY = 500  # records
+SCHEMA_VERSION = 3
+
+
+def data_digest(data):
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _format_dhash(dhash):
+    # Hex text: a 64-bit hash does not fit SQLite's signed INTEGER.
+    return None if dhash is None else f'{dhash:016x}'
+
+
+class ConversionManifest:
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.read_only = read_only
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+        if read_only:
+            # For dry runs: nothing is written, migrated or checkpointed. Even a read-only WAL reader
+            # creates -wal and -shm files; with no -wal present no writer has the database open, so
+            # it is opened immutable and nothing appears beside it.
+            uri = f'file:{quote(os.path.abspath(path))}?mode=ro'
+            if not os.path.exists(path + '-wal'):
+                uri += '&immutable=1'
+            self.connection = sqlite3.connect(uri, uri=True)
+            version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+            # A layout a real run would drop holds nothing it would skip.
+            self.stale = version not in (2, SCHEMA_VERSION)
+            return
+        self.stale = False
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        version = self.connection.execute('PRAGMA user_version').fetchone()[0]
+        if version == 2:
+            # Version 3 only adds the perceptual hash; keep the recorded work.
+            self.connection.execute('ALTER TABLE files ADD COLUMN dhash TEXT')
+            self.connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        elif version != SCHEMA_VERSION:
+            # The manifest is only a cache of past work; an old layout is dropped and rebuilt.
+            self.connection.execute('DROP TABLE IF EXISTS files')
+            self.connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS files (
+                input_key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                content_hash TEXT,
+                params TEXT NOT NULL,
+                output_base TEXT NOT NULL,
+                outputs TEXT NOT NULL,
+                converted_at REAL NOT NULL,
+                dhash TEXT
+            )''')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS files_output_base ON files (output_base)')
+        self.connection.commit()
+
+    def lookup(self, input_key):
+        if self.stale:
+            return None
+        return self.connection.execute(
+            'SELECT size, mtime_ns, content_hash, params, output_base, outputs FROM files WHERE input_key = ?',
+            (input_key,)).fetchone()
+
+    def is_up_to_date(self, input_key, input_path, input_size, mtime_ns, params, output_base, verify_hash=False):
+        row = self.lookup(input_key)
+        if row is None:
+            return False
+        size, recorded_mtime_ns, content_hash, recorded_params, recorded_base, outputs = row
+        if recorded_params != params or size != input_size or recorded_base != output_base:
+            return False
+        try:
+            for output_path, output_size in json.loads(outputs):
+                if os.path.getsize(output_path) != output_size:
+                    return False
+        except OSError:
+            return False
+        if recorded_mtime_ns == mtime_ns:
+            return True
+        # Touched or copied but possibly identical: compare contents before reconverting.
+        if verify_hash and content_hash and file_digest(input_path) == content_hash:
+            if not self.read_only:
+                self.connection.execute('UPDATE files SET mtime_ns = ? WHERE input_key = ?', (mtime_ns, input_key))
+                self._maybe_commit()
+            return True
+        return False
+
+    def record(self, input_key, size, mtime_ns, params, output_base, outputs, content_hash=None, dhash=None):
+        # outputs is a list of (path, size) pairs, one per rendition written.
+        self.connection.execute(
+            'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (input_key, size, mtime_ns, content_hash, params, output_base, json.dumps(outputs), time.time(),
+             _format_dhash(dhash)))
+        self._maybe_commit()
+
+    def output_owner(self, output_base, input_key):
+        # Another input recorded as writing to output_base, if any.
+        if self.stale:
+            return None
+        row = self.connection.execute('SELECT input_key FROM files WHERE output_base = ? AND input_key != ? LIMIT 1',
+                                      (output_base, input_key)).fetchone()
+        return row[0] if row else None
+
+    def lookup_dhash(self, input_key):
+        row = self.connection.execute('SELECT dhash FROM files WHERE input_key = ?', (input_key,)).fetchone()
+        return int(row[0], 16) if row and row[0] else None
+
+    def set_dhash(self, input_key, dhash):
+        self.connection.execute('UPDATE files SET dhash = ? WHERE input_key = ?', (_format_dhash(dhash), input_key))
+        self._maybe_commit()
+
+    def _maybe_commit(self):
+        # Committing every record is slow on big trees; batch them and accept redoing a few files after a crash.
+        self.uncommitted += 1
+        if self.uncommitted >= COMMIT_EVERY or time.monotonic() - self.last_commit >= COMMIT_INTERVAL:
+            self.commit()
+
+    def commit(self):
+        if self.read_only:
+            return
+        try:
+            self.connection.commit()
+        except sqlite3.Error as e:
+            logging.exception(e)
+        self.uncommitted = 0
+        self.last_commit = time.monotonic()
+
+    def close(self):
+        self.commit()
+        self.connection.close()
@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import math
+import time
+from collections import deque
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Per-file stages in pipeline order. 'compute' covers open through encode and is what the
+# worker processes spend; read and write run on the I/O threads.
+FILE_STAGES = ('read', 'open', 'orientation', 'resize', 'encode', 'write')
+PIPELINE_STAGES = ('read', 'compute', 'write')
+QUANTILES = (0.5, 0.9, 0.99)
+METRIC_PREFIX = 'img_convert'
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    if sys.platform == 'darwin':
+        peak /= 1024
+    return peak / 1024
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    # Nearest rank; plenty for latency reporting and needs no interpolation rules.
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Stopwatch:
+    # Adds the time since the previous lap to the named stage, so a stage can be timed in
+    # several pieces (e.g. one resize per rendition).
+    def __init__(self, timings=None):
+        self.timings = timings if timings is not None else {}
+        self.last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0.0) + now - self.last
+        self.last = now
+
+    def restart(self):
+        # Drop the time since the last lap, e.g. while waiting for the user.
+        self.last = time.perf_counter()
+
+
+class RunMetrics:
+    # max_samples bounds the per-stage latency samples kept for the percentiles, for runs that
+    # never end; counters, busy time and the latency sums and counts always cover the whole run.
+    def __init__(self, threads, max_samples=None):
+        self.started = time.perf_counter()
+        self.threads = threads
+        self.status_counts = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.peak_rss_mb = None
+        self.latencies = {stage: deque(maxlen=max_samples) for stage in FILE_STAGES + ('total',)}
+        self.latency_sum = dict.fromkeys(self.latencies, 0.0)
+        self.latency_count = dict.fromkeys(self.latencies, 0)
+        self.busy = {stage: 0.0 for stage in PIPELINE_STAGES}
+
+    def add(self, result):
+        status = result['status']
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        timings = result.get('timings')
+        if not timings:
+            return
+        for stage, seconds in timings.items():
+            if stage in self.busy:
+                self.busy[stage] += seconds
+            if stage in self.latencies:
+                self._add_latency(stage, seconds)
+        self._add_latency('total', sum(timings.get(stage, 0.0) for stage in PIPELINE_STAGES))
+        if status == 'converted':
+            self.bytes_in += result.get('old_size') or 0
+            self.bytes_out += result.get('new_size') or 0
+        rss = result.get('peak_rss_mb')
+        if rss is not None and (self.peak_rss_mb is None or rss > self.peak_rss_mb):
+            self.peak_rss_mb = rss
+
+    def _add_latency(self, stage, seconds):
+        self.latencies[stage].append(seconds)
+        self.latency_sum[stage] += seconds
+        self.latency_count[stage] += 1
+
+    def summary(self):
+        wall = time.perf_counter() - self.started
+        converted = self.status_counts.get('converted', 0)
+        latency = {}
+        for stage, values in self.latencies.items():
+            if not values:
+                continue
+            values = sorted(values)
+            latency[stage] = {f'p{round(q * 100)}': round(percentile(values, q), 4) for q in QUANTILES}
+            latency[stage]['max'] = round(values[-1], 4)
+        stages = {}
+        for stage, busy in self.busy.items():
+            capacity = wall * self.threads.get(stage, 1)
+            stages[stage] = {
+                'busy_s': round(busy, 3),
+                'threads': self.threads.get(stage, 1),
+                'utilization': round(busy / capacity, 3) if capacity else 0.0,
+            }
+        timed = bool(self.latencies['total'])
+        return {
+            'wall_s': round(wall, 3),
+            'files': dict(self.status_counts),
+            'files_per_s': round(converted / wall, 3) if wall else 0.0,
+            'mb_in_per_s': round(self.bytes_in / 1e6 / wall, 3) if wall else 0.0,
+            'mb_out_per_s': round(self.bytes_out / 1e6 / wall, 3) if wall else 0.0,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'peak_rss_mb': round(self.peak_rss_mb, 1) if self.peak_rss_mb is not None else None,
+            'latency_s': latency,
+            'stages': stages,
+            'bottleneck': max(stages, key=lambda stage: stages[stage]['utilization']) if timed else None,
+        }
+
+    def to_prometheus(self):
+        summary = self.summary()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f'# HELP {METRIC_PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {METRIC_PREFIX}_{name} {kind}')
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{val}"' for key, val in labels.items())
+                lines.append(f'{METRIC_PREFIX}_{name}{{{label_text}}} {value}' if label_text
+                             else f'{METRIC_PREFIX}_{name} {value}')
+
+        metric('files_total', 'counter', 'Files handled, by result status.',
+               [({'status': status}, count) for status, count in sorted(self.status_counts.items())])
+        metric('input_bytes_total', 'counter', 'Bytes read from converted inputs.', [({}, self.bytes_in)])
+        metric('output_bytes_total', 'counter', 'Bytes written to outputs.', [({}, self.bytes_out)])
+        metric('run_seconds', 'gauge', 'Wall time of the run so far.', [({}, summary['wall_s'])])
+        metric('files_per_second', 'gauge', 'Converted files per second of wall time.',
+               [({}, summary['files_per_s'])])
+        metric('stage_utilization', 'gauge', 'Busy fraction of each pipeline stage.',
+               [({'stage': stage}, info['utilization']) for stage, info in summary['stages'].items()])
+        if self.peak_rss_mb is not None:
+            metric('peak_rss_bytes', 'gauge', 'Highest peak RSS reported by any converting process.',
+                   [({}, int(self.peak_rss_mb * 1024 * 1024))])
+        samples = []
+        for stage, values in self.latencies.items():
+            if not values:
+                continue
+            values = sorted(values)
+            samples.extend(({'stage': stage, 'quantile': str(q)}, round(percentile(values, q), 6)) for q in QUANTILES)
+        metric('stage_seconds', 'summary', 'Per-file time spent in each stage.', samples)
+        for stage, count in self.latency_count.items():
+            if count:
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {round(self.latency_sum[stage], 6)}')
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_count{{stage="{stage}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        # Replaced atomically so a node_exporter textfile collector never reads half a file.
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w') as file:
+            file.write(self.to_prometheus())
+        os.replace(temp_path, path)
+
+
+class TraceWriter:
+    # One JSON line per file, then the run summary; easy to diff between runs or load into pandas.
+    def __init__(self, path):
+        self.file = open(path, 'a')
+
+    def file_record(self, result):
+        record = {key: result.get(key) for key in ('rel_path', 'status', 'old_size', 'new_size', 'original_size',
+                                                   'size', 'quality', 'peak_rss_mb', 'error')}
+        record['timings'] = {stage: round(seconds, 6) for stage, seconds in result.get('timings', {}).items()}
+        self._write({'event': 'file', 'time': time.time(), **record})
+
+    def summary(self, summary):
+        self._write({'event': 'summary', 'time': time.time(), **summary})
+
+    def _write(self, record):
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
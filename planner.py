@@ -0,0 +1,189 @@
+import os
+import math
+import time
+import random
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from engine import (ConversionOptions, get_scan_options, get_output_base, get_exif_orientation, get_oriented_size,
+                    get_rendition_sizes, read_source, render_image, write_outputs, resolve_workers, open_manifest,
+                    is_unchanged)
+from scanner import scan_images
+
+SAMPLE_SIZE = 24
+HEADER_CHUNK = 256  # files whose headers are read per batch of the I/O threads
+
+
+def read_header(entry, options):
+    # Format, dimensions and orientation from the file header; no pixels are decoded.
+    with Image.open(entry.path) as img:
+        orientation = get_exif_orientation(img)
+        original_size = get_oriented_size(img, orientation)
+        sizes = get_rendition_sizes(original_size, options)
+        return {
+            'entry': entry,
+            'format': img.format,
+            'pixels': img.width * img.height,
+            'target_pixels': sum(width * height for width, height in sizes),
+        }
+
+
+def _read_header(entry, options):
+    try:
+        return read_header(entry, options)
+    except (IOError, ValueError, Image.DecompressionBombError):
+        return None
+
+
+def ratio_estimate(ys, xs, total_x, population):
+    # Ratio estimator of the population total of y from a simple random sample, with its
+    # standard error. y (output bytes, seconds) roughly scales with x (pixels, bytes), so this
+    # is far tighter than scaling the sample mean by the file count.
+    n, sum_x = len(xs), sum(xs)
+    if not n or not sum_x:
+        return None, None
+    ratio = sum(ys) / sum_x
+    if n < 2:
+        return ratio * total_x, None
+    residuals = sum((y - ratio * x) ** 2 for y, x in zip(ys, xs)) / (n - 1)
+    variance = population ** 2 * (1 - n / population) * residuals / n
+    return ratio * total_x, math.sqrt(max(variance, 0.0))
+
+
+def sample_conversions(sample, options):
+    # The sampled files go through the real read, render and write stages; outputs land in a
+    # temporary directory that is removed afterwards.
+    measured = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for index, header in enumerate(sample):
+            entry = header['entry']
+            try:
+                source = read_source(entry.path, options)
+            except OSError:
+                continue
+            result = render_image(source, entry.path, os.path.join(output_dir, str(index)), options)
+            if result['status'] == 'converted':
+                result = write_outputs(result)
+            if result['status'] != 'converted':
+                continue
+            timings = result['timings']
+            measured.append({**header, 'old_size': result['old_size'], 'new_size': result['new_size'],
+                             'read_s': timings.get('read', 0.0), 'compute_s': timings.get('compute', 0.0),
+                             'write_s': timings.get('write', 0.0)})
+    return measured
+
+
+def project_time(read_s, compute_s, write_s, workers, io_threads):
+    # The pipeline runs its stages side by side, so the slowest one sets the pace. Compute
+    # scales with workers only up to the number of CPUs.
+    cpus = os.cpu_count() or 1
+    stages = {
+        'read': read_s / io_threads,
+        'compute': compute_s / min(workers, cpus),
+        'write': write_s,
+    }
+    bottleneck = max(stages, key=stages.get)
+    return {'workers': workers, 'wall_s': round(stages[bottleneck], 1), 'bottleneck': bottleneck}
+
+
+def default_worker_counts(options):
+    cpus = os.cpu_count() or 1
+    counts = {1, resolve_workers(options.workers)}
+    count = 2
+    while count <= cpus:
+        counts.add(count)
+        count *= 2
+    counts.add(cpus)
+    return sorted(counts)
+
+
+def plan_conversion(input_dir, output_dir, options=None, sample_size=SAMPLE_SIZE, seed=0, worker_counts=None,
+                    stop_event=None, on_progress=None):
+    # Dry run: what converting input_dir would do, without writing to output_dir. Every header is
+    # read; only a seeded random sample of sample_size files is decoded and encoded.
+    options = options or ConversionOptions()
+    started = time.perf_counter()
+    scan_options = get_scan_options(options, output_dir)
+    manifest = open_manifest(output_dir, options, read_only=True)
+    params = options.fingerprint()
+    rng = random.Random(seed)
+    sample = []
+    totals = {'files': 0, 'unchanged': 0, 'unreadable': 0, 'convert': 0, 'input_bytes': 0, 'pixels': 0,
+              'target_pixels': 0}
+    formats = {}
+    stopped = False
+
+    entries = scan_images(input_dir, **scan_options)
+    try:
+        with ThreadPoolExecutor(max_workers=options.io_threads) as pool:
+            while not stopped:
+                chunk = [entry for _, entry in zip(range(HEADER_CHUNK), entries)]
+                if not chunk:
+                    break
+                totals['files'] += len(chunk)
+                todo = [entry for entry in chunk if not is_unchanged(
+                    manifest, entry, params, get_output_base(output_dir, entry.rel_path, options), options)]
+                totals['unchanged'] += len(chunk) - len(todo)
+                for header in pool.map(_read_header, todo, [options] * len(todo)):
+                    if header is None:
+                        totals['unreadable'] += 1
+                        continue
+                    totals['convert'] += 1
+                    totals['input_bytes'] += header['entry'].size
+                    totals['pixels'] += header['pixels']
+                    totals['target_pixels'] += header['target_pixels']
+                    formats[header['format']] = formats.get(header['format'], 0) + 1
+                    # Reservoir sampling keeps a uniform sample without holding every header.
+                    if len(sample) < sample_size:
+                        sample.append(header)
+                    else:
+                        index = rng.randrange(totals['convert'])
+                        if index < sample_size:
+                            sample[index] = header
+                if on_progress is not None:
+                    on_progress(totals['files'])
+                stopped = stop_event is not None and stop_event.is_set()
+    finally:
+        if manifest is not None:
+            manifest.close()
+    scan_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    measured = sample_conversions(sample, options) if not stopped else []
+    sample_s = time.perf_counter() - started
+
+    population = totals['convert']
+    output_bytes, output_error = ratio_estimate([item['new_size'] for item in measured],
+                                                [item['target_pixels'] for item in measured],
+                                                totals['target_pixels'], population)
+    read_s, _ = ratio_estimate([item['read_s'] for item in measured], [item['old_size'] for item in measured],
+                               totals['input_bytes'], population)
+    compute_s, _ = ratio_estimate([item['compute_s'] for item in measured], [item['pixels'] for item in measured],
+                                  totals['pixels'], population)
+    write_s, _ = ratio_estimate([item['write_s'] for item in measured], [item['new_size'] for item in measured],
+                                output_bytes or 0, population)
+    projection = None
+    if output_bytes is not None:
+        saved = totals['input_bytes'] - output_bytes
+        projection = {
+            'output_bytes': round(output_bytes),
+            'output_bytes_stderr': round(output_error) if output_error is not None else None,
+            'saved_bytes': round(saved),
+            'saved_percent': round(100 * saved / totals['input_bytes'], 1) if totals['input_bytes'] else 0.0,
+            'cpu_s': {'read': round(read_s, 1), 'compute': round(compute_s, 1), 'write': round(write_s, 1)},
+            'time': [project_time(read_s, compute_s, write_s, workers, options.io_threads)
+                     for workers in (worker_counts or default_worker_counts(options))],
+        }
+    return {
+        **totals,
+        'formats': formats,
+        'stopped': stopped,
+        'scan_s': round(scan_s, 2),
+        'sample': {
+            'files': len(measured),
+            'seconds': round(sample_s, 2),
+            'input_bytes': sum(item['old_size'] for item in measured),
+            'output_bytes': sum(item['new_size'] for item in measured),
+        },
+        'projection': projection,
+    }
@@ -0,0 +1,201 @@
+import io
+import os
+import struct
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from engine import get_exif_orientation, swaps_axes, apply_draft, correct_image_orientation
+
+PREVIEW_SIZE = (300, 300)
+PREVIEW_CACHE_DIR = 'preview_cache'
+MEMORY_ITEMS = 64
+DISK_BYTES = 64 * 1024 * 1024
+PREFETCH_THREADS = 2
+# An embedded thumbnail whose aspect ratio is off by more than this has letterbox bars.
+ASPECT_TOLERANCE = 0.02
+EXIF_HEADER = b'Exif\x00\x00'
+THUMBNAIL_OFFSET_TAG = 0x0201
+THUMBNAIL_LENGTH_TAG = 0x0202
+
+
+def exif_thumbnail(img):
+    # The JPEG a camera stores in IFD1 of the EXIF block, found by walking the TIFF structure;
+    # nothing of the main image is decoded.
+    exif = img.info.get('exif')
+    if not exif:
+        return None
+    tiff = exif[len(EXIF_HEADER):] if exif.startswith(EXIF_HEADER) else exif
+    try:
+        order = {b'II': '<', b'MM': '>'}[tiff[:2]]
+        ifd = struct.unpack_from(order + 'I', tiff, 4)[0]
+        count = struct.unpack_from(order + 'H', tiff, ifd)[0]
+        ifd = struct.unpack_from(order + 'I', tiff, ifd + 2 + count * 12)[0]
+        if not ifd:
+            return None
+        tags = {}
+        for index in range(struct.unpack_from(order + 'H', tiff, ifd)[0]):
+            tag, kind = struct.unpack_from(order + 'HH', tiff, ifd + 2 + index * 12)
+            # SHORT values sit in the first two bytes of the value field.
+            value_format = order + ('H' if kind == 3 else 'I')
+            tags[tag] = struct.unpack_from(value_format, tiff, ifd + 10 + index * 12)[0]
+    except (KeyError, struct.error):
+        return None
+    offset, length = tags.get(THUMBNAIL_OFFSET_TAG), tags.get(THUMBNAIL_LENGTH_TAG)
+    if not offset or not length:
+        return None
+    data = tiff[offset:offset + length]
+    return data if data.startswith(b'\xff\xd8') else None
+
+
+def _usable_thumbnail(data, img, box):
+    try:
+        thumbnail = Image.open(io.BytesIO(data))
+        thumbnail.load()
+    except (IOError, ValueError):
+        return None
+    width, height = img.size
+    ratio = thumbnail.width / thumbnail.height
+    if abs(ratio - width / height) > ASPECT_TOLERANCE * width / height:
+        return None
+    if thumbnail.width < box[0] and thumbnail.height < box[1]:
+        return None  # would have to be scaled up
+    return thumbnail
+
+
+def make_preview(path, size=PREVIEW_SIZE):
+    # JPEG bytes of an upright preview that fits size. Uses the embedded EXIF thumbnail when it
+    # is big enough, otherwise decodes at the smallest DCT scale that still covers size.
+    with Image.open(path) as img:
+        orientation = get_exif_orientation(img)
+        # Scale the stored pixels and rotate the small result.
+        box = (size[1], size[0]) if swaps_axes(orientation) else size
+        data = exif_thumbnail(img)
+        preview = _usable_thumbnail(data, img, box) if data else None
+        if preview is None:
+            apply_draft(img, size, orientation)
+            img.load()
+            preview = img
+        preview.thumbnail(box)
+        preview = correct_image_orientation(preview, orientation)
+        if preview.mode != 'RGB':
+            preview = preview.convert('RGB')
+        buffer = io.BytesIO()
+        preview.save(buffer, 'JPEG', quality=85)
+    return buffer.getvalue()
+
+
+class PreviewCache:
+    # Encoded previews keyed by path, mtime and size: the newest MEMORY_ITEMS in memory and up to
+    # DISK_BYTES on disk, both evicted least recently used first. prefetch() builds them on
+    # background threads so get() rarely has to wait for a decode.
+    def __init__(self, cache_dir=PREVIEW_CACHE_DIR, size=PREVIEW_SIZE, memory_items=MEMORY_ITEMS,
+                 disk_bytes=DISK_BYTES, threads=PREFETCH_THREADS):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.memory_items = memory_items
+        self.disk_bytes = disk_bytes
+        self.lock = threading.Lock()
+        self.memory = OrderedDict()
+        self.pending = {}
+        self.disk = OrderedDict()  # file name -> bytes, oldest first
+        self.disk_total = 0
+        self.pool = ThreadPoolExecutor(max_workers=threads)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            with os.scandir(cache_dir) as it:
+                files = [entry for entry in it if entry.is_file() and not entry.name.startswith('.')]
+            for entry in sorted(files, key=lambda entry: entry.stat().st_mtime):
+                self.disk[entry.name] = entry.stat().st_size
+                self.disk_total += entry.stat().st_size
+
+    def _key(self, path):
+        stat = os.stat(path)
+        text = f'{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}|{self.size[0]}x{self.size[1]}'
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+    def _remember(self, key, data):
+        with self.lock:
+            self.memory[key] = data
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_items:
+                self.memory.popitem(last=False)
+
+    def _load(self, key, path):
+        if self.cache_dir:
+            try:
+                with open(os.path.join(self.cache_dir, key), 'rb') as file:
+                    data = file.read()
+                with self.lock:
+                    if key in self.disk:
+                        self.disk.move_to_end(key)
+                return data
+            except OSError:
+                pass
+        data = make_preview(path, self.size)
+        if self.cache_dir:
+            self._store(key, data)
+        return data
+
+    def _store(self, key, data):
+        temp_path = os.path.join(self.cache_dir, f'.{key}.tmp')
+        try:
+            with open(temp_path, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, os.path.join(self.cache_dir, key))
+        except OSError as e:
+            logging.warning(f"Could not cache preview: {e}")
+            return
+        evicted = []
+        with self.lock:
+            self.disk_total += len(data) - self.disk.pop(key, 0)
+            self.disk[key] = len(data)
+            while self.disk_total > self.disk_bytes and len(self.disk) > 1:
+                name, size = self.disk.popitem(last=False)
+                self.disk_total -= size
+                evicted.append(name)
+        for name in evicted:
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+
+    def _build(self, key, path):
+        try:
+            data = self._load(key, path)
+            self._remember(key, data)
+            return data
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def _future(self, path):
+        key = self._key(path)
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return None, self.memory[key]
+            future = self.pending.get(key)
+            if future is None:
+                future = self.pending[key] = self.pool.submit(self._build, key, path)
+        return future, None
+
+    def prefetch(self, path):
+        try:
+            self._future(path)
+        except OSError:
+            pass  # reported when the file itself is converted
+
+    def get(self, path):
+        # Preview bytes for path, or None if it cannot be read.
+        try:
+            future, data = self._future(path)
+            return data if future is None else future.result()
+        except (OSError, ValueError, Image.DecompressionBombError) as e:
+            logging.warning(f"Could not make a preview of {path}: {e}")
+            return None
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,90 @@
+import os
+import logging
+import threading
+from fnmatch import fnmatch
+from collections import namedtuple
+
+DEFAULT_EXTENSIONS = ('.jpg', '.jpeg')
+
+ScanEntry = namedtuple('ScanEntry', ['path', 'rel_path', 'size', 'mtime_ns'])
+
+
+def normalize_extensions(extensions):
+    extensions = extensions or DEFAULT_EXTENSIONS
+    return tuple(ext.lower() if ext.startswith('.') else '.' + ext.lower() for ext in extensions)
+
+
+def _matches(rel_path, patterns):
+    name = rel_path.rsplit('/', 1)[-1]
+    return any(fnmatch(rel_path, pattern) or fnmatch(name, pattern) for pattern in patterns)
+
+
+def accepts(rel_path, extensions, include=(), exclude=()):
+    # The same file filter scan_images() applies, for paths that arrive some other way.
+    if not rel_path.lower().endswith(extensions):
+        return False
+    if include and not _matches(rel_path, include):
+        return False
+    return not (exclude and _matches(rel_path, exclude))
+
+
+def accepts_directory(rel_dir, exclude=()):
+    # Whether scan_images() would descend into every directory on rel_dir ('a/b').
+    parts = rel_dir.split('/') if rel_dir else []
+    return not any(_matches('/'.join(parts[:depth]), exclude) for depth in range(1, len(parts) + 1))
+
+
+def scan_images(root, recursive=True, extensions=None, include=None, exclude=None, exclude_dirs=()):
+    # Walks lazily, one directory at a time, so callers can start work before the walk ends.
+    # Entries are sorted within each directory to keep the order repeatable between runs.
+    extensions = normalize_extensions(extensions)
+    include = include or ()
+    exclude = exclude or ()
+    exclude_dirs = {os.path.realpath(path) for path in exclude_dirs}
+    stack = [(root, '')]
+    while stack:
+        directory, prefix = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError as e:
+            logging.error(f"Could not scan {directory}: {e}")
+            continue
+
+        subdirectories = []
+        for entry in entries:
+            rel_path = prefix + entry.name
+            try:
+                if entry.is_dir():
+                    if recursive and not _matches(rel_path, exclude) \
+                            and os.path.realpath(entry.path) not in exclude_dirs:
+                        subdirectories.append((entry.path, rel_path + '/'))
+                    continue
+                if not accepts(rel_path, extensions, include, exclude) or not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError as e:
+                logging.error(f"Could not read {entry.path}: {e}")
+                continue
+            yield ScanEntry(entry.path, rel_path, stat.st_size, stat.st_mtime_ns)
+        # Pushed in reverse so subdirectories are visited in name order.
+        stack.extend(reversed(subdirectories))
+
+
+def count_images(root, **scan_options):
+    return sum(1 for _ in scan_images(root, **scan_options))
+
+
+class BackgroundCounter(threading.Thread):
+    # Counts matching files next to the conversion so the first files don't wait for the total.
+    def __init__(self, root, **scan_options):
+        super().__init__(daemon=True)
+        self.root = root
+        self.scan_options = scan_options
+        self.total = None
+
+    def run(self):
+        try:
+            self.total = count_images(self.root, **self.scan_options)
+        except Exception as e:
+            logging.exception(e)
@@ -0,0 +1,529 @@
+import os
+import json
+import uuid
+import time
+import asyncio
+import logging
+import itertools
+from collections import OrderedDict
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from engine import (ImageConverter, ConversionOptions, iter_convert_images, render_data, write_outputs,
+                    format_result, resolve_workers)
+from scanner import ScanEntry
+
+DEFAULT_PORT = 8765
+MAX_BODY = 256 * 1024 * 1024
+MAX_FINISHED_JOBS = 1000
+# Progress events kept per job: a window while it runs, and only the tail once it has finished.
+MAX_EVENTS = 1000
+FINISHED_EVENTS = 100
+OUTPUT_TTL = 3600  # seconds an upload's encoded outputs stay downloadable
+# ConversionOptions arguments a client may set. Server-wide limits (memory budget, strip
+# threshold) and anything that runs with the server's privileges stay under the operator's control.
+CLIENT_OPTIONS = ('width', 'height', 'workers', 'max_in_flight', 'draft', 'incremental', 'manifest_path',
+                  'verify_hash', 'resume', 'recursive', 'mirror', 'extensions', 'include', 'exclude', 'widths',
+                  'formats', 'quality', 'method', 'lossless', 'keep_metadata', 'target_bytes', 'min_ssim',
+                  'min_psnr', 'max_encodes', 'read_ahead', 'io_threads', 'write_queue', 'dedup')
+MAX_IO_THREADS = 8
+FINISHED = ('done', 'failed', 'cancelled')
+CONTENT_TYPES = {'webp': 'image/webp', 'avif': 'image/avif', 'jpeg': 'image/jpeg', 'png': 'image/png',
+                 'png-alpha': 'image/png'}
+REASONS = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found',
+           405: 'Method Not Allowed', 409: 'Conflict', 410: 'Gone', 411: 'Length Required', 413: 'Payload Too Large',
+           500: 'Internal Server Error'}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def summarize(result):
+    # What a client needs about one file; never the encoded bytes.
+    summary = {key: result.get(key) for key in ('rel_path', 'file', 'status', 'old_size', 'new_size', 'error',
+                                                'duplicate_of')}
+    summary['outputs'] = [{key: output[key] for key in ('path', 'format', 'size', 'bytes', 'quality')}
+                          for output in result.get('outputs', ())]
+    summary['message'] = format_result(result)
+    return summary
+
+
+class Job:
+    # Lives on the event loop thread; conversion threads report back through call_soon_threadsafe.
+    def __init__(self, kind, priority, spec, options):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.priority = priority
+        self.spec = spec
+        self.options = options
+        self.status = 'queued'
+        self.created = time.time()
+        self.started = self.finished = None
+        self.processed = 0
+        self.total = None
+        self.counts = {}
+        self.error = None
+        self.outputs = []  # (format, bytes) of upload outputs kept for download
+        self.outputs_expired = False
+        self.converter = None
+        # events[0] has sequence number first_seq; older ones have been dropped.
+        self.events = []
+        self.first_seq = 0
+        self._updated = asyncio.Event()
+
+    @property
+    def done(self):
+        return self.status in FINISHED
+
+    def publish(self, event, **fields):
+        self.events.append({'seq': self.first_seq + len(self.events), 'event': event, 'job': self.id, **fields})
+        if len(self.events) > 2 * MAX_EVENTS:
+            self.trim_events(MAX_EVENTS)
+        # Wake every waiting stream, then start a fresh event for the next update.
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    def add_result(self, processed, total, result):
+        self.processed = processed
+        self.total = total
+        self.counts[result['status']] = self.counts.get(result['status'], 0) + 1
+        self.publish('file', processed=processed, total=total, result=result)
+
+    def trim_events(self, keep):
+        drop = len(self.events) - keep
+        if drop > 0:
+            del self.events[:drop]
+            self.first_seq += drop
+
+    def expire_outputs(self):
+        self.outputs = []
+        self.outputs_expired = True
+
+    async def stream(self, start=0):
+        index = start
+        while True:
+            updated = self._updated
+            if index < self.first_seq:
+                # A slow or late reader skips what has already been dropped, and is told so.
+                yield {'event': 'gap', 'job': self.id, 'from': index, 'to': self.first_seq}
+                index = self.first_seq
+            if index - self.first_seq < len(self.events):
+                yield self.events[index - self.first_seq]
+                index += 1
+                continue
+            if self.done:
+                return
+            await updated.wait()
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'priority': self.priority,
+            'status': self.status,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+            'processed': self.processed,
+            'total': self.total,
+            'counts': self.counts,
+            'error': self.error,
+            'outputs': len(self.outputs),
+        }
+
+
+class JobService:
+    # Jobs wait in two priority queues: 'batch' for directory and file-list jobs, each of which
+    # drives a full pipeline with its own workers, and 'upload' for single in-memory images.
+    # Each queue has its own number of dispatchers, which is its concurrency limit. Higher
+    # priority runs first, and ties run in submission order.
+    def __init__(self, workers=0, max_jobs=1, max_uploads=None, allowed_root=None):
+        self.workers = resolve_workers(workers)
+        self.max_jobs = max(1, max_jobs)
+        self.max_uploads = max(1, max_uploads or os.cpu_count() or 1)
+        self.allowed_root = os.path.realpath(allowed_root) if allowed_root else None
+        self.jobs = OrderedDict()
+        self.sequence = itertools.count()
+        self.queues = {}
+        self.dispatchers = []
+        self.process_pool = ProcessPoolExecutor(max_workers=self.max_uploads)
+        self.thread_pool = ThreadPoolExecutor(max_workers=self.max_jobs + self.max_uploads)
+
+    async def start(self):
+        for name, count in (('batch', self.max_jobs), ('upload', self.max_uploads)):
+            self.queues[name] = asyncio.PriorityQueue()
+            self.dispatchers.extend(asyncio.create_task(self._dispatch(self.queues[name])) for _ in range(count))
+
+    async def close(self):
+        for job in self.jobs.values():
+            if job.status == 'queued':
+                self._finish(job, 'cancelled')
+            elif job.converter is not None:
+                job.converter.stop_event.set()
+        for task in self.dispatchers:
+            task.cancel()
+        await asyncio.gather(*self.dispatchers, return_exceptions=True)
+        # Running batch jobs stop after their current files.
+        await asyncio.get_running_loop().run_in_executor(None, self.thread_pool.shutdown)
+        self.process_pool.shutdown(cancel_futures=True)
+
+    def _check_path(self, path, name):
+        if not isinstance(path, str) or not path:
+            raise HTTPError(400, f"{name} is required.")
+        if self.allowed_root is not None:
+            real = os.path.realpath(path)
+            if real != self.allowed_root and not real.startswith(self.allowed_root + os.sep):
+                raise HTTPError(403, f"{name} is outside the served directory.")
+        return path
+
+    def _options(self, options):
+        if options is None:
+            options = {}
+        if not isinstance(options, dict):
+            raise HTTPError(400, "options must be a JSON object.")
+        unknown = sorted(set(options) - set(CLIENT_OPTIONS))
+        if unknown:
+            raise HTTPError(400, f"Options not accepted: {', '.join(unknown)}.")
+        options = dict(options)
+        if options.get('manifest_path') not in (None, False):
+            self._check_path(options['manifest_path'], 'manifest_path')
+        # Concurrency is clamped to what the server was started with, never raised by a client.
+        workers = self._limit(options, 'workers', self.workers) or self.workers
+        options['workers'] = workers
+        max_in_flight = self._limit(options, 'max_in_flight', workers * 2) or workers * 2
+        self._limit(options, 'read_ahead', max(4, max_in_flight * 2))
+        self._limit(options, 'write_queue', max_in_flight)
+        self._limit(options, 'io_threads', MAX_IO_THREADS)
+        options['batch_mode'] = True
+        try:
+            return ConversionOptions(**options)
+        except (TypeError, ValueError) as e:
+            raise HTTPError(400, f"Invalid options: {e}")
+
+    @staticmethod
+    def _limit(options, name, high):
+        value = options.get(name)
+        if value is None:
+            return None
+        if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+            raise HTTPError(400, f"{name} must be a non-negative integer.")
+        if not value:
+            # 0 means "the default", which is derived from the already clamped values.
+            del options[name]
+            return None
+        options[name] = min(value, high)
+        return options[name]
+
+    def _parse_priority(self, value):
+        try:
+            return int(value or 0)
+        except (TypeError, ValueError):
+            raise HTTPError(400, "priority must be an integer.")
+
+    def submit(self, spec):
+        if 'files' in spec:
+            kind = 'files'
+            if not isinstance(spec['files'], list) or not spec['files']:
+                raise HTTPError(400, "files must be a non-empty list of paths.")
+            for path in spec['files']:
+                self._check_path(path, 'files')
+            if spec.get('input_dir'):
+                self._check_path(spec['input_dir'], 'input_dir')
+        else:
+            kind = 'directory'
+            self._check_path(spec.get('input_dir'), 'input_dir')
+        self._check_path(spec.get('output_dir'), 'output_dir')
+        job = Job(kind, self._parse_priority(spec.get('priority')), spec, self._options(spec.get('options')))
+        return self._enqueue(job, 'batch')
+
+    def submit_upload(self, data, name, priority=None, output_dir=None, options=None):
+        if not data:
+            raise HTTPError(400, "The request body must contain the image.")
+        if output_dir is not None:
+            self._check_path(output_dir, 'output_dir')
+        name = os.path.basename(name or 'upload.jpg')
+        spec = {'name': name, 'output_dir': output_dir, 'data': data}
+        job = Job('upload', self._parse_priority(priority), spec, self._options(options))
+        return self._enqueue(job, 'upload')
+
+    def _enqueue(self, job, queue_name):
+        self.jobs[job.id] = job
+        self.queues[queue_name].put_nowait((-job.priority, next(self.sequence), job))
+        job.publish('queued', priority=job.priority)
+        return job
+
+    def cancel(self, job):
+        if job.status == 'queued':
+            # Left in the queue; the dispatcher skips finished jobs.
+            self._finish(job, 'cancelled')
+        elif job.status == 'running' and job.converter is not None:
+            job.converter.stop_event.set()
+        elif job.status == 'running':
+            raise HTTPError(409, "Upload jobs cannot be cancelled once running.")
+
+    async def _dispatch(self, queue):
+        while True:
+            _, _, job = await queue.get()
+            if job.done:
+                continue
+            job.status = 'running'
+            job.started = time.time()
+            job.publish('started')
+            try:
+                if job.kind == 'upload':
+                    await self._run_upload(job)
+                else:
+                    await self._run_batch(job)
+            except asyncio.CancelledError:
+                self._finish(job, 'cancelled')
+                raise
+            except Exception as e:
+                logging.exception(e)
+                job.error = str(e)
+                self._finish(job, 'failed')
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished = time.time()
+        job.spec.pop('data', None)
+        job.publish(status, counts=job.counts, error=job.error)
+        # The final event carries the counts; per-file history beyond the tail is not kept.
+        job.trim_events(FINISHED_EVENTS)
+        self._evict()
+
+    def _evict(self):
+        # Expire old upload outputs and forget the oldest finished jobs, so a long-running
+        # service doesn't grow without bound.
+        now = time.time()
+        finished = [job for job in self.jobs.values() if job.done]
+        for job in finished:
+            if job.outputs and now - job.finished > OUTPUT_TTL:
+                job.expire_outputs()
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            job.expire_outputs()
+            del self.jobs[job.id]
+
+    async def _run_batch(self, job):
+        loop = asyncio.get_running_loop()
+        job.converter = converter = ImageConverter({})
+        spec = job.spec
+
+        def entries():
+            if job.kind != 'files':
+                return None
+            base = spec.get('input_dir') or os.path.commonpath([os.path.dirname(path) for path in spec['files']])
+            found = []
+            for path in spec['files']:
+                try:
+                    stat = os.stat(path)
+                    size, mtime_ns = stat.st_size, stat.st_mtime_ns
+                except OSError:
+                    size = mtime_ns = 0  # reported as an error when it is read
+                rel_path = os.path.relpath(path, base).replace(os.sep, '/')
+                if rel_path.startswith('../'):
+                    # Not below input_dir: written straight into output_dir.
+                    rel_path = os.path.basename(path)
+                found.append(ScanEntry(path, rel_path, size, mtime_ns))
+            return found
+
+        def work():
+            converter.is_converting.set()
+            try:
+                input_dir = spec.get('input_dir') or ''
+                for processed, total, result in iter_convert_images(converter, input_dir, spec['output_dir'],
+                                                                    job.options, entries=entries()):
+                    loop.call_soon_threadsafe(job.add_result, processed, total, summarize(result))
+            finally:
+                converter.is_converting.clear()
+
+        await loop.run_in_executor(self.thread_pool, work)
+        self._finish(job, 'cancelled' if converter.stop_event.is_set() else 'done')
+
+    async def _run_upload(self, job):
+        loop = asyncio.get_running_loop()
+        spec = job.spec
+        output_dir = spec['output_dir']
+        output_base = os.path.join(output_dir or '', os.path.splitext(spec['name'])[0])
+        # Hashing, decoding and encoding are CPU-bound: run them in worker processes, never on the loop.
+        # Popped so a finished job does not keep the upload's bytes alive.
+        result = await loop.run_in_executor(self.process_pool, render_data, spec.pop('data'), spec['name'],
+                                            output_base, job.options)
+        if result['status'] == 'converted':
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+                result = await loop.run_in_executor(self.thread_pool, write_outputs, result)
+            else:
+                job.outputs = [(output['format'], data)
+                               for output, (_, data) in zip(result['outputs'], result.pop('encoded'))]
+        job.add_result(1, 1, summarize(result))
+        self._finish(job, 'done' if result['status'] == 'converted' else 'failed')
+
+    def get(self, job_id):
+        self._evict()
+        job = self.jobs.get(job_id)
+        if job is None:
+            raise HTTPError(404, f"No job {job_id}.")
+        return job
+
+    def health(self):
+        statuses = [job.status for job in self.jobs.values()]
+        return {'status': 'ok', 'queued': statuses.count('queued'), 'running': statuses.count('running'),
+                'jobs': len(statuses)}
+
+
+async def read_request(reader):
+    request_line = await reader.readline()
+    if not request_line:
+        raise ConnectionError("client closed the connection")
+    try:
+        method, target, _ = request_line.decode('latin-1').split()
+    except ValueError:
+        raise HTTPError(400, "Malformed request line.")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if 'chunked' in headers.get('transfer-encoding', '').lower():
+        raise HTTPError(411, "Send a Content-Length instead of a chunked body.")
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HTTPError(400, "Invalid Content-Length.")
+    if length > MAX_BODY:
+        raise HTTPError(413, f"Bodies are limited to {MAX_BODY} bytes.")
+    body = await reader.readexactly(length) if length else b''
+    return method.upper(), target, headers, body
+
+
+async def send_response(writer, status, body, content_type='application/json'):
+    if isinstance(body, (dict, list)):
+        body = json.dumps(body).encode()
+    writer.write(f'HTTP/1.1 {status} {REASONS.get(status, "")}\r\nContent-Type: {content_type}\r\n'
+                 f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body)
+    await writer.drain()
+
+
+async def send_stream(writer, events):
+    # Newline-delimited JSON over chunked encoding, one chunk per event, until the job ends.
+    writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n'
+                 b'Transfer-Encoding: chunked\r\nConnection: close\r\n\r\n')
+    async for event in events:
+        line = json.dumps(event).encode() + b'\n'
+        writer.write(f'{len(line):x}\r\n'.encode() + line + b'\r\n')
+        await writer.drain()
+    writer.write(b'0\r\n\r\n')
+    await writer.drain()
+
+
+class JobServer:
+    # A deliberately small HTTP/1.1 front end: one request per connection, JSON in and out.
+    #   POST   /jobs                  {"input_dir", "output_dir"} or {"files": [...], "output_dir"},
+    #                                 plus optional "priority" and "options" (ConversionOptions arguments)
+    #   POST   /jobs/upload?name=&output_dir=&priority=&options=   raw image bytes as the body
+    #   GET    /jobs, /jobs/<id>, /health
+    #   GET    /jobs/<id>/events?from=N   progress as newline-delimited JSON until the job finishes
+    #   GET    /jobs/<id>/outputs/<n>     encoded bytes of an upload converted without output_dir
+    #   DELETE /jobs/<id>                 cancel
+    def __init__(self, service):
+        self.service = service
+
+    async def handle(self, reader, writer):
+        try:
+            try:
+                method, target, headers, body = await read_request(reader)
+                await self.route(writer, method, target, body)
+            except HTTPError as e:
+                await send_response(writer, e.status, {'error': e.message})
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            except Exception as e:
+                logging.exception(e)
+                await send_response(writer, 500, {'error': str(e)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def route(self, writer, method, target, body):
+        url = urlsplit(target)
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split('/') if part]
+        service = self.service
+
+        if parts == ['health'] and method == 'GET':
+            return await send_response(writer, 200, service.health())
+        if parts == ['jobs'] and method == 'GET':
+            return await send_response(writer, 200, [job.to_dict() for job in service.jobs.values()])
+        if parts == ['jobs'] and method == 'POST':
+            try:
+                spec = json.loads(body or b'{}')
+            except ValueError:
+                raise HTTPError(400, "The body must be a JSON object.")
+            if not isinstance(spec, dict):
+                raise HTTPError(400, "The body must be a JSON object.")
+            return await send_response(writer, 202, service.submit(spec).to_dict())
+        if parts == ['jobs', 'upload'] and method == 'POST':
+            try:
+                options = json.loads(query['options']) if 'options' in query else None
+            except ValueError:
+                raise HTTPError(400, "options must be a JSON object.")
+            job = service.submit_upload(body, query.get('name'), query.get('priority'), query.get('output_dir'),
+                                        options)
+            return await send_response(writer, 202, job.to_dict())
+        if len(parts) >= 2 and parts[0] == 'jobs':
+            job = service.get(parts[1])
+            if len(parts) == 2 and method == 'GET':
+                return await send_response(writer, 200, job.to_dict())
+            if len(parts) == 2 and method == 'DELETE':
+                service.cancel(job)
+                return await send_response(writer, 200, job.to_dict())
+            if parts[2:] == ['events'] and method == 'GET':
+                try:
+                    start = int(query.get('from', 0))
+                except ValueError:
+                    raise HTTPError(400, "from must be an integer.")
+                return await send_stream(writer, job.stream(start))
+            if len(parts) == 4 and parts[2] == 'outputs' and method == 'GET':
+                if job.outputs_expired:
+                    raise HTTPError(410, f"Outputs are kept for {OUTPUT_TTL} seconds after a job finishes.")
+                try:
+                    output_format, data = job.outputs[int(parts[3])]
+                except (ValueError, IndexError):
+                    raise HTTPError(404, "No such output.")
+                return await send_response(writer, 200, data, CONTENT_TYPES[output_format])
+        raise HTTPError(404 if method in ('GET', 'POST', 'DELETE') else 405, f"No route for {method} {url.path}.")
+
+
+async def serve(service, host='127.0.0.1', port=DEFAULT_PORT, unix_path=None, stop_event=None, on_ready=None):
+    # Runs until stop_event (an asyncio.Event) is set.
+    stop_event = stop_event or asyncio.Event()
+    server_handler = JobServer(service).handle
+    await service.start()
+    if unix_path:
+        server = await asyncio.start_unix_server(server_handler, path=unix_path)
+    else:
+        server = await asyncio.start_server(server_handler, host, port)
+    try:
+        if on_ready is not None:
+            on_ready(server)
+        await stop_event.wait()
+    finally:
+        server.close()
+        # Finishing the jobs first also ends any open event streams, which wait_closed() waits for.
+        await service.close()
+        await server.wait_closed()
+        if unix_path:
+            try:
+                os.remove(unix_path)
+            except OSError:
+                pass
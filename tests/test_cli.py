@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+
+from cli import build_options, build_parser
+from engine import ImageConverter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG = {'encoder': {'quality': 90, 'method': 6, 'lossless': True, 'keep_metadata': True}}
+
+
+def options_for(*arguments):
+    args = build_parser().parse_args(['convert', 'in', 'out', *arguments])
+    return build_options(args, ImageConverter(CONFIG))
+
+
+def test_config_supplies_unset_encoder_settings():
+    options = options_for()
+    assert (options.quality, options.method, options.lossless, options.keep_metadata) == (90, 6, True, True)
+
+
+def test_zero_on_the_command_line_is_kept():
+    options = options_for('--quality', '0', '--method', '0')
+    assert (options.quality, options.method) == (0, 0)
+
+
+def test_command_line_overrides_config():
+    options = options_for('--quality', '75', '--formats', 'jpeg', '--widths', '640', '320')
+    assert options.quality == 75
+    assert options.formats == ['jpeg']
+    assert options.widths == [640, 320]
+
+
+def test_watcher_and_planner_load_with_their_subcommands():
+    # convert runs, and worker processes that re-import the main module, must not pay for them.
+    code = "import sys, cli; print(sorted({'watcher', 'planner', 'service'} & set(sys.modules)))"
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == '[]'
@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+import engine
+
+
+@pytest.fixture
+def config_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(engine, '_config', None)
+    return tmp_path
+
+
+def read(config_dir):
+    return json.loads((config_dir / engine.CONFIG_FILE).read_text())
+
+
+def test_save_keeps_changes_made_since_loading(config_dir):
+    (config_dir / engine.CONFIG_FILE).write_text(json.dumps({'input_dir': 'old', 'encoder': {'quality': 80}}))
+    assert engine.load_config()['input_dir'] == 'old'
+    # Another process, the GUI or a manual edit changes the file afterwards.
+    (config_dir / engine.CONFIG_FILE).write_text(json.dumps({'input_dir': 'new', 'encoder': {'quality': 60}}))
+    engine.save_config({'total_files_converted': 5})
+    assert read(config_dir) == {'input_dir': 'new', 'encoder': {'quality': 60}, 'total_files_converted': 5}
+    assert engine.load_config()['total_files_converted'] == 5
+
+
+def test_save_without_a_config_file(config_dir):
+    engine.save_config({'total_files_converted': 1})
+    assert read(config_dir) == {'total_files_converted': 1}
+    assert not list(config_dir.glob('.*.tmp'))
+
+
+def test_unreadable_config_falls_back_to_the_loaded_copy(config_dir):
+    (config_dir / engine.CONFIG_FILE).write_text(json.dumps({'input_dir': 'in'}))
+    engine.load_config()
+    (config_dir / engine.CONFIG_FILE).write_text('{not json')
+    engine.save_config({'output_dir': 'out'})
+    assert read(config_dir) == {'input_dir': 'in', 'output_dir': 'out'}
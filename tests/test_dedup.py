@@ -0,0 +1,48 @@
+from PIL import Image
+
+from dedup import DedupIndex, NearDuplicateIndex, difference_hash
+
+
+def write(tmp_path, name, data):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return str(path)
+
+
+def test_identical_contents_map_to_the_first_file(tmp_path):
+    index = DedupIndex()
+    first = write(tmp_path, 'a.jpg', b'same bytes')
+    assert index.find('a.jpg', first, 10, b'same bytes') is None
+    assert index.find('b.jpg', write(tmp_path, 'b.jpg', b'same bytes'), 10, b'same bytes') == 'a.jpg'
+    # Same size, different contents.
+    assert index.find('c.jpg', write(tmp_path, 'c.jpg', b'diff bytes'), 10, b'diff bytes') is None
+    assert index.find('d.jpg', write(tmp_path, 'd.jpg', b'diff bytes'), 10, b'diff bytes') == 'c.jpg'
+
+
+def test_forgotten_original_is_not_matched(tmp_path):
+    index = DedupIndex()
+    index.find('a.jpg', write(tmp_path, 'a.jpg', b'same bytes'), 10, b'same bytes')
+    index.forget('a.jpg')
+    assert index.find('b.jpg', write(tmp_path, 'b.jpg', b'same bytes'), 10, b'same bytes') is None
+    assert index.find('c.jpg', write(tmp_path, 'c.jpg', b'same bytes'), 10, b'same bytes') == 'b.jpg'
+
+
+def test_near_duplicates_are_grouped():
+    img = Image.effect_mandelbrot((256, 256), (-2, -1.5, 1, 1.5), 100)
+    resaved = img.resize((128, 128)).resize((256, 256))
+    other = img.transpose(Image.FLIP_LEFT_RIGHT)
+    index = NearDuplicateIndex(4)
+    for key, picture in (('a', img), ('b', resaved), ('c', other)):
+        index.add(key, difference_hash(picture))
+    assert index.groups() == [['a', 'b']]
+
+
+def test_low_detail_hashes_are_skipped():
+    index = NearDuplicateIndex(4)
+    flat = difference_hash(Image.new('RGB', (64, 64), (200, 200, 200)))
+    assert flat == 0
+    for key in ('blank1', 'blank2', 'blank3'):
+        index.add(key, flat)
+    index.add('full', (1 << 64) - 1)
+    assert index.pairs == []
+    assert index.report()['low_detail_skipped'] == 4
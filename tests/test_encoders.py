@@ -0,0 +1,69 @@
+import io
+
+import pytest
+from PIL import Image
+
+import encoders
+from encoders import QUALITY_RANGE, encode_to_bytes, psnr, search_quality, ssim, _blocks, _metric_image
+
+FULL_SEARCH = 7  # binary search steps over QUALITY_RANGE
+
+
+@pytest.fixture(scope='module')
+def image():
+    # A gradient with noise on top, so size and error move smoothly with the quality.
+    gradient = Image.linear_gradient('L').resize((320, 240))
+    noise = Image.effect_noise((320, 240), 30)
+    return Image.merge('RGB', (gradient, noise, Image.blend(gradient, noise, 0.5)))
+
+
+def jpeg_size(img, quality):
+    return len(encode_to_bytes(img, 'jpeg', {'quality': quality}))
+
+
+def test_byte_budget_finds_the_highest_quality_that_fits(image):
+    target = jpeg_size(image, 70)
+    quality, data = search_quality(image, 'jpeg', {}, target_bytes=target, max_encodes=FULL_SEARCH)
+    assert len(data) <= target
+    assert quality >= 70
+    assert quality == QUALITY_RANGE[1] or jpeg_size(image, quality + 1) > target
+
+
+def test_psnr_floor_finds_the_lowest_quality_that_reaches_it(image):
+    reference = _metric_image(image)
+
+    def quality_psnr(quality):
+        data = encode_to_bytes(image, 'jpeg', {'quality': quality})
+        with Image.open(io.BytesIO(data)) as decoded:
+            return psnr(reference, _metric_image(decoded, image.size))
+
+    floor = quality_psnr(60)
+    quality, _ = search_quality(image, 'jpeg', {}, min_psnr=floor, max_encodes=FULL_SEARCH)
+    assert quality_psnr(quality) >= floor
+    assert quality == QUALITY_RANGE[0] or quality_psnr(quality - 1) < floor
+
+
+def test_ssim_floor_is_reached(image):
+    quality, data = search_quality(image, 'jpeg', {}, min_ssim=0.9, max_encodes=FULL_SEARCH)
+    assert data == encode_to_bytes(image, 'jpeg', {'quality': quality})
+    with Image.open(io.BytesIO(data)) as decoded:
+        assert ssim(_blocks(_metric_image(image)), _metric_image(decoded, image.size)) >= 0.9
+
+
+@pytest.mark.parametrize('max_encodes', [1, 3, 6])
+def test_max_encodes_bounds_the_search(image, monkeypatch, max_encodes):
+    calls = []
+
+    def counting_encode(img, name, params):
+        calls.append(params['quality'])
+        return encode_to_bytes(img, name, params)
+
+    monkeypatch.setattr(encoders, 'encode_to_bytes', counting_encode)
+    search_quality(image, 'jpeg', {}, target_bytes=jpeg_size(image, 50), max_encodes=max_encodes)
+    assert len(calls) == max_encodes
+
+
+def test_unreachable_target_returns_the_closest_miss(image):
+    quality, data = search_quality(image, 'jpeg', {}, target_bytes=10, max_encodes=FULL_SEARCH)
+    assert quality == QUALITY_RANGE[0]
+    assert len(data) > 10
@@ -0,0 +1,259 @@
+import io
+import os
+import time
+
+import pytest
+from PIL import Image, ImageChops, ImageOps
+
+import engine
+from dedup import DedupIndex
+from encoders import ORIENTATION_TAG
+from engine import (ConversionOptions, ImageConverter, correct_image_orientation, get_exif_orientation,
+                    get_oriented_size, iter_convert_images, resize_in_strips)
+from scanner import ScanEntry
+
+
+def make_jpeg(path, size=(160, 120), seed=50):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    Image.effect_noise(size, seed).convert('RGB').save(path, quality=90)
+
+
+def scan_entry(input_dir, rel_path):
+    path = os.path.join(input_dir, rel_path)
+    stat = os.stat(path)
+    return ScanEntry(path, rel_path, stat.st_size, stat.st_mtime_ns)
+
+
+def convert(input_dir, output_dir, options, entries=None, **kwargs):
+    converter = ImageConverter({})
+    converter.is_converting.set()
+    return [result for _, _, result in iter_convert_images(converter, input_dir, output_dir, options,
+                                                           entries=entries, **kwargs)]
+
+
+def statuses(results):
+    return {result['rel_path']: result['status'] for result in results}
+
+
+def test_flat_output_collision_is_an_error(tmp_path):
+    input_dir, output_dir = str(tmp_path / 'in'), str(tmp_path / 'out')
+    make_jpeg(os.path.join(input_dir, 'a', 'x.jpg'))
+    make_jpeg(os.path.join(input_dir, 'b', 'x.jpg'), seed=60)
+    options = ConversionOptions(mirror=False)
+    results = convert(input_dir, output_dir, options)
+    assert statuses(results) == {'a/x.jpg': 'converted', 'b/x.jpg': 'error'}
+    error = next(result['error'] for result in results if result['rel_path'] == 'b/x.jpg')
+    assert 'a/x.jpg' in error
+    # The first input keeps its outputs, so a rerun skips it rather than converting both again.
+    results = convert(input_dir, output_dir, options)
+    assert statuses(results) == {'a/x.jpg': 'unchanged', 'b/x.jpg': 'error'}
+
+
+def test_same_stem_in_one_directory_is_an_error(tmp_path):
+    input_dir, output_dir = str(tmp_path / 'in'), str(tmp_path / 'out')
+    make_jpeg(os.path.join(input_dir, 'x.jpg'))
+    Image.effect_noise((160, 120), 70).convert('RGB').save(os.path.join(input_dir, 'x.png'))
+    options = ConversionOptions(extensions=['.jpg', '.png'])
+    results = convert(input_dir, output_dir, options)
+    assert statuses(results) == {'x.jpg': 'converted', 'x.png': 'error'}
+
+
+def test_collision_with_an_earlier_batch_is_an_error(tmp_path):
+    # The watcher converts each batch separately; the manifest remembers who owns an output.
+    input_dir, output_dir = str(tmp_path / 'in'), str(tmp_path / 'out')
+    make_jpeg(os.path.join(input_dir, 'a', 'x.jpg'))
+    make_jpeg(os.path.join(input_dir, 'b', 'x.jpg'), seed=60)
+    options = ConversionOptions(mirror=False)
+    first = convert(input_dir, output_dir, options, [scan_entry(input_dir, 'a/x.jpg')])
+    assert statuses(first) == {'a/x.jpg': 'converted'}
+    second = convert(input_dir, output_dir, options, [scan_entry(input_dir, 'b/x.jpg')])
+    assert statuses(second) == {'b/x.jpg': 'error'}
+    # Once the earlier input is gone, its output name is free again.
+    os.remove(os.path.join(input_dir, 'a', 'x.jpg'))
+    third = convert(input_dir, output_dir, options, [scan_entry(input_dir, 'b/x.jpg')])
+    assert statuses(third) == {'b/x.jpg': 'converted'}
+
+
+def test_output_never_replaces_its_input(tmp_path):
+    input_dir = str(tmp_path)
+    make_jpeg(os.path.join(input_dir, 'p.jpg'), size=(400, 300))
+    before = open(os.path.join(input_dir, 'p.jpg'), 'rb').read()
+    results = convert(input_dir, input_dir, ConversionOptions(formats=['jpeg'], widths=[200]))
+    assert statuses(results) == {'p.jpg': 'error'}
+    assert open(os.path.join(input_dir, 'p.jpg'), 'rb').read() == before
+
+
+def test_linked_duplicate_never_replaces_its_input(tmp_path):
+    # a.png holds the same JPEG bytes as r.jpg: a.png is encoded to a.jpg, and r.jpg's
+    # reused output would be r.jpg itself.
+    input_dir = str(tmp_path)
+    make_jpeg(os.path.join(input_dir, 'r.jpg'))
+    before = open(os.path.join(input_dir, 'r.jpg'), 'rb').read()
+    with open(os.path.join(input_dir, 'a.png'), 'wb') as file:
+        file.write(before)
+    options = ConversionOptions(formats=['jpeg'], extensions=['.jpg', '.png'], dedup='link')
+    results = convert(input_dir, input_dir, options)
+    assert statuses(results) == {'a.png': 'converted', 'r.jpg': 'error'}
+    assert next(result for result in results if result['rel_path'] == 'r.jpg').get('duplicate_of') == 'a.png'
+    assert open(os.path.join(input_dir, 'r.jpg'), 'rb').read() == before
+
+
+def quadrant_image(size=(64, 32)):
+    # Four flat quadrants, so every flip and rotation gives a different picture.
+    width, height = size
+    img = Image.new('RGB', size)
+    for index, color in enumerate([(255, 0, 0), (0, 255, 0), (0, 0, 255), (255, 255, 255)]):
+        left, top = (index % 2) * width // 2, (index // 2) * height // 2
+        img.paste(color, (left, top, left + width // 2, top + height // 2))
+    return img
+
+
+def with_orientation(img, orientation, path=None):
+    exif = Image.Exif()
+    exif[ORIENTATION_TAG] = orientation
+    buffer = path or io.BytesIO()
+    img.save(buffer, 'PNG' if path is None else 'JPEG', exif=exif.tobytes(), quality=95)
+    if path is None:
+        buffer.seek(0)
+        return Image.open(buffer)
+    return None
+
+
+@pytest.mark.parametrize('orientation', range(1, 9))
+def test_orientation_transpose_matches_exif_transpose(orientation):
+    img = with_orientation(quadrant_image(), orientation)
+    assert get_exif_orientation(img) == orientation
+    corrected = correct_image_orientation(img)
+    expected = ImageOps.exif_transpose(img)
+    assert corrected.size == expected.size == get_oriented_size(img)
+    assert list(corrected.convert('RGB').getdata()) == list(expected.convert('RGB').getdata())
+
+
+@pytest.mark.parametrize('orientation', [3, 6, 8])
+def test_converted_output_is_upright(tmp_path, orientation):
+    input_dir, output_dir = str(tmp_path / 'in'), str(tmp_path / 'out')
+    os.makedirs(input_dir)
+    source = quadrant_image((800, 400))
+    with_orientation(source, orientation, os.path.join(input_dir, 'photo.jpg'))
+    results = convert(input_dir, output_dir, ConversionOptions(widths=[100], formats=['png']))
+    assert statuses(results) == {'photo.jpg': 'converted'}
+    with Image.open(os.path.join(output_dir, 'photo.png')) as output:
+        assert output.size == ((100, 200) if orientation in (6, 8) else (100, 50))
+        expected = ImageOps.exif_transpose(with_orientation(source, orientation)).resize(output.size)
+        # Sample each quadrant's centre; JPEG and resampling blur only the edges.
+        width, height = output.size
+        for x, y in ((width // 4, height // 4), (3 * width // 4, height // 4),
+                     (width // 4, 3 * height // 4), (3 * width // 4, 3 * height // 4)):
+            actual = output.convert('RGB').getpixel((x, y))
+            assert all(abs(a - b) < 40 for a, b in zip(actual, expected.convert('RGB').getpixel((x, y))))
+
+
+@pytest.mark.parametrize('source_size, size, strip_bytes', [
+    ((600, 900), (200, 300), 20_000),      # integer scale, many bands
+    ((601, 997), (173, 287), 30_000),      # fractional scale
+    ((400, 300), (400, 300), 50_000),      # no scaling
+    ((300, 500), (150, 250), 10 ** 9),     # a single band
+])
+def test_strip_resize_matches_whole_image_resize(source_size, size, strip_bytes):
+    img = Image.merge('RGB', [Image.effect_noise(source_size, sigma) for sigma in (40, 60, 80)])
+    striped = resize_in_strips(img, size, strip_bytes)
+    whole = img.resize(size, Image.LANCZOS)
+    assert striped.size == whole.size
+    # Seams would show up as whole rows off by far more than rounding.
+    difference = ImageChops.difference(striped, whole)
+    assert max(high for _, high in difference.getextrema()) <= 1
+
+
+def make_copies(input_dir, original, *names):
+    with open(os.path.join(input_dir, original), 'rb') as file:
+        data = file.read()
+    for name in names:
+        with open(os.path.join(input_dir, name), 'wb') as file:
+            file.write(data)
+
+
+def test_duplicates_wait_for_and_link_to_the_original(tmp_path, monkeypatch):
+    input_dir, output_dir = str(tmp_path / 'in'), str(tmp_path / 'out')
+    make_jpeg(os.path.join(input_dir, 'a.jpg'))
+    make_copies(input_dir, 'a.jpg', 'b.jpg', 'c.jpg')
+    make_jpeg(os.path.join(input_dir, 'd.jpg'), seed=90)
+    render_image, link_duplicate = engine.render_image, engine.link_duplicate
+    linked_sources = []
+
+    def slow_render(source, input_path, *args):
+        # Keeps the original computing while its copies are read, so they have to wait.
+        if input_path.endswith('a.jpg'):
+            time.sleep(0.5)
+        return render_image(source, input_path, *args)
+
+    def recording_link(primary, input_path, output_base, source, mode):
+        linked_sources.append(source)
+        return link_duplicate(primary, input_path, output_base, source, mode)
+
+    monkeypatch.setattr(engine, 'render_image', slow_render)
+    monkeypatch.setattr(engine, 'link_duplicate', recording_link)
+    results = convert(input_dir, output_dir, ConversionOptions(dedup='link'))
+    assert statuses(results) == {'a.jpg': 'converted', 'b.jpg': 'duplicate', 'c.jpg': 'duplicate',
+                                 'd.jpg': 'converted'}
+    for name in ('b', 'c'):
+        result = next(result for result in results if result['rel_path'] == f'{name}.jpg')
+        assert result['duplicate_of'] == 'a.jpg'
+        assert os.path.samefile(os.path.join(output_dir, f'{name}.webp'), os.path.join(output_dir, 'a.webp'))
+    # Waiting copies keep their metadata, not their bytes.
+    assert len(linked_sources) == 2 and all('data' not in source for source in linked_sources)
+
+
+def test_copies_of_a_failed_original_convert_on_their_own(tmp_path, monkeypatch):
+    input_dir, output_dir = str(tmp_path / 'in'), str(tmp_path / 'out')
+    make_jpeg(os.path.join(input_dir, 'a.jpg'))
+    make_copies(input_dir, 'a.jpg', 'b.jpg', 'c.jpg')
+    render_image = engine.render_image
+
+    def failing_render(source, input_path, *args):
+        if input_path.endswith('a.jpg'):
+            time.sleep(0.3)
+            raise OSError('simulated failure')
+        return render_image(source, input_path, *args)
+
+    monkeypatch.setattr(engine, 'render_image', failing_render)
+    results = convert(input_dir, output_dir, ConversionOptions(dedup='link'))
+    by_path = {result['rel_path']: result for result in results}
+    assert by_path['a.jpg']['status'] == 'error'
+    # One copy is re-read and becomes the original for the other.
+    assert sorted(by_path[name]['status'] for name in ('b.jpg', 'c.jpg')) == ['converted', 'duplicate']
+    copy = next(result for result in by_path.values() if result['status'] == 'duplicate')
+    assert copy['duplicate_of'] in ('b.jpg', 'c.jpg')
+    assert os.path.exists(os.path.join(output_dir, 'b.webp')) and os.path.exists(os.path.join(output_dir, 'c.webp'))
+    assert not os.path.exists(os.path.join(output_dir, 'a.webp'))
+
+
+def test_shared_dedup_index_links_copies_from_later_batches(tmp_path):
+    # The watcher converts one batch per call and shares one DedupIndex between them.
+    input_dir, output_dir = str(tmp_path / 'in'), str(tmp_path / 'out')
+    make_jpeg(os.path.join(input_dir, 'a.jpg'))
+    options = ConversionOptions(dedup='link')
+    index = DedupIndex()
+
+    def batch(name):
+        results = convert(input_dir, output_dir, options, [scan_entry(input_dir, name)], dedup_index=index)
+        return results[0]
+
+    assert batch('a.jpg')['status'] == 'converted'
+    make_copies(input_dir, 'a.jpg', 'b.jpg')
+    result = batch('b.jpg')
+    assert (result['status'], result['duplicate_of']) == ('duplicate', 'a.jpg')
+    assert os.path.samefile(os.path.join(output_dir, 'b.webp'), os.path.join(output_dir, 'a.webp'))
+
+    # Once the original's outputs are gone, the next copy is encoded and becomes the original.
+    os.remove(os.path.join(output_dir, 'a.webp'))
+    make_copies(input_dir, 'a.jpg', 'c.jpg')
+    assert batch('c.jpg')['status'] == 'converted'
+    make_copies(input_dir, 'a.jpg', 'd.jpg')
+    assert batch('d.jpg')['duplicate_of'] == 'c.jpg'
+
+    # A file that changed since it was indexed no longer stands for its old contents, so a
+    # copy of those is encoded rather than linked to the new outputs.
+    make_jpeg(os.path.join(input_dir, 'c.jpg'), seed=90)
+    assert batch('c.jpg')['status'] == 'converted'
+    make_copies(input_dir, 'a.jpg', 'e.jpg')
+    assert batch('e.jpg')['status'] == 'converted'
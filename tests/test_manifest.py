@@ -0,0 +1,183 @@
+import os
+import sqlite3
+
+import pytest
+
+from engine import ConversionOptions, is_unchanged
+from manifest import ConversionManifest, file_digest
+from scanner import ScanEntry
+
+PARAMS = '{"quality": 80}'
+
+
+@pytest.fixture
+def files(tmp_path):
+    input_path = tmp_path / 'photo.jpg'
+    input_path.write_bytes(b'input bytes')
+    output_path = tmp_path / 'out' / 'photo.webp'
+    output_path.parent.mkdir()
+    output_path.write_bytes(b'output')
+    return input_path, output_path
+
+
+def make_entry(input_path):
+    stat = os.stat(input_path)
+    return ScanEntry(str(input_path), 'photo.jpg', stat.st_size, stat.st_mtime_ns)
+
+
+def record(manifest, entry, output_path, content_hash=None):
+    manifest.record(entry.rel_path, entry.size, entry.mtime_ns, PARAMS, 'out/photo',
+                    [(str(output_path), os.path.getsize(output_path))], content_hash)
+
+
+def is_up_to_date(manifest, entry, params=PARAMS, output_base='out/photo', verify_hash=False):
+    return manifest.is_up_to_date(entry.rel_path, entry.path, entry.size, entry.mtime_ns, params, output_base,
+                                  verify_hash)
+
+
+def test_unchanged_file_is_skipped(tmp_path, files):
+    input_path, output_path = files
+    manifest = ConversionManifest(str(tmp_path / 'manifest.sqlite'))
+    entry = make_entry(input_path)
+    assert not is_up_to_date(manifest, entry)
+    record(manifest, entry, output_path)
+    assert is_up_to_date(manifest, entry)
+    manifest.close()
+
+
+def test_changed_size_params_or_base_is_converted(tmp_path, files):
+    input_path, output_path = files
+    manifest = ConversionManifest(str(tmp_path / 'manifest.sqlite'))
+    entry = make_entry(input_path)
+    record(manifest, entry, output_path)
+    assert not is_up_to_date(manifest, entry._replace(size=entry.size + 1))
+    assert not is_up_to_date(manifest, entry, params='{"quality": 60}')
+    assert not is_up_to_date(manifest, entry, output_base='elsewhere/photo')
+    manifest.close()
+
+
+def test_missing_or_altered_output_is_converted(tmp_path, files):
+    input_path, output_path = files
+    manifest = ConversionManifest(str(tmp_path / 'manifest.sqlite'))
+    entry = make_entry(input_path)
+    record(manifest, entry, output_path)
+    output_path.write_bytes(b'truncated output')
+    assert not is_up_to_date(manifest, entry)
+    output_path.unlink()
+    assert not is_up_to_date(manifest, entry)
+    manifest.close()
+
+
+def test_touched_file_needs_verify_hash(tmp_path, files):
+    input_path, output_path = files
+    manifest = ConversionManifest(str(tmp_path / 'manifest.sqlite'))
+    entry = make_entry(input_path)
+    record(manifest, entry, output_path, file_digest(str(input_path)))
+    touched = entry._replace(mtime_ns=entry.mtime_ns + 1)
+    assert not is_up_to_date(manifest, touched)
+    assert is_up_to_date(manifest, touched, verify_hash=True)
+    # The new mtime is recorded, so the next run skips it without hashing.
+    assert manifest.lookup(entry.rel_path)[1] == touched.mtime_ns
+    manifest.close()
+
+
+def test_verify_hash_rejects_different_contents(tmp_path, files):
+    input_path, output_path = files
+    manifest = ConversionManifest(str(tmp_path / 'manifest.sqlite'))
+    entry = make_entry(input_path)
+    record(manifest, entry, output_path, file_digest(str(input_path)))
+    input_path.write_bytes(b'other bytes')
+    assert not is_up_to_date(manifest, make_entry(input_path), verify_hash=True)
+    manifest.close()
+
+
+def test_old_schema_is_dropped(tmp_path, files):
+    input_path, output_path = files
+    path = str(tmp_path / 'manifest.sqlite')
+    manifest = ConversionManifest(path)
+    entry = make_entry(input_path)
+    record(manifest, entry, output_path)
+    manifest.close()
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA user_version = 1')
+    connection.commit()
+    connection.close()
+
+    manifest = ConversionManifest(path)
+    assert not is_up_to_date(manifest, entry)
+    manifest.close()
+
+
+def test_is_unchanged_follows_incremental_and_resume(tmp_path, files):
+    input_path, output_path = files
+    manifest = ConversionManifest(str(tmp_path / 'manifest.sqlite'))
+    entry = make_entry(input_path)
+    record(manifest, entry, output_path)
+    assert is_unchanged(manifest, entry, PARAMS, 'out/photo', ConversionOptions())
+    assert not is_unchanged(manifest, entry, PARAMS, 'out/photo', ConversionOptions(incremental=False))
+    assert is_unchanged(manifest, entry, PARAMS, 'out/photo', ConversionOptions(incremental=False, resume=True))
+    assert not is_unchanged(None, entry, PARAMS, 'out/photo', ConversionOptions())
+    manifest.close()
+
+
+def test_read_only_manifest_writes_nothing(tmp_path, files):
+    input_path, output_path = files
+    path = str(tmp_path / 'manifest.sqlite')
+    manifest = ConversionManifest(path)
+    entry = make_entry(input_path)
+    record(manifest, entry, output_path, file_digest(str(input_path)))
+    manifest.close()
+    before = os.path.getmtime(path), os.path.getsize(path)
+
+    read_only = ConversionManifest(path, read_only=True)
+    touched = entry._replace(mtime_ns=entry.mtime_ns + 1)
+    assert is_up_to_date(read_only, touched, verify_hash=True)
+    assert read_only.lookup(entry.rel_path)[1] == entry.mtime_ns
+    read_only.close()
+    assert (os.path.getmtime(path), os.path.getsize(path)) == before
+    assert not os.path.exists(path + '-wal') and not os.path.exists(path + '-shm')
+
+
+def test_read_only_manifest_ignores_old_schema(tmp_path, files):
+    input_path, output_path = files
+    path = str(tmp_path / 'manifest.sqlite')
+    manifest = ConversionManifest(path)
+    entry = make_entry(input_path)
+    record(manifest, entry, output_path)
+    manifest.close()
+    connection = sqlite3.connect(path)
+    connection.execute('PRAGMA user_version = 1')
+    connection.commit()
+    connection.close()
+
+    read_only = ConversionManifest(path, read_only=True)
+    assert not is_up_to_date(read_only, entry)
+    read_only.close()
+    connection = sqlite3.connect(path)
+    assert connection.execute('PRAGMA user_version').fetchone()[0] == 1
+    connection.close()
+
+
+def test_read_only_path_with_special_characters(tmp_path, files):
+    input_path, output_path = files
+    directory = tmp_path / 'a #dir? 100%'
+    directory.mkdir()
+    path = str(directory / 'manifest.sqlite')
+    manifest = ConversionManifest(path)
+    entry = make_entry(input_path)
+    record(manifest, entry, output_path)
+    manifest.close()
+    read_only = ConversionManifest(path, read_only=True)
+    assert is_up_to_date(read_only, entry)
+    read_only.close()
+
+
+def test_dhash_round_trips(tmp_path, files):
+    input_path, output_path = files
+    manifest = ConversionManifest(str(tmp_path / 'manifest.sqlite'))
+    entry = make_entry(input_path)
+    record(manifest, entry, output_path)
+    assert manifest.lookup_dhash(entry.rel_path) is None
+    manifest.set_dhash(entry.rel_path, 0xfedcba9876543210)
+    assert manifest.lookup_dhash(entry.rel_path) == 0xfedcba9876543210
+    manifest.close()
@@ -0,0 +1,30 @@
+from metrics import RunMetrics
+
+
+def result(seconds, status='converted'):
+    return {'status': status, 'old_size': 100, 'new_size': 40,
+            'timings': {'read': seconds, 'encode': seconds, 'compute': seconds, 'write': seconds}}
+
+
+def prometheus_value(text, name):
+    return next(float(line.rsplit(' ', 1)[1]) for line in text.splitlines() if line.startswith(name + ' '))
+
+
+def test_bounded_samples_keep_running_totals():
+    metrics = RunMetrics({'read': 1, 'compute': 1, 'write': 1}, max_samples=10)
+    for _ in range(25):
+        metrics.add(result(1.0))
+    assert len(metrics.latencies['encode']) == 10
+    text = metrics.to_prometheus()
+    assert prometheus_value(text, 'img_convert_stage_seconds_count{stage="encode"}') == 25
+    assert prometheus_value(text, 'img_convert_stage_seconds_sum{stage="encode"}') == 25.0
+    assert prometheus_value(text, 'img_convert_stage_seconds_sum{stage="total"}') == 75.0
+    assert prometheus_value(text, 'img_convert_files_total{status="converted"}') == 25
+    assert prometheus_value(text, 'img_convert_input_bytes_total') == 2500
+
+
+def test_percentiles_follow_the_recent_samples():
+    metrics = RunMetrics({'read': 1, 'compute': 1, 'write': 1}, max_samples=10)
+    for seconds in [10.0] * 10 + [1.0] * 10:
+        metrics.add(result(seconds))
+    assert metrics.summary()['latency_s']['encode']['max'] == 1.0
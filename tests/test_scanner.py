@@ -0,0 +1,60 @@
+import os
+
+from scanner import accepts, accepts_directory, count_images, normalize_extensions, scan_images
+
+
+def touch(root, rel_path):
+    path = os.path.join(root, *rel_path.split('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+
+def rel_paths(root, **options):
+    return [entry.rel_path for entry in scan_images(str(root), **options)]
+
+
+def test_walk_is_recursive_sorted_and_case_insensitive(tmp_path):
+    for rel_path in ('b.jpg', 'A.JPG', 'notes.txt', 'sub/c.jpeg', 'sub/deeper/d.jpg', 'zz/e.jpg'):
+        touch(tmp_path, rel_path)
+    assert rel_paths(tmp_path) == ['A.JPG', 'b.jpg', 'sub/c.jpeg', 'sub/deeper/d.jpg', 'zz/e.jpg']
+    assert rel_paths(tmp_path, recursive=False) == ['A.JPG', 'b.jpg']
+    assert count_images(str(tmp_path)) == 5
+
+
+def test_extensions_are_normalized(tmp_path):
+    for rel_path in ('a.jpg', 'b.png', 'c.PNG', 'd.webp'):
+        touch(tmp_path, rel_path)
+    assert normalize_extensions(['png', '.WEBP']) == ('.png', '.webp')
+    assert rel_paths(tmp_path, extensions=['png']) == ['b.png', 'c.PNG']
+
+
+def test_include_and_exclude_match_paths_and_names(tmp_path):
+    for rel_path in ('keep.jpg', 'skip_me.jpg', 'raw/a.jpg', 'raw/thumbs/b.jpg', 'edited/c.jpg'):
+        touch(tmp_path, rel_path)
+    assert rel_paths(tmp_path, exclude=['skip_*']) == ['keep.jpg', 'edited/c.jpg', 'raw/a.jpg', 'raw/thumbs/b.jpg']
+    # An excluded directory is not descended into at all.
+    assert rel_paths(tmp_path, exclude=['raw/thumbs']) == ['keep.jpg', 'skip_me.jpg', 'edited/c.jpg', 'raw/a.jpg']
+    assert rel_paths(tmp_path, include=['raw/*']) == ['raw/a.jpg', 'raw/thumbs/b.jpg']
+    assert rel_paths(tmp_path, include=['raw/*'], exclude=['b.jpg']) == ['raw/a.jpg']
+
+
+def test_output_directory_inside_the_input_is_skipped(tmp_path):
+    touch(tmp_path, 'a.jpg')
+    touch(tmp_path, 'out/a.jpg')
+    assert rel_paths(tmp_path, exclude_dirs=[str(tmp_path / 'out')]) == ['a.jpg']
+
+
+def test_accepts_matches_the_scan_filter():
+    extensions = normalize_extensions(None)
+    assert accepts('a/b.JPEG', extensions)
+    assert not accepts('a/b.png', extensions)
+    assert not accepts('a/b.jpg', extensions, include=['c/*'])
+    assert not accepts('a/skip.jpg', extensions, exclude=['skip*'])
+
+
+def test_accepts_directory_checks_every_ancestor():
+    assert accepts_directory('')
+    assert accepts_directory('raw/2024', exclude=['thumbs'])
+    assert not accepts_directory('raw/thumbs/small', exclude=['thumbs'])
+    assert not accepts_directory('raw/thumbs', exclude=['raw/thumbs'])
+    assert not accepts_directory('raw/2024', exclude=['raw'])
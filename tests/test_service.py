@@ -0,0 +1,84 @@
+import pytest
+
+from service import HTTPError, JobService, MAX_IO_THREADS
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = JobService(workers=2, allowed_root=str(tmp_path))
+    yield service
+    service.process_pool.shutdown()
+    service.thread_pool.shutdown()
+
+
+def test_defaults_follow_server_workers(service):
+    options = service._options(None)
+    assert options.workers == 2
+    assert options.max_in_flight == 4
+    assert options.batch_mode
+
+
+def test_unknown_options_are_rejected(service):
+    with pytest.raises(HTTPError) as error:
+        service._options({'quality': 80, 'batch_mode': False, 'allow_all': True})
+    assert error.value.status == 400
+    assert 'allow_all' in error.value.message and 'batch_mode' in error.value.message
+
+
+def test_options_must_be_an_object(service):
+    with pytest.raises(HTTPError) as error:
+        service._options(['workers', 2])
+    assert error.value.status == 400
+
+
+def test_concurrency_is_clamped(service):
+    options = service._options({'workers': 64, 'max_in_flight': 1000, 'read_ahead': 10 ** 6,
+                                'write_queue': 500, 'io_threads': 100})
+    assert options.workers == 2
+    assert options.max_in_flight == 4
+    assert options.read_ahead == 8
+    assert options.write_queue == 4
+    assert options.io_threads == MAX_IO_THREADS
+
+
+def test_lower_concurrency_is_kept(service):
+    options = service._options({'workers': 1, 'io_threads': 2})
+    assert options.workers == 1
+    assert options.max_in_flight == 2
+    assert options.io_threads == 2
+
+
+@pytest.mark.parametrize('value', [-1, 1.5, '4', True])
+def test_invalid_concurrency_is_rejected(service, value):
+    with pytest.raises(HTTPError) as error:
+        service._options({'workers': value})
+    assert error.value.status == 400
+
+
+def test_manifest_path_must_be_inside_root(service, tmp_path):
+    inside = str(tmp_path / 'manifest.sqlite')
+    assert service._options({'manifest_path': inside}).manifest_path == inside
+    assert service._options({'manifest_path': False}).manifest_path is False
+    with pytest.raises(HTTPError) as error:
+        service._options({'manifest_path': str(tmp_path.parent / 'manifest.sqlite')})
+    assert error.value.status == 403
+
+
+def test_invalid_values_are_reported(service):
+    with pytest.raises(HTTPError) as error:
+        service._options({'formats': ['bmp-xl']})
+    assert error.value.status == 400
+
+
+@pytest.mark.parametrize('options', [{'target_bytes': 'abc'}, {'target_bytes': 0}, {'min_ssim': 2},
+                                     {'min_ssim': 'high'}, {'min_psnr': -5}, {'min_psnr': [40]}])
+def test_quality_targets_are_validated(service, options):
+    with pytest.raises(HTTPError) as error:
+        service._options(options)
+    assert error.value.status == 400
+
+
+def test_valid_quality_targets_are_kept(service):
+    assert service._options({'target_bytes': 50000}).target_bytes == 50000
+    assert service._options({'min_ssim': 0.95}).min_ssim == 0.95
+    assert service._options({'min_psnr': 38}).min_psnr == 38.0
@@ -0,0 +1,277 @@
+import os
+import time
+import queue
+import logging
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+from engine import ConversionOptions, iter_convert_images, get_scan_options, make_compute_pool, open_manifest
+from dedup import DedupIndex
+from metrics import RunMetrics, percentile
+from scanner import ScanEntry, accepts, accepts_directory
+
+try:
+    # inotify on Linux, FSEvents on macOS, ReadDirectoryChangesW on Windows; optional.
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = FileSystemEventHandler = None
+
+SETTLE_TIME = 2.0  # seconds a file's size and mtime must stay unchanged
+LATENCY_TARGET = 5.0  # seconds from a file appearing to its outputs being written
+BATCH_SIZE = 64
+POLL_INTERVAL = 1.0
+# Rewriting a file in place does not touch its directory's mtime; a periodic full listing catches it.
+FULL_SCAN_INTERVAL = 60.0
+# Memory must not grow with uptime: percentiles come from the most recent samples, while the
+# counters keep running totals.
+LATENCY_SAMPLES = 10000
+
+
+class PollingSource:
+    # Stats every known directory each poll and lists only those whose mtime changed, so an idle
+    # tree costs one stat per directory rather than one per file. Within a changed directory only
+    # new or modified files are reported.
+    def __init__(self, root, scan_options):
+        self.root = root
+        self.scan_options = scan_options
+        self.exclude_dirs = {os.path.realpath(path) for path in scan_options['exclude_dirs']}
+        self.directories = {}
+        self.files = {}
+        self._list(root)
+        self.last_full_scan = time.monotonic()
+
+    def _list(self, directory):
+        # Returns the image paths directly in directory and registers its subdirectories.
+        found = []
+        try:
+            self.directories[directory] = os.stat(directory).st_mtime_ns
+            with os.scandir(directory) as it:
+                entries = list(it)
+        except OSError:
+            self.directories.pop(directory, None)
+            return found
+        for entry in entries:
+            try:
+                if entry.is_dir():
+                    if self.scan_options['recursive'] and entry.path not in self.directories \
+                            and os.path.realpath(entry.path) not in self.exclude_dirs \
+                            and accepts_directory(_rel_path(self.root, entry.path), self.scan_options['exclude']):
+                        found.extend(self._list(entry.path))
+                elif entry.is_file():
+                    stat = entry.stat()
+                    if self.files.get(entry.path) != (stat.st_size, stat.st_mtime_ns):
+                        self.files[entry.path] = (stat.st_size, stat.st_mtime_ns)
+                        found.append(entry.path)
+            except OSError:
+                continue
+        return found
+
+    def changes(self):
+        changed = []
+        full_scan = time.monotonic() - self.last_full_scan >= FULL_SCAN_INTERVAL
+        if full_scan:
+            self.last_full_scan = time.monotonic()
+        for directory, mtime_ns in list(self.directories.items()):
+            try:
+                current = os.stat(directory).st_mtime_ns
+            except OSError:
+                # Removed; forget it and everything below it.
+                for known in [known for known in self.directories if known == directory
+                              or known.startswith(directory + os.sep)]:
+                    del self.directories[known]
+                for known in [known for known in self.files if known.startswith(directory + os.sep)]:
+                    del self.files[known]
+                continue
+            if current != mtime_ns or full_scan:
+                changed.extend(self._list(directory))
+        return changed
+
+    def close(self):
+        pass
+
+
+class _EventHandler(FileSystemEventHandler or object):
+    # Only events that can mean new contents; opening a file to convert it must not queue it again.
+    EVENT_TYPES = ('created', 'modified', 'moved', 'closed')
+
+    def __init__(self, paths):
+        self.paths = paths
+
+    def on_any_event(self, event):
+        if not event.is_directory and event.event_type in self.EVENT_TYPES:
+            self.paths.put(getattr(event, 'dest_path', None) or event.src_path)
+
+
+class WatchdogSource:
+    def __init__(self, root, scan_options):
+        self.paths = queue.Queue()
+        self.observer = Observer()
+        self.observer.schedule(_EventHandler(self.paths), root, recursive=scan_options['recursive'])
+        self.observer.start()
+
+    def changes(self):
+        changed = []
+        while True:
+            try:
+                changed.append(self.paths.get_nowait())
+            except queue.Empty:
+                return changed
+
+    def close(self):
+        self.observer.stop()
+        self.observer.join()
+
+
+def _rel_path(root, path):
+    return os.path.relpath(path, root).replace(os.sep, '/')
+
+
+class FolderWatcher:
+    # Long-running conversion of new files under input_dir. Candidates are debounced until their
+    # size and mtime have been stable for settle_time, then handed to the engine in batches: as
+    # soon as batch_size files are ready, or once the oldest ready file has waited long enough
+    # that converting later would miss the latency target. Runs until converter.stop_event is set.
+    def __init__(self, converter, input_dir, output_dir, options=None, settle_time=SETTLE_TIME,
+                 latency=LATENCY_TARGET, batch_size=BATCH_SIZE, poll_interval=POLL_INTERVAL,
+                 use_polling=False, on_result=None, on_batch=None):
+        self.converter = converter
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.options = options or ConversionOptions()
+        self.settle_time = settle_time
+        self.latency = latency
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.use_polling = use_polling or Observer is None
+        self.on_result = on_result
+        # Called after each batch, e.g. to persist totals once per batch rather than per file.
+        self.on_batch = on_batch
+        self.scan_options = get_scan_options(self.options, output_dir)
+        self.output_root = os.path.realpath(output_dir)
+        self.pending = {}  # path -> (size, mtime_ns, first_seen, last_change)
+        self.ready = {}  # path -> (ScanEntry, first_seen)
+        self.metrics = RunMetrics({'read': self.options.io_threads, 'compute': self.options.workers, 'write': 1},
+                                  max_samples=LATENCY_SAMPLES)
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.latency_count = self.over_target = 0
+        # One pipeline for the life of the watcher rather than one per batch; opened in run().
+        self.manifest = None
+        self.compute_pool = None
+        # Shared by every batch, so a file identical to one converted earlier is linked, not encoded.
+        self.dedup_index = DedupIndex() if self.options.dedup else None
+
+    def _candidate(self, path):
+        rel_path = _rel_path(self.input_dir, path)
+        if rel_path.startswith('../') or os.path.realpath(path).startswith(self.output_root + os.sep):
+            return None
+        rel_dir = rel_path.rpartition('/')[0]
+        if rel_dir and not self.scan_options['recursive']:
+            return None
+        if not accepts(rel_path, self.scan_options['extensions'], self.scan_options['include'],
+                       self.scan_options['exclude']) or not accepts_directory(rel_dir, self.scan_options['exclude']):
+            return None
+        return rel_path
+
+    def _notice(self, paths, now):
+        for path in paths:
+            if path not in self.pending and path not in self.ready and self._candidate(path) is not None:
+                self.pending[path] = (None, None, now, now)
+
+    def _settle(self, now):
+        # A file still being uploaded keeps changing size or mtime; wait until it stops.
+        for path, (size, mtime_ns, first_seen, last_change) in list(self.pending.items()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                self.pending[path] = (stat.st_size, stat.st_mtime_ns, first_seen, now)
+            elif stat.st_size and now - last_change >= self.settle_time:
+                del self.pending[path]
+                entry = ScanEntry(path, self._candidate(path), stat.st_size, stat.st_mtime_ns)
+                self.ready[path] = (entry, first_seen)
+
+    def _due(self, now):
+        if not self.ready:
+            return False
+        if len(self.ready) >= self.batch_size:
+            return True
+        # Leave half of what remains of the latency budget for the conversion itself.
+        oldest = min(first_seen for _, first_seen in self.ready.values())
+        return now - oldest >= self.settle_time + max(0.0, self.latency - self.settle_time) / 2
+
+    def _convert(self, entries=None, first_seen=None):
+        first_seen = first_seen or {}
+        try:
+            self._convert_batch(entries, first_seen)
+        except BrokenProcessPool as e:
+            # A worker died (e.g. killed for memory). Start a fresh pool and go over the batch
+            # once more; the manifest skips whatever was already written.
+            logging.error(f"Worker pool failed, restarting it: {e}")
+            self.compute_pool.shutdown(wait=False, cancel_futures=True)
+            self.compute_pool = make_compute_pool(self.options)
+            self._convert_batch(entries, first_seen)
+        if self.manifest is not None:
+            self.manifest.commit()
+        if self.on_batch is not None:
+            self.on_batch()
+
+    def _convert_batch(self, entries, first_seen):
+        for _, _, result in iter_convert_images(self.converter, self.input_dir, self.output_dir, self.options,
+                                                entries=entries, manifest=self.manifest,
+                                                compute_pool=self.compute_pool, dedup_index=self.dedup_index):
+            self.metrics.add(result)
+            # Files from the catch-up pass have no arrival time.
+            if result['status'] in ('converted', 'duplicate') and result['input_path'] in first_seen:
+                latency = time.monotonic() - first_seen[result['input_path']]
+                self.latencies.append(latency)
+                self.latency_count += 1
+                if latency > self.latency:
+                    self.over_target += 1
+                    logging.warning(f"{result['rel_path']} took {latency:.1f}s from arrival to output, "
+                                    f"over the {self.latency:.1f}s target.")
+            if self.on_result is not None:
+                self.on_result(result)
+
+    def run(self):
+        stop_event = self.converter.stop_event
+        # Start listening before the catch-up pass so nothing arriving during it is missed.
+        if self.use_polling:
+            source = PollingSource(self.input_dir, self.scan_options)
+        else:
+            source = WatchdogSource(self.input_dir, self.scan_options)
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.manifest = open_manifest(self.output_dir, self.options)
+        self.compute_pool = make_compute_pool(self.options)
+        try:
+            # Files already there are converted once up front; the manifest skips finished ones.
+            self._convert()
+            tick = min(self.poll_interval, self.settle_time / 4 or self.poll_interval)
+            while not stop_event.is_set():
+                now = time.monotonic()
+                self._notice(source.changes(), now)
+                self._settle(now)
+                if self._due(now):
+                    batch = sorted(self.ready.values(), key=lambda item: item[0].rel_path)[:self.batch_size]
+                    for entry, _ in batch:
+                        del self.ready[entry.path]
+                    self._convert([entry for entry, _ in batch], {entry.path: seen for entry, seen in batch})
+                    continue
+                stop_event.wait(tick)
+        finally:
+            source.close()
+            if self.compute_pool is not None:
+                self.compute_pool.shutdown(cancel_futures=True)
+            if self.manifest is not None:
+                self.manifest.close()
+
+    def latency_summary(self):
+        values = sorted(self.latencies)
+        return {
+            'target_s': self.latency,
+            'files': self.latency_count,
+            'p50_s': round(percentile(values, 0.5), 3) if values else None,
+            'p90_s': round(percentile(values, 0.9), 3) if values else None,
+            'over_target': self.over_target,
+        }